@@ -1,16 +1,17 @@
 import os
+import sys
 from logging import DEBUG, INFO, StreamHandler, basicConfig
 from logging.handlers import RotatingFileHandler
+from pathlib import Path
 
 from drova_desktop_keenetic.common.constants import WINDOWS_HOST
 
-assert WINDOWS_HOST in os.environ, "Need windows host in config env"
-
-
 LOG_FORMAT = "[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s"
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 ch = StreamHandler()
-handler_rotating = RotatingFileHandler(f"app.{os.environ[WINDOWS_HOST]}.log", maxBytes=1024 * 1024, backupCount=5)
+handler_rotating = RotatingFileHandler(
+    f"app.{os.environ.get(WINDOWS_HOST) or Path(sys.argv[0]).stem}.log", maxBytes=1024 * 1024, backupCount=5
+)
 
 
 basicConfig(level=INFO, handlers=(handler_rotating, ch), format=LOG_FORMAT, datefmt=DATE_FORMAT)
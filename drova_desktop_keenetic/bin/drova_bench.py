@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from ipaddress import IPv4Address
+from uuid import uuid4
+
+from asyncssh import SSHClientConnection
+from asyncssh import connect as connect_ssh
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.constants import WINDOWS_HOST
+from drova_desktop_keenetic.common.drova import (
+    SessionsEntity,
+    SessionsResponse,
+    StatusEnum,
+    parse_latest_session,
+)
+from drova_desktop_keenetic.common.remote_shell import RemoteShell
+
+SHELL_COMMAND = "ver"
+
+
+def report(name: str, elapsed: list[float]) -> None:
+    ordered = sorted(elapsed)
+    p50 = ordered[len(ordered) // 2]
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{name:<24} total {sum(elapsed):8.3f}s  p50 {p50 * 1000:8.2f}ms  p95 {p95 * 1000:8.2f}ms")
+
+
+async def timed(coro) -> float:
+    started = time.perf_counter()
+    await coro
+    return time.perf_counter() - started
+
+
+async def bench_shell(conn: SSHClientConnection, count: int) -> None:
+    report("ssh.run", [await timed(conn.run(SHELL_COMMAND)) for _ in range(count)])
+
+    shell = RemoteShell(conn)
+    await shell.start()
+    try:
+        report("shell sequential", [await timed(shell.run(SHELL_COMMAND)) for _ in range(count)])
+        started = time.perf_counter()
+        await shell.run_many([SHELL_COMMAND] * count)
+        report("shell pipelined", [(time.perf_counter() - started) / count] * count)
+    finally:
+        await shell.close()
+
+
+def sessions_body(count: int) -> bytes:
+    """Sessions response of server with history of count sessions"""
+    sessions = [
+        SessionsEntity(
+            uuid=uuid4(),
+            product_id=uuid4(),
+            client_id=uuid4(),
+            created_on=datetime.now(),
+            finished_on=datetime.now(),
+            status=StatusEnum.FINISHED,
+            creator_ip=IPv4Address("127.0.0.1"),
+            abort_comment="client disconnected",
+            billing_type="default",
+        )
+        for _ in range(count)
+    ]
+    return json.dumps(SessionsResponse(sessions=sessions).model_dump(mode="json")).encode()
+
+
+def timed_call(call, *args) -> float:
+    started = time.perf_counter()
+    call(*args)
+    return time.perf_counter() - started
+
+
+def bench_parse(count: int, sessions: int) -> None:
+    """Parse cost of sessions response per poll - full model as before, newest session only, unchanged body"""
+    body = sessions_body(sessions)
+    print(f"sessions response {len(body)} bytes, {sessions} sessions")
+
+    def full(body: bytes) -> None:
+        response = SessionsResponse(**json.loads(body))
+        assert response.sessions
+
+    last = hashlib.blake2b(body, digest_size=16).digest()
+
+    def unchanged(body: bytes) -> None:
+        assert hashlib.blake2b(body, digest_size=16).digest() == last
+
+    report("full response", [timed_call(full, body) for _ in range(count)])
+    report("latest session", [timed_call(parse_latest_session, body) for _ in range(count)])
+    report("unchanged body", [timed_call(unchanged, body) for _ in range(count)])
+
+
+async def main(args: argparse.Namespace) -> None:
+    if args.bench == "parse":
+        # local - not need windows host
+        bench_parse(args.count, args.sessions)
+        return
+
+    assert args.env or WINDOWS_HOST in os.environ, "Need windows host in config env"
+    config = Config.from_env_file(args.env) if args.env else Config()
+    async with connect_ssh(
+        host=config.windows_host,
+        username=config.windows_login,
+        password=config.windows_password,
+        known_hosts=None,
+        encoding="windows-1251",
+    ) as conn:
+        match args.bench:
+            case "shell":
+                await bench_shell(conn, args.count)
+
+
+def run_async_main():
+    parser = argparse.ArgumentParser(description="Measure drova desktop operations against real windows host")
+    parser.add_argument("bench", choices=("shell", "parse"))
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=20, help="sessions in response of parse bench")
+    parser.add_argument("--env", help=".env file of host, default - current environment")
+    asyncio.run(main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    run_async_main()
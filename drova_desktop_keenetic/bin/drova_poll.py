@@ -1,7 +1,11 @@
 import asyncio
+import os
 
+from drova_desktop_keenetic.common.constants import WINDOWS_HOST
 from drova_desktop_keenetic.common.drova_poll import DrovaPoll
 
+assert WINDOWS_HOST in os.environ, "Need windows host in config env"
+
 
 def run_async_main():
     asyncio.run(DrovaPoll().serve(True))
@@ -0,0 +1,28 @@
+import asyncio
+import sys
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.drova_proxy import DrovaProxy
+from drova_desktop_keenetic.common.metrics_server import MetricsServer
+
+
+async def main(config: Config):
+    metrics_server = MetricsServer(config.metrics_listen) if config.metrics_listen else None
+    async with DrovaProxy(config):
+        if metrics_server:
+            await metrics_server.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            if metrics_server:
+                await metrics_server.close()
+
+
+def run_async_main():
+    # optional env file of proxy, default - current environment
+    config = Config.from_env_file(sys.argv[1]) if len(sys.argv) > 1 else Config()
+    asyncio.run(main(config))
+
+
+if __name__ == "__main__":
+    run_async_main()
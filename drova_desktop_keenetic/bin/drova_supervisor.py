@@ -0,0 +1,20 @@
+import asyncio
+import os
+import sys
+
+from drova_desktop_keenetic.common.constants import DROVA_HOSTS, METRICS_LISTEN
+from drova_desktop_keenetic.common.drova_supervisor import DrovaSupervisor
+
+
+async def main(locations: list[str]):
+    await DrovaSupervisor.from_env_files(locations, os.getenv(METRICS_LISTEN)).serve()
+
+
+def run_async_main():
+    locations = sys.argv[1:] or [location for location in os.getenv(DROVA_HOSTS, "").split(",") if location]
+    assert locations, f"Need env files of windows hosts in arguments or {DROVA_HOSTS} env"
+    asyncio.run(main(locations))
+
+
+if __name__ == "__main__":
+    run_async_main()
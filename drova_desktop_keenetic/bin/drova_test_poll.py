@@ -1,9 +1,13 @@
 import asyncio
+import os
 
 from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.constants import WINDOWS_HOST
 from drova_desktop_keenetic.common.drova import FakeDrova
 from drova_desktop_keenetic.common.drova_poll import DrovaPoll
 
+assert WINDOWS_HOST in os.environ, "Need windows host in config env"
+
 
 async def main():
     fake_drova = FakeDrova()
@@ -1,8 +1,12 @@
 import asyncio
+import os
 
 from drova_desktop_keenetic.common import ENV_LOCATION
+from drova_desktop_keenetic.common.constants import WINDOWS_HOST
 from drova_desktop_keenetic.common.drova_validate import validate_creds, validate_env
 
+assert WINDOWS_HOST in os.environ, "Need windows host in config env"
+
 
 def main():
     print(ENV_LOCATION)
@@ -0,0 +1,55 @@
+import random
+import time
+
+import aiohttp
+
+
+class CircuitOpen(aiohttp.ClientError):
+    """Api failed many times in a row - not requested until cooldown ends"""
+
+
+class CircuitBreaker:
+    """Stop requests to failing api for jittered cooldown growing with every failed trial
+
+    After failures in a row circuit opens, calls are rejected at once. After cooldown one trial call is let through,
+    success closes circuit, failure opens it again for longer cooldown.
+    """
+
+    def __init__(self, failures: int = 5, cooldown: float = 2, cooldown_max: float = 30):
+        self._failures_max = failures
+        self._cooldown = cooldown
+        self._cooldown_max = cooldown_max
+        self._failures = 0
+        self._opened = 0  # opens since last success
+        self._open_until = 0.0
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened > 0
+
+    def check(self) -> None:
+        """Raise CircuitOpen if call not allowed now"""
+        if not self._opened:
+            return
+        if self._trial or time.monotonic() < self._open_until:
+            raise CircuitOpen(f"circuit open for {max(0.0, self._open_until - time.monotonic()):.1f}s")
+        self._trial = True
+
+    def success(self) -> None:
+        self._failures = 0
+        self._opened = 0
+        self._trial = False
+
+    def abandon(self) -> None:
+        """Call cancelled without answer - next call can be trial"""
+        self._trial = False
+
+    def failure(self) -> None:
+        self._failures += 1
+        if not self._trial and self._failures < self._failures_max:
+            return
+        self._trial = False
+        self._opened += 1
+        delay = min(self._cooldown_max, self._cooldown * 2 ** (self._opened - 1))
+        self._open_until = time.monotonic() + delay / 2 + random.uniform(0, delay / 2)
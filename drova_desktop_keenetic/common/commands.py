@@ -1,10 +1,13 @@
+import csv
+import json
 import os
 import re
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 from enum import StrEnum
 from pathlib import PureWindowsPath
-from typing import Literal
+from typing import ClassVar, Literal
+from uuid import uuid4
 
 from mslex import quote
 
@@ -30,14 +33,83 @@ class ICommandBuilder(ABC):
         return self._build_command()
 
 
+@dataclass
+class CommandResult:
+    returncode: int | None  # None - batch broken before command
+    stdout: str
+    elapsed: float | None = None  # by windows clock, 10ms precision
+
+
+@dataclass
+class CommandBatch(ICommandBuilder):
+    """Many commands as one remote call, exit code and time of every command is echoed after it
+
+    Runs in nested cmd with delayed expansion - !errorlevel! is expanded after command, %errorlevel% on line parse.
+    """
+
+    MARKER: ClassVar[str] = "__drova_batch"
+
+    commands: list[ICommandBuilder | str] = field(default_factory=list)
+
+    def add(self, command: ICommandBuilder | str) -> None:
+        self.commands.append(command)
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def _build_command(self) -> str:
+        parts: list[str] = [f"echo {self.MARKER}_start_0_!time!"]
+        for index, command in enumerate(self.commands):
+            command = str(command)
+            if "!" in command:
+                raise ValueError(f"Delayed expansion break command with '!', run it alone: {command}")
+            # `(call )` resets errorlevel - builtins like rmdir not reset it on success
+            parts.append(f"(call ) & ({command}) & echo {self.MARKER}_{index}_!errorlevel!_!time!")
+        return f'cmd /D /V:ON /S /C "{" & ".join(parts)}"'
+
+    @staticmethod
+    def _seconds(match: re.Match) -> float | None:
+        # %time% is " 9:05:01.25" or "9:05:01,25" - by locale
+        if match["hours"] is None:
+            return None
+        return int(match["hours"]) * 3600 + int(match["minutes"]) * 60 + int(match["seconds"]) + int(match["cs"]) / 100
+
+    def parse(self, stdout: str) -> list[CommandResult]:
+        """Result of every command - stdout split by markers, stderr of batch is not split"""
+        r_marker = re.compile(
+            rf"^(?P<out>.*?){self.MARKER}_(?P<index>\d+|start)_(?P<returncode>-?\d+)"
+            r"(?:_\s*(?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>\d+)[.,](?P<cs>\d+))?\s*$"
+        )
+        results = [CommandResult(returncode=None, stdout="") for _ in self.commands]
+        output: list[str] = []
+        previous: float | None = None
+        for line in stdout.splitlines(keepends=True):
+            match = r_marker.match(line.rstrip("\r\n"))
+            if not match:
+                output.append(line)
+                continue
+            # command output without newline at end - marker on same line
+            output.append(match["out"])
+            at = self._seconds(match)
+            if match["index"] != "start" and int(match["index"]) < len(results):
+                # midnight between commands - clock starts from 0
+                elapsed = (at - previous) % (24 * 60 * 60) if at is not None and previous is not None else None
+                results[int(match["index"])] = CommandResult(
+                    returncode=int(match["returncode"]), stdout="".join(output), elapsed=elapsed
+                )
+            previous = at
+            output = []
+        return results
+
+
 @dataclass
 class PsExec(ICommandBuilder):
     command: ICommandBuilder | str = ""
     interactive: int | None = field(kw_only=True, default=1)
     accepteula: bool = True
     detach: bool = True
-    user: str = os.environ[WINDOWS_LOGIN]
-    password: str = os.environ[WINDOWS_PASSWORD]
+    user: str = os.getenv(WINDOWS_LOGIN, "")
+    password: str = os.getenv(WINDOWS_PASSWORD, "")
     working_directory: PureWindowsPath | None = None
 
     def _build_command(self) -> str:
@@ -81,8 +153,9 @@ class PsExec(ICommandBuilder):
 
 @dataclass
 class TaskKill(ICommandBuilder):
-    image: str
+    image: str | list[str] = ""
     force: bool = True
+    pid: int | None = None
 
     def _build_command(self) -> str:
         command = ["taskkill.exe"]
@@ -90,11 +163,33 @@ class TaskKill(ICommandBuilder):
         if self.force:
             command += ["/f"]
 
-        command += ["/IM", self.image]
+        if self.pid is not None:
+            command += ["/PID", str(self.pid)]
+
+        # many images - one taskkill
+        for image in [self.image] if isinstance(self.image, str) else self.image:
+            if image:
+                command += ["/IM", image]
 
         return " ".join(command)
 
 
+@dataclass
+class TaskList(ICommandBuilder):
+    def _build_command(self) -> str:
+        return "tasklist /FO CSV /NH"
+
+    @staticmethod
+    def parse(output: str) -> list[tuple[str, int]]:
+        """(image, pid) of all processes - csv columns not depend on windows language"""
+        result: list[tuple[str, int]] = []
+        for row in csv.reader(output.splitlines()):
+            if len(row) < 2 or not row[1].isdigit():
+                continue
+            result.append((row[0], int(row[1])))
+        return result
+
+
 @dataclass
 class Steam(ICommandBuilder):
     def _build_command(self) -> str:
@@ -207,6 +302,7 @@ class RegKeyAction(ICommandBuilder):  # pylint: disable=R0903
     pass
 
 
+@dataclass
 class RegDelActionRemoveValue(RegKeyAction):  # pylint: disable=R0903
     value_name: str
 
@@ -233,6 +329,38 @@ class RegDel(ICommandBuilder):
         return " ".join(("reg", "delete", quote(self.key), "/f", str(self.action)))
 
 
+@dataclass
+class RegImport(ICommandBuilder):
+    file: PureWindowsPath
+
+    def _build_command(self):
+        return " ".join(("reg", "import", quote(str(self.file))))
+
+
+@dataclass
+class RegQuery(ICommandBuilder):
+    keys: list[str]
+
+    def _build_command(self):
+        # one remote call for many keys - missing key not break next queries
+        return " & ".join(" ".join(("reg", "query", quote(key))) for key in self.keys)
+
+    @staticmethod
+    def parse(output: str) -> dict[str, dict[str, tuple[str, str]]]:
+        """Parse to {KEY: {value name: (type, data)}} - key and value names in upper case"""
+        r_value = re.compile(r"^\s{2,}(?P<name>.*?)\s{2,}(?P<type>REG_[A-Z_]+)(?:\s{2,}(?P<data>.*))?$")
+        result: dict[str, dict[str, tuple[str, str]]] = {}
+        key: str | None = None
+        for line in output.splitlines():
+            line = line.rstrip()
+            if line.startswith("HKEY_"):
+                key = line.upper()
+                result.setdefault(key, {})
+            elif key is not None and (match := r_value.match(line)):
+                result[key][match["name"].upper()] = (match["type"], match["data"] or "")
+        return result
+
+
 @dataclass
 class RmDir(ICommandBuilder):
     dir: PureWindowsPath
@@ -241,6 +369,53 @@ class RmDir(ICommandBuilder):
         return " ".join(("rmdir", "/S", "/Q", quote(str(self.dir))))
 
 
+TOMBSTONE_MARK = ".drova-tombstone-"
+
+
+@dataclass
+class RmDirFast(ICommandBuilder):
+    """Rename directory to tombstone next to it - constant time for any size, rmdir if rename failed (locked files)"""
+
+    dir: PureWindowsPath
+    tombstone: str
+
+    def _build_command(self):
+        return " ".join(("ren", quote(str(self.dir)), quote(self.tombstone), "||", str(RmDir(dir=self.dir))))
+
+    @staticmethod
+    def tombstone_name(directory: PureWindowsPath) -> str:
+        return f"{directory.name}{TOMBSTONE_MARK}{uuid4().hex[:8]}"
+
+
+@dataclass
+class PurgeTombstones(ICommandBuilder):
+    """Remove all tombstones of directory left by RmDirFast"""
+
+    dir: PureWindowsPath
+
+    def _build_command(self):
+        pattern = self.dir.parent / f"{self.dir.name}{TOMBSTONE_MARK}*"
+        return f'for /D %d in ({quote(str(pattern))}) do rmdir /S /Q "%~d"'
+
+
+@dataclass
+class CertUtilHashFile(ICommandBuilder):
+    file: PureWindowsPath
+    algorithm: Literal["SHA256"] = "SHA256"
+
+    def _build_command(self):
+        return " ".join(("certutil", "-hashfile", quote(str(self.file)), self.algorithm))
+
+    @staticmethod
+    def parse(output: str) -> str | None:
+        # old windows print hash as "ab 12 ..." - remove spaces
+        for line in output.splitlines():
+            line = line.strip().replace(" ", "").lower()
+            if re.fullmatch(r"[0-9a-f]{64}", line):
+                return line
+        return None
+
+
 @dataclass
 class WmicGetLocalDrives(ICommandBuilder):
     def _build_command(self):
@@ -258,12 +433,91 @@ class WmicGetLocalDrives(ICommandBuilder):
         assert realoutput
         result: list[str] = []
         for line in realoutput.split("\n")[1:]:
+            # wmic ends lines by \r\r\n and adds empty line at end
+            line = line.strip()
             if not line:
                 continue
             result.append(line[0])
         return result
 
 
+@dataclass
+class WmicGetDesktopMonitors(ICommandBuilder):
+    def _build_command(self):
+        return "wmic desktopmonitor get pnpdeviceid"
+
+    @staticmethod
+    def parse(output: str) -> list[str]:
+        """PnP device ids like DISPLAY\\DRO00DD\\1&28A6823A&0&UID256"""
+        lines = [line.strip() for line in output.splitlines()[1:]]
+        return [line for line in lines if line]
+
+
+@dataclass
+class CimHostFacts(ICommandBuilder):
+    """Fixed drives and monitors by one powershell CIM query - replacement of deprecated wmic.exe"""
+
+    SCRIPT: ClassVar[str] = (
+        "$drives = (Get-CimInstance Win32_LogicalDisk -Filter 'DriveType=3' "
+        "| ForEach-Object { $_.DeviceID.Substring(0, 1) }) -join ''; "
+        "$monitors = @(Get-CimInstance Win32_DesktopMonitor | ForEach-Object { $_.PNPDeviceID }); "
+        "ConvertTo-Json -Compress @{drives = $drives; monitors = $monitors}"
+    )
+
+    def _build_command(self):
+        return f'powershell -NoProfile -NonInteractive -Command "{self.SCRIPT}"'
+
+    @staticmethod
+    def parse(output: str) -> dict[str, str | list[str]]:
+        try:
+            facts = json.loads(output)
+        except ValueError:
+            return {}
+        result: dict[str, str | list[str]] = {}
+        if facts.get("drives"):
+            result["drives"] = str(facts["drives"])
+        # powershell 5 write one item array as value
+        monitors = facts.get("monitors") or []
+        result["monitors"] = [str(monitor) for monitor in ([monitors] if isinstance(monitors, str) else monitors)]
+        return result
+
+
+@dataclass
+class RegQueryBootId(ICommandBuilder):
+    """Windows counter of boots - changed on every reboot"""
+
+    KEY: ClassVar[str] = r"HKLM\SYSTEM\CurrentControlSet\Control\Session Manager\Memory Management\PrefetchParameters"
+
+    def _build_command(self):
+        return " ".join(("reg", "query", quote(self.KEY), "/v", "BootId"))
+
+    @staticmethod
+    def parse(output: str) -> str | None:
+        for values in RegQuery.parse(output).values():
+            if value := values.get("BOOTID"):
+                return value[1]
+        return None
+
+
+@dataclass
+class IfExist(ICommandBuilder):
+    """Which of paths exist - one call for many paths, marker with index for every found path"""
+
+    paths: list[PureWindowsPath] = field(default_factory=list)
+
+    MARKER: ClassVar[str] = "__drova_exists"
+
+    def _build_command(self):
+        # index instead of path - echo of path with ")" breaks brackets
+        return " & ".join(
+            f"(if exist {quote(str(path))} echo {self.MARKER}_{index})" for index, path in enumerate(self.paths)
+        )
+
+    def parse(self, stdout: str) -> dict[PureWindowsPath, bool]:
+        found = {int(index) for index in re.findall(rf"{self.MARKER}_(\d+)", stdout)}
+        return {path: index in found for index, path in enumerate(self.paths)}
+
+
 @dataclass
 class Shutdown(ICommandBuilder):
     actions: Literal["reboot", "shutdown"]
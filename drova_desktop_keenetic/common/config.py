@@ -1,9 +1,43 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, fields, replace
+from pathlib import Path
+from typing import Any, Mapping
+
+from dotenv import dotenv_values
 
 from drova_desktop_keenetic.common.constants import (
+    DROVA_BREAKER_COOLDOWN,
+    DROVA_BREAKER_FAILURES,
+    DROVA_CACHE_LOCATION,
+    DROVA_CONNECT_TIMEOUT,
+    DROVA_HEDGE,
+    DROVA_PROXY_LISTEN,
+    DROVA_PROXY_RATE,
+    DROVA_PROXY_SESSIONS_TTL,
+    DROVA_READ_TIMEOUT,
+    DROVA_REQUEST_DEADLINE,
     DROVA_SERVICE_HOST,
+    FAST_DELETE,
+    HOST_FACTS_BACKEND,
+    IPATCH_FORCE_REFRESH,
+    IPATCH_MEMORY_LIMIT,
+    METRICS_LISTEN,
     OBS_REMOTE_URL,
+    PATCHER_CONCURRENCY,
+    PATCHERS_PRUNE,
+    POLL_BACKOFF_MAX,
+    POLL_INTERVAL_ACTIVE,
+    POLL_INTERVAL_FAST,
+    POLL_INTERVAL_IDLE,
+    PROCESS_EXIT_TIMEOUT,
+    PRODUCT_CACHE_SIZE,
+    PRODUCT_CACHE_TTL,
+    READY_TIMEOUT,
+    RECONNECT_BACKOFF_MAX,
+    RECONNECT_INTERVAL,
+    REMOTE_SHELL,
+    REMOTE_SHELL_TIMEOUT,
+    SESSION_WARMUP,
     SHADOW_DEFENDER_PASSWORD,
     WINDOWS_HOST,
     WINDOWS_LOGIN,
@@ -11,8 +45,12 @@ from drova_desktop_keenetic.common.constants import (
 )
 
 
+def to_bool(value: str) -> bool:
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
 @dataclass
-class Config:
+class Config:  # pylint: disable=R0902
     windows_host: str = os.getenv(WINDOWS_HOST, "localhost")
     windows_login: str = os.getenv(WINDOWS_LOGIN, "Administrator")
     windows_password: str = os.getenv(WINDOWS_PASSWORD, "VeryStrongPasword")
@@ -22,3 +60,101 @@ class Config:
     obs_remote_url: str | None = os.getenv(OBS_REMOTE_URL)
 
     drova_service_host: str = os.getenv(DROVA_SERVICE_HOST, "https://services.drova.io")
+    drova_connect_timeout: float = float(os.getenv(DROVA_CONNECT_TIMEOUT, "5"))
+    drova_read_timeout: float = float(os.getenv(DROVA_READ_TIMEOUT, "10"))
+    drova_request_deadline: float = float(os.getenv(DROVA_REQUEST_DEADLINE, "15"))
+    drova_hedge: bool = to_bool(os.getenv(DROVA_HEDGE, "0"))
+    drova_breaker_failures: int = int(os.getenv(DROVA_BREAKER_FAILURES, "5"))
+    drova_breaker_cooldown: float = float(os.getenv(DROVA_BREAKER_COOLDOWN, "30"))
+
+    poll_interval_fast: float = float(os.getenv(POLL_INTERVAL_FAST, "0.5"))
+    poll_interval_active: float = float(os.getenv(POLL_INTERVAL_ACTIVE, "5"))
+    poll_interval_idle: float = float(os.getenv(POLL_INTERVAL_IDLE, "2"))
+    poll_backoff_max: float = float(os.getenv(POLL_BACKOFF_MAX, "60"))
+
+    reconnect_interval: float = float(os.getenv(RECONNECT_INTERVAL, "1"))
+    reconnect_backoff_max: float = float(os.getenv(RECONNECT_BACKOFF_MAX, "15"))
+    ready_timeout: float = float(os.getenv(READY_TIMEOUT, "180"))
+
+    patcher_concurrency: int = int(os.getenv(PATCHER_CONCURRENCY, "4"))
+    process_exit_timeout: float = float(os.getenv(PROCESS_EXIT_TIMEOUT, "10"))
+    fast_delete: bool = to_bool(os.getenv(FAST_DELETE, "1"))
+    host_facts_backend: str = os.getenv(HOST_FACTS_BACKEND, "wmic")
+    patchers_prune: bool = to_bool(os.getenv(PATCHERS_PRUNE, "1"))
+    ipatch_memory_limit: int = int(os.getenv(IPATCH_MEMORY_LIMIT, str(1024 * 1024)))
+    ipatch_force_refresh: bool = to_bool(os.getenv(IPATCH_FORCE_REFRESH, "0"))
+    remote_shell: bool = to_bool(os.getenv(REMOTE_SHELL, "1"))
+    remote_shell_timeout: float = float(os.getenv(REMOTE_SHELL_TIMEOUT, "120"))
+    session_warmup: bool = to_bool(os.getenv(SESSION_WARMUP, "1"))
+    metrics_listen: str | None = os.getenv(METRICS_LISTEN)
+
+    cache_location: str | None = os.getenv(DROVA_CACHE_LOCATION)
+    product_cache_ttl: float = float(os.getenv(PRODUCT_CACHE_TTL, str(24 * 60 * 60)))
+    product_cache_size: int = int(os.getenv(PRODUCT_CACHE_SIZE, "256"))
+
+    proxy_listen: str = os.getenv(DROVA_PROXY_LISTEN, "127.0.0.1:7986")
+    proxy_rate: float = float(os.getenv(DROVA_PROXY_RATE, "10"))
+    proxy_sessions_ttl: float = float(os.getenv(DROVA_PROXY_SESSIONS_TTL, "0.5"))
+
+    def cache_file(self, name: str) -> Path | None:
+        if not self.cache_location:
+            return None
+        return Path(self.cache_location) / name
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str | None]) -> "Config":
+        # values not set in env are taken from process defaults
+        defaults = cls()
+        types = {field.name: type(getattr(defaults, field.name)) for field in fields(cls)}
+        values: dict[str, Any] = {}
+        for name, key in _ENV_FIELDS.items():
+            if value := env.get(key):
+                if types[name] is bool:
+                    values[name] = to_bool(value)
+                else:
+                    values[name] = value if types[name] is type(None) else types[name](value)
+        return replace(defaults, **values)
+
+    @classmethod
+    def from_env_file(cls, location: str | os.PathLike) -> "Config":
+        return cls.from_env(dotenv_values(location))
+
+
+_ENV_FIELDS: dict[str, str] = {
+    "windows_host": WINDOWS_HOST,
+    "windows_login": WINDOWS_LOGIN,
+    "windows_password": WINDOWS_PASSWORD,
+    "shadow_defender_password": SHADOW_DEFENDER_PASSWORD,
+    "obs_remote_url": OBS_REMOTE_URL,
+    "drova_service_host": DROVA_SERVICE_HOST,
+    "drova_connect_timeout": DROVA_CONNECT_TIMEOUT,
+    "drova_read_timeout": DROVA_READ_TIMEOUT,
+    "drova_request_deadline": DROVA_REQUEST_DEADLINE,
+    "drova_hedge": DROVA_HEDGE,
+    "drova_breaker_failures": DROVA_BREAKER_FAILURES,
+    "drova_breaker_cooldown": DROVA_BREAKER_COOLDOWN,
+    "poll_interval_fast": POLL_INTERVAL_FAST,
+    "poll_interval_active": POLL_INTERVAL_ACTIVE,
+    "poll_interval_idle": POLL_INTERVAL_IDLE,
+    "poll_backoff_max": POLL_BACKOFF_MAX,
+    "reconnect_interval": RECONNECT_INTERVAL,
+    "reconnect_backoff_max": RECONNECT_BACKOFF_MAX,
+    "ready_timeout": READY_TIMEOUT,
+    "patcher_concurrency": PATCHER_CONCURRENCY,
+    "process_exit_timeout": PROCESS_EXIT_TIMEOUT,
+    "fast_delete": FAST_DELETE,
+    "host_facts_backend": HOST_FACTS_BACKEND,
+    "patchers_prune": PATCHERS_PRUNE,
+    "ipatch_memory_limit": IPATCH_MEMORY_LIMIT,
+    "ipatch_force_refresh": IPATCH_FORCE_REFRESH,
+    "remote_shell": REMOTE_SHELL,
+    "remote_shell_timeout": REMOTE_SHELL_TIMEOUT,
+    "session_warmup": SESSION_WARMUP,
+    "metrics_listen": METRICS_LISTEN,
+    "cache_location": DROVA_CACHE_LOCATION,
+    "product_cache_ttl": PRODUCT_CACHE_TTL,
+    "product_cache_size": PRODUCT_CACHE_SIZE,
+    "proxy_listen": DROVA_PROXY_LISTEN,
+    "proxy_rate": DROVA_PROXY_RATE,
+    "proxy_sessions_ttl": DROVA_PROXY_SESSIONS_TTL,
+}
@@ -6,3 +6,60 @@ SHADOW_DEFENDER_PASSWORD = "SHADOW_DEFENDER_PASSWORD"
 OBS_REMOTE_URL = "OBS_REMOTE_URL"
 
 DROVA_SERVICE_HOST = "DROVA_SERVICE_HOST"
+DROVA_CONNECT_TIMEOUT = "DROVA_CONNECT_TIMEOUT"
+DROVA_READ_TIMEOUT = "DROVA_READ_TIMEOUT"
+# max seconds of whole drova api call, 1 - send second request if first slower than p95 of recent requests
+DROVA_REQUEST_DEADLINE = "DROVA_REQUEST_DEADLINE"
+DROVA_HEDGE = "DROVA_HEDGE"
+# failed drova api calls in a row before calls stopped, max seconds of stop (grows with every failed trial)
+DROVA_BREAKER_FAILURES = "DROVA_BREAKER_FAILURES"
+DROVA_BREAKER_COOLDOWN = "DROVA_BREAKER_COOLDOWN"
+
+# seconds between polls of drova api
+POLL_INTERVAL_FAST = "POLL_INTERVAL_FAST"
+POLL_INTERVAL_ACTIVE = "POLL_INTERVAL_ACTIVE"
+POLL_INTERVAL_IDLE = "POLL_INTERVAL_IDLE"
+POLL_BACKOFF_MAX = "POLL_BACKOFF_MAX"
+
+# wait of windows host after reboot: first probe interval, max interval, max wait of ssh/sftp/esme token
+RECONNECT_INTERVAL = "RECONNECT_INTERVAL"
+RECONNECT_BACKOFF_MAX = "RECONNECT_BACKOFF_MAX"
+READY_TIMEOUT = "READY_TIMEOUT"
+
+# IPatch files up to this size in bytes patched in memory, bigger - through local temp file
+IPATCH_MEMORY_LIMIT = "IPATCH_MEMORY_LIMIT"
+# always patch IPatch files, not skip files found in known clean state
+IPATCH_FORCE_REFRESH = "IPATCH_FORCE_REFRESH"
+
+# how many patchers of same PRIORITY work at once over one ssh connection
+PATCHER_CONCURRENCY = "PATCHER_CONCURRENCY"
+# max seconds to wait exit of killed launcher before continue
+PROCESS_EXIT_TIMEOUT = "PROCESS_EXIT_TIMEOUT"
+# query of host facts (drives, monitors) - wmic or cim (powershell, for windows without wmic)
+HOST_FACTS_BACKEND = "HOST_FACTS_BACKEND"
+# skip patchers of launchers not installed on host (scanned once per boot), 0 - run full set
+PATCHERS_PRUNE = "PATCHERS_PRUNE"
+# rename profile directories to tombstone on session start, remove tombstones later while idle
+FAST_DELETE = "FAST_DELETE"
+# run patcher commands in one persistent cmd.exe per connection instead of new ssh channel per command
+REMOTE_SHELL = "REMOTE_SHELL"
+# max seconds of command in persistent cmd.exe, shell closed after it - commands run over ssh channels
+REMOTE_SHELL_TIMEOUT = "REMOTE_SHELL_TIMEOUT"
+# host:port of prometheus /metrics endpoint, not set - endpoint disabled
+METRICS_LISTEN = "METRICS_LISTEN"
+# prepare session start work (uploads, prefetch, drives) while host idle
+SESSION_WARMUP = "SESSION_WARMUP"
+
+# local directory for persistent caches, not set - keep caches only in memory
+DROVA_CACHE_LOCATION = "DROVA_CACHE_LOCATION"
+PRODUCT_CACHE_TTL = "PRODUCT_CACHE_TTL"
+PRODUCT_CACHE_SIZE = "PRODUCT_CACHE_SIZE"
+
+# comma separated list of env files (or directories with *.env) for drova_supervisor
+DROVA_HOSTS = "DROVA_HOSTS"
+
+# local drova api proxy shared by pollers of router: listen host:port or unix:/path, upstream requests per second,
+# seconds sessions answer served from cache
+DROVA_PROXY_LISTEN = "DROVA_PROXY_LISTEN"
+DROVA_PROXY_RATE = "DROVA_PROXY_RATE"
+DROVA_PROXY_SESSIONS_TTL = "DROVA_PROXY_SESSIONS_TTL"
@@ -1,16 +1,168 @@
-from dataclasses import dataclass
+import asyncio
+import logging
+import time
+from collections.abc import Iterable
+from contextlib import AbstractContextManager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
 
-from asyncssh import SFTPClient, SSHClientConnection
+from asyncssh import SFTPClient, SSHClientConnection, SSHCompletedProcess
 
+from drova_desktop_keenetic.common.commands import (
+    CommandBatch,
+    CommandResult,
+    ICommandBuilder,
+    TaskKill,
+    TaskList,
+)
 from drova_desktop_keenetic.common.config import Config
 from drova_desktop_keenetic.common.drova import ProductInfo, SessionsEntity
+from drova_desktop_keenetic.common.fingerprint_cache import FingerprintCache
+from drova_desktop_keenetic.common.helpers import to_str
+from drova_desktop_keenetic.common.host_facts import HostFacts
+from drova_desktop_keenetic.common.metrics import REGISTRY
+from drova_desktop_keenetic.common.process_table import ProcessTable
+from drova_desktop_keenetic.common.remote_shell import RemoteShell, RemoteShellClosed
+
+logger = logging.getLogger(__name__)
+
+WARMUP_USED = REGISTRY.counter("drova_warmup_used_total", "Session start steps asked for idle warmup result")
+COMMAND_LATENCY = REGISTRY.histogram("drova_command_seconds", "Remote command latency by patcher and transition")
+SFTP_LATENCY = REGISTRY.histogram("drova_sftp_seconds", "SFTP operation latency by patcher and transition")
+PROCESS_WAIT = REGISTRY.histogram(
+    "drova_process_wait_seconds", "Wait of process exit or start - outcome done or timeout"
+)
+
+# first poll of tasklist while wait process, doubled up to max
+WAIT_POLL_INTERVAL = 0.05
+WAIT_POLL_INTERVAL_MAX = 0.5
+
+# which hook works now - set by session transition, labels of command and sftp metrics
+CURRENT_PATCHER: ContextVar[str] = ContextVar("current_patcher", default="none")
+CURRENT_TRANSITION: ContextVar[str] = ContextVar("current_transition", default="none")
 
 
 @dataclass
-class SessionHandlerContext:
+class SessionHandlerContext:  # pylint: disable=R0902
     config: Config
     ssh: SSHClientConnection | None
     sftp: SFTPClient | None
 
     session: SessionsEntity | None = None
     product: ProductInfo | None = None
+
+    shell: RemoteShell | None = None
+
+    # monotonic time of reboot requested by protector - for turnaround metric
+    rebooted_at: float | None = None
+
+    # known clean states of IPatch files of this host
+    fingerprints: FingerprintCache = field(default_factory=FingerprintCache)
+
+    # drives, monitors of current boot of this host
+    facts: HostFacts = field(default_factory=HostFacts)
+
+    # tasklist snapshot of current transition, None - not taken yet
+    processes: ProcessTable | None = None
+    _processes_lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    # prepared by on_warmup of handlers for current ssh connection, consumed by on_session_start
+    warmup: dict[str, Any] = field(default_factory=dict)
+
+    def take_warm(self, key: str) -> Any | None:
+        value = self.warmup.pop(key, None)
+        WARMUP_USED.inc(step=key, hit=str(int(value is not None)))
+        return value
+
+    async def run(self, command: ICommandBuilder | str, check: bool = False) -> SSHCompletedProcess:
+        """Run command in persistent shell, plain ssh.run if shell not started or broken"""
+        if self.shell and self.shell.is_running:
+            try:
+                with COMMAND_LATENCY.time(**self._labels(channel="shell")):
+                    return await self.shell.run(command, check=check)
+            except RemoteShellClosed:
+                logger.warning(f"Remote shell closed - run over ssh channel: {command}")
+        return await self.run_ssh(command, check=check)
+
+    async def run_batch(self, batch: CommandBatch) -> list[CommandResult]:
+        """Run all commands of batch by one remote call, result of every command"""
+        result = await self.run(batch)
+        return batch.parse(to_str(result.stdout, "windows-1251"))
+
+    async def process_table(self, refresh: bool = False) -> ProcessTable:
+        """One tasklist per transition for all handlers, refresh - take new snapshot"""
+        async with self._processes_lock:
+            if self.processes is None or refresh:
+                result = await self.run(TaskList())
+                processes = TaskList.parse(to_str(result.stdout, "windows-1251"))
+                self.processes = ProcessTable(processes, complete=bool(processes))
+                if not processes:
+                    logger.warning(f"tasklist failed with {result.returncode} - treat all images as running")
+            return self.processes
+
+    async def kill(self, images: list[str]) -> list[str]:
+        """Kill running images by one taskkill, return killed"""
+        if not images:
+            return []
+        table = await self.process_table()
+        running = table.running(images)
+        if running:
+            # forget before kill - handlers running in parallel not kill same image
+            table.discard(running)
+            await self.run(TaskKill(image=running))
+        return running
+
+    async def wait_exit(
+        self, images: Iterable[str] = (), pids: Iterable[int] = (), timeout: float | None = None
+    ) -> float:
+        """Poll tasklist until images and pids gone or timeout, return waited seconds - timeout not raise"""
+        images, pids = list(images), list(pids)
+        timeout = self.config.process_exit_timeout if timeout is None else timeout
+        started = time.monotonic()
+        interval = WAIT_POLL_INTERVAL
+        while True:
+            table = await self.process_table(refresh=True)
+            alive = table.running(images) + [pid for pid in pids if table.has_pid(pid)]
+            waited = time.monotonic() - started
+            # incomplete table not know anything - waiting is useless
+            if not alive or not table.complete or waited >= timeout:
+                break
+            await asyncio.sleep(min(interval, timeout - waited))
+            interval = min(interval * 2, WAIT_POLL_INTERVAL_MAX)
+        outcome = "timeout" if alive and table.complete else "done"
+        PROCESS_WAIT.observe(waited, **self._labels(wait="exit", outcome=outcome))
+        if outcome == "timeout":
+            logger.warning(f"Processes still running after {waited:.1f}s: {alive}")
+        return waited
+
+    async def wait_started(self, image: str, timeout: float) -> list[int]:
+        """Poll tasklist until image is running or timeout, return its pids"""
+        started = time.monotonic()
+        interval = WAIT_POLL_INTERVAL
+        while True:
+            pids = (await self.process_table(refresh=True)).pids(image)
+            waited = time.monotonic() - started
+            if pids or waited >= timeout:
+                break
+            await asyncio.sleep(min(interval, timeout - waited))
+            interval = min(interval * 2, WAIT_POLL_INTERVAL_MAX)
+        PROCESS_WAIT.observe(waited, **self._labels(wait="start", outcome="done" if pids else "timeout"))
+        return pids
+
+    async def run_ssh(self, command: ICommandBuilder | str, check: bool = False) -> SSHCompletedProcess:
+        """Run command in own ssh channel - for commands which must not wait in shell queue"""
+        assert self.ssh
+        with COMMAND_LATENCY.time(**self._labels(channel="ssh")):
+            return await self.ssh.run(str(command), check=check)
+
+    def sftp_timer(self, operation: str) -> AbstractContextManager[None]:
+        return SFTP_LATENCY.time(**self._labels(operation=operation))
+
+    def _labels(self, **labels: str) -> dict[str, str]:
+        return {
+            "host": self.config.windows_host,
+            "patcher": CURRENT_PATCHER.get(),
+            "transition": CURRENT_TRANSITION.get(),
+            **labels,
+        }
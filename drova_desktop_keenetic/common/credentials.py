@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from drova_desktop_keenetic.common.json_file import read_json, write_json
+from drova_desktop_keenetic.common.metrics import REGISTRY
+
+REFRESH_LATENCY = REGISTRY.histogram(
+    "drova_credentials_refresh_seconds", "Query of esme server_id and auth_token, by outcome - ok or error"
+)
+STALE_SERVED = REGISTRY.counter(
+    "drova_credentials_stale_total", "Expired credentials served while background refresh in flight"
+)
+
+
+@dataclass(frozen=True)
+class Credentials:
+    server_id: str
+    auth_token: str
+
+
+class CredentialProvider:  # pylint: disable=R0902
+    """Esme server_id and auth_token of host - refreshed in background before expiry
+
+    Only one refresh at a time - concurrent callers wait same query. While refresh in flight last good pair is
+    served, caller waits refresh only on first get or if pair is much older than ttl.
+
+    Optionally persisted to json file readable only by owner - after restart pair is used at once, queried again
+    only if api rejects token or windows booted again. Persisted pair of known boot is not refreshed by ttl.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(  # pylint: disable=R0913
+        self,
+        fetch: Callable[[], Awaitable[tuple[str, str]]],
+        *,
+        host: str,
+        ttl: float = 60,
+        refresh_ahead: float = 10,
+        max_stale: float = 180,
+        location: str | os.PathLike | None = None,
+    ):
+        self._fetch = fetch
+        self._host = host
+        self._ttl = ttl
+        self._refresh_ahead = refresh_ahead
+        self._max_stale = max_stale
+        self._credentials: Credentials | None = None
+        self._fetched_at = 0.0
+        self._refresh_task: asyncio.Task | None = None
+        self._location = Path(location) if location else None
+        self.boot_id: str | None = None  # boot of host when pair was queried
+        self.persisted = False  # pair loaded from file, not queried by this process
+        self._saved: dict | None = None  # content of file - not rewritten by refresh with same pair
+        self._load()
+
+    @property
+    def persistent(self) -> bool:
+        return self._location is not None
+
+    @property
+    def of_boot(self) -> bool:
+        """Pair of current boot - esme changes token only after reboot, api rejection invalidates it"""
+        return self.persistent and self.boot_id is not None and self._credentials is not None
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self._fetched_at
+
+    async def get(self) -> Credentials:
+        if self.of_boot:
+            assert self._credentials
+            return self._credentials
+        if self._credentials is None or self.age >= self._max_stale:
+            return await self.refresh()
+        if self.age >= self._ttl - self._refresh_ahead:
+            self._start_refresh()
+        if self.age >= self._ttl:
+            STALE_SERVED.inc(host=self._host)
+        return self._credentials
+
+    async def refresh(self) -> Credentials:
+        """Query now, or join query in flight"""
+        # caller cancelled - query still finished for others
+        await asyncio.shield(self._start_refresh())
+        assert self._credentials
+        return self._credentials
+
+    def set(self, credentials: Credentials) -> None:
+        self._credentials = credentials
+        self._fetched_at = time.monotonic()
+        self.persisted = False
+        self._save()
+
+    def invalidate(self) -> None:
+        """Next get waits new query"""
+        self._credentials = None
+        self.persisted = False
+        self._saved = None
+        if self._location:
+            try:
+                self._location.unlink(missing_ok=True)
+            except OSError:
+                self.logger.exception(f"Can't remove credentials {self._location}")
+
+    def on_boot(self, boot_id: str | None) -> bool:
+        """Current boot of host, True if pair can be used - esme can get new token after reboot"""
+        if self._credentials is not None and (boot_id is None or boot_id != self.boot_id):
+            self.logger.info(f"Boot {boot_id} of {self._host} (credentials of {self.boot_id}) - query again")
+            self.invalidate()
+        self.boot_id = boot_id
+        return self._credentials is not None
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+            self._refresh_task.add_done_callback(self._log_failure)
+        return self._refresh_task
+
+    async def _refresh(self) -> None:
+        started = time.perf_counter()
+        try:
+            server_id, auth_token = await self._fetch()
+        except BaseException:
+            REFRESH_LATENCY.observe(time.perf_counter() - started, host=self._host, outcome="error")
+            raise
+        REFRESH_LATENCY.observe(time.perf_counter() - started, host=self._host, outcome="ok")
+        self.set(Credentials(server_id=server_id, auth_token=auth_token))
+
+    def _log_failure(self, task: asyncio.Task) -> None:
+        # background refresh not awaited by anyone - last good pair stays until max_stale
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.warning(f"Credentials refresh failed, age of served {self.age:.0f}s: {task.exception()!r}")
+
+    def _load(self) -> None:
+        if not self._location:
+            return
+        try:
+            content = read_json(self._location)
+            if content is None:
+                return
+            self._saved = dict(content)
+            self.boot_id = content.pop("boot_id")
+            self._credentials = Credentials(**content)
+        except (OSError, ValueError, TypeError, KeyError):
+            self.logger.exception(f"Bad credentials {self._location} - query again")
+            self.boot_id = None
+            self._credentials = None
+            self._saved = None
+            return
+        # age unknown - trusted until api or boot says otherwise, refreshed in background by ttl as queried one
+        self._fetched_at = time.monotonic()
+        self.persisted = True
+
+    def _save(self) -> None:
+        if not self._location or self._credentials is None:
+            return
+        content = {**asdict(self._credentials), "boot_id": self.boot_id}
+        if content == self._saved:
+            return
+        try:
+            write_json(self._location, content, mode=0o600)
+            self._saved = content
+        except OSError:
+            self.logger.exception(f"Can't save credentials {self._location}")
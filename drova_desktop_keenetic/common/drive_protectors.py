@@ -1,13 +1,14 @@
 import logging
+import time
 from enum import Enum
 
-from drova_desktop_keenetic.common.commands import (
-    ShadowDefenderCLI,
-    Shutdown,
-    WmicGetLocalDrives,
-)
+from drova_desktop_keenetic.common.commands import ShadowDefenderCLI, Shutdown
+from drova_desktop_keenetic.common.host_facts import HostFacts
+from drova_desktop_keenetic.common.metrics import REGISTRY
 from drova_desktop_keenetic.common.patch import ISessionHandler, SessionHandlerContext
 
+REBOOTS = REGISTRY.counter("drova_reboots_total", "Reboots requested to exit from shadow mode")
+
 
 class ShadowDefender(ISessionHandler):
     logger = logging.getLogger(__file__)
@@ -15,32 +16,39 @@ class ShadowDefender(ISessionHandler):
     async def on_idle(self, ctx: SessionHandlerContext):
         return None
 
+    async def _detect_drives(self, ctx: SessionHandlerContext) -> str:
+        drives = (await ctx.facts.ensure(ctx)).get(HostFacts.DRIVES)
+        if not drives:
+            self.logger.error("Error on drive getter - using ONLY C")
+            return "C"
+        return drives
+
+    async def on_warmup(self, ctx: SessionHandlerContext):
+        # drives not changed until reboot - session start takes them from facts
+        await ctx.facts.ensure(ctx)
+
     async def on_session_start(self, ctx: SessionHandlerContext):
         assert ctx.ssh
-        detect_drives = WmicGetLocalDrives()
-        drives_result = await ctx.ssh.run(str(detect_drives))
-        drives = "C"
-        if drives_result.returncode != 0:
-            self.logger.error("Error on drive getter - using ONLY C")
-        else:
-            drives = "".join(WmicGetLocalDrives.parse(drives_result.stdout))  # pyright: ignore[reportArgumentType]
+        drives = await self._detect_drives(ctx)
 
         cmd_protect = ShadowDefenderCLI(password=ctx.config.shadow_defender_password, actions=["enter"], drives=drives)
 
-        await ctx.ssh.run(str(cmd_protect))
+        await ctx.run(cmd_protect)
 
         # exit from shadow on next boot
         cmd_unlock_not_now = ShadowDefenderCLI(
             password=ctx.config.shadow_defender_password, actions=["exit"], drives=drives, now=False
         )
-        await ctx.ssh.run(str(cmd_unlock_not_now))
+        await ctx.run(cmd_unlock_not_now)
 
     async def on_session_active(self, ctx: SessionHandlerContext):
         return None
 
     async def on_session_end(self, ctx: SessionHandlerContext):
         assert ctx.ssh
-        await ctx.ssh.run(str(Shutdown(actions="reboot")))
+        REBOOTS.inc(host=ctx.config.windows_host)
+        ctx.rebooted_at = time.monotonic()
+        await ctx.run_ssh(Shutdown(actions="reboot"))
 
 
 class PatcherTypeEnum(Enum):
@@ -1,13 +1,21 @@
+import asyncio
+import hashlib
 import logging
+import time
 from datetime import datetime
 from enum import StrEnum
 from ipaddress import IPv4Address
 from pathlib import PureWindowsPath
+from typing import Any
 from uuid import UUID
 
 import aiohttp
 from aiohttp import web
-from pydantic import UUID4, BaseModel, ConfigDict
+from pydantic import UUID4, BaseModel, ConfigDict, TypeAdapter
+
+from drova_desktop_keenetic.common.circuit_breaker import CircuitBreaker
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.metrics import REGISTRY
 
 SESSION_UUID_FAKE = UUID("e099d33f-51f3-4129-a3a6-b75d75885b45")
 CLIENT_UUID_FAKE = UUID("fefca70b-0af8-463d-82bb-724edc1da927")
@@ -43,6 +51,24 @@ class SessionsResponse(BaseModel):
     sessions: list[SessionsEntity] | None
 
 
+class SessionsHead(BaseModel):
+    """Sessions response without validation of items - only newest session is used"""
+
+    sessions: list[Any] | None
+
+
+SESSIONS_HEAD_ADAPTER = TypeAdapter(SessionsHead)
+SESSION_ADAPTER = TypeAdapter(SessionsEntity)
+
+
+def parse_latest_session(body: bytes) -> SessionsEntity | None:
+    """Newest session of sessions response body, other sessions are not validated"""
+    sessions = SESSIONS_HEAD_ADAPTER.validate_json(body).sessions
+    if not sessions:
+        return None
+    return SESSION_ADAPTER.validate_python(sessions[0])
+
+
 class ProductInfo(BaseModel):
     model_config = ConfigDict(extra="allow")
     product_id: UUID
@@ -53,49 +79,241 @@ class ProductInfo(BaseModel):
     title: str = "Test"
 
 
-class DrovaService:
+class AuthTokenRejected(aiohttp.ClientResponseError):
+    """Drova api not accepted X-Auth-Token - token of esme changed"""
+
+
+HANDSHAKES = REGISTRY.counter("drova_api_handshakes_total", "New TCP/TLS connections opened to drova api")
+REQUEST_LATENCY = REGISTRY.histogram("drova_api_request_seconds", "Drova api request latency, answered requests only")
+CALL_LATENCY = REGISTRY.histogram(
+    "drova_api_call_seconds", "Drova api call latency with hedging and deadline, by outcome - ok or error"
+)
+CALL_P99 = REGISTRY.gauge("drova_api_call_p99_seconds", "p99 of recent successful drova api calls")
+HEDGED = REGISTRY.counter("drova_api_hedged_total", "Second request sent after p95, by winner - primary or hedge")
+CIRCUIT_OPEN = REGISTRY.gauge("drova_api_circuit_open", "1 - drova api failed many times, calls rejected for cooldown")
+UNCHANGED = REGISTRY.counter("drova_api_unchanged_total", "Drova api responses same as previous - not parsed again")
+
+
+class DrovaService:  # pylint: disable=R0902
     logger = logging.getLogger(__file__)
-    URL_SESSIONS = "{host}/session-manager/sessions?"
-    URL_PRODUCT = "{host}/server-manager/product/get/{product_id}"
+    URL_SESSIONS = "/session-manager/sessions?"
+    URL_PRODUCT = "/server-manager/product/get/{product_id}"
+
+    DNS_CACHE_TTL = 300  # seconds
+    KEEPALIVE_TIMEOUT = 60  # seconds - longer than poll interval, connection must be reused
+    STATS_INTERVAL = 60  # seconds between api stats log lines
+
+    UNIX_PREFIX = "unix:"  # host of local drova proxy on unix socket - unix:/run/drova_proxy.sock
 
-    def __init__(self, host: str):
+    HEDGE_MIN_SAMPLES = 20  # p95 not trusted before
+    HEDGE_MIN_DELAY = 0.05  # seconds - not hedge fast local api
+
+    def __init__(  # pylint: disable=R0913
+        self,
+        host: str,
+        connect_timeout: float = 5,
+        read_timeout: float = 10,
+        *,
+        deadline: float = 15,
+        hedge: bool = False,
+        breaker: CircuitBreaker | None = None,
+    ):
         self._host: str = host
+        self._socket_path = host.removeprefix(self.UNIX_PREFIX) if host.startswith(self.UNIX_PREFIX) else None
+        # urls of unix socket need any http host
+        self._base_url = "http://localhost" if self._socket_path else host
+        self._timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self._deadline = deadline
+        self._hedge = hedge
+        self._breaker = breaker or CircuitBreaker()
+        self._session: aiohttp.ClientSession | None = None
+
+        self._stats_at = time.monotonic()
+        self._stats_handshakes = HANDSHAKES.value(api=host)
+        # request: digest of last body, session parsed from it
+        self._last_sessions: dict[tuple[str, str], tuple[bytes, SessionsEntity | None]] = {}
+
+    @classmethod
+    def from_config(cls, config: Config) -> "DrovaService":
+        return cls(
+            host=config.drova_service_host,
+            connect_timeout=config.drova_connect_timeout,
+            read_timeout=config.drova_read_timeout,
+            deadline=config.drova_request_deadline,
+            hedge=config.drova_hedge,
+            breaker=CircuitBreaker(failures=config.drova_breaker_failures, cooldown_max=config.drova_breaker_cooldown),
+        )
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # created lazy - session must be created inside running loop
+        if self._session is None or self._session.closed:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(self._on_connection_create)
+            connector: aiohttp.BaseConnector
+            if self._socket_path:
+                connector = aiohttp.UnixConnector(self._socket_path, keepalive_timeout=self.KEEPALIVE_TIMEOUT)
+            else:
+                connector = aiohttp.TCPConnector(
+                    ttl_dns_cache=self.DNS_CACHE_TTL, keepalive_timeout=self.KEEPALIVE_TIMEOUT
+                )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self._timeout,
+                trace_configs=[trace_config],
+            )
+        return self._session
+
+    async def _on_connection_create(self, *_) -> None:
+        HANDSHAKES.inc(api=self._host)
+
+    def _log_stats(self) -> None:
+        now = time.monotonic()
+        if now - self._stats_at < self.STATS_INTERVAL:
+            return
+        handshakes = HANDSHAKES.value(api=self._host)
+        per_minute = (handshakes - self._stats_handshakes) * 60 / (now - self._stats_at)
+        self._stats_at, self._stats_handshakes = now, handshakes
+
+        for endpoint in ("sessions", "product"):
+            if not REQUEST_LATENCY.count(api=self._host, endpoint=endpoint):
+                continue
+            p50, p95, p99 = (
+                REQUEST_LATENCY.percentile(percent, api=self._host, endpoint=endpoint) or 0.0
+                for percent in (50, 95, 99)
+            )
+            self.logger.info(
+                f"Drova api {endpoint}: {per_minute:.1f} handshakes/min,"
+                f" latency p50={p50 * 1000:.0f}ms p95={p95 * 1000:.0f}ms p99={p99 * 1000:.0f}ms"
+            )
+
+    async def request(self, endpoint: str, path_qs: str, **kwargs) -> tuple[int, bytes]:
+        """Status and raw body of GET to drova api, AuthTokenRejected if token not accepted
+
+        Other not 2xx answers raise ClientResponseError and count as api failure.
+        Whole call limited by deadline, CircuitOpen while api failing.
+        """
+        self._breaker.check()
+        send = self._hedged if self._hedge else self._send
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with asyncio.timeout(self._deadline):
+                result = await send(endpoint, path_qs, **kwargs)
+        except AuthTokenRejected:
+            # api answered - not failing
+            self._breaker.success()
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self._breaker.failure()
+            raise
+        except BaseException:
+            self._breaker.abandon()
+            raise
+        else:
+            outcome = "ok"
+            self._breaker.success()
+        finally:
+            CALL_LATENCY.observe(time.perf_counter() - started, api=self._host, endpoint=endpoint, outcome=outcome)
+            CIRCUIT_OPEN.set(int(self._breaker.is_open), api=self._host)
+
+        p99 = CALL_LATENCY.percentile(99, api=self._host, endpoint=endpoint, outcome="ok")
+        CALL_P99.set(p99 or 0.0, api=self._host, endpoint=endpoint)
+        self._log_stats()
+        return result
+
+    async def _send(self, endpoint: str, path_qs: str, **kwargs) -> tuple[int, bytes]:
+        started = time.perf_counter()
+        async with self._get_session().get(self._base_url + path_qs, **kwargs) as resp:
+            if resp.status in (401, 403):
+                raise AuthTokenRejected(resp.request_info, resp.history, status=resp.status, headers=resp.headers)
+            if not 200 <= resp.status < 300:
+                # error page of api or its balancer - not data
+                raise aiohttp.ClientResponseError(
+                    resp.request_info, resp.history, status=resp.status, message=resp.reason or "", headers=resp.headers
+                )
+            result = resp.status, await resp.read()
+        # cancelled request (lost hedge) not counted - its latency is unknown
+        REQUEST_LATENCY.observe(time.perf_counter() - started, api=self._host, endpoint=endpoint)
+        return result
+
+    def _hedge_delay(self, endpoint: str) -> float | None:
+        if REQUEST_LATENCY.count(api=self._host, endpoint=endpoint) < self.HEDGE_MIN_SAMPLES:
+            return None
+        p95 = REQUEST_LATENCY.percentile(95, api=self._host, endpoint=endpoint) or 0.0
+        return max(self.HEDGE_MIN_DELAY, p95)
+
+    async def _hedged(self, endpoint: str, path_qs: str, **kwargs) -> tuple[int, bytes]:
+        """Request slower than rolling p95 is sent again, first answer wins"""
+        delay = self._hedge_delay(endpoint)
+        primary = asyncio.create_task(self._send(endpoint, path_qs, **kwargs))
+        tasks = {primary}
+        try:
+            done: set[asyncio.Task] = set()
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+            if delay is None or done:
+                return await primary
+
+            tasks.add(asyncio.create_task(self._send(endpoint, path_qs, **kwargs)))
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                answered = [task for task in done if task.exception() is None]
+                # failed one - wait other
+                if answered or not pending:
+                    winner = (answered or list(done))[0]
+                    HEDGED.inc(api=self._host, endpoint=endpoint, winner="primary" if winner is primary else "hedge")
+                    return winner.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _get_body(self, endpoint: str, path_qs: str, **kwargs) -> bytes:
+        _, body = await self.request(endpoint, path_qs, **kwargs)
+        return body
+
+    async def _get_latest_session(self, path_qs: str, server_id: str, auth_token: str) -> SessionsEntity | None:
+        # almost every poll gets same body - parsed only if changed
+        body = await self._get_body(
+            "sessions", path_qs, data={"server_id": server_id}, headers={"X-Auth-Token": auth_token}
+        )
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        last = self._last_sessions.get((path_qs, server_id))
+        if last and last[0] == digest:
+            UNCHANGED.inc(api=self._host, endpoint="sessions")
+            return last[1]
+        session = parse_latest_session(body)
+        self._last_sessions[(path_qs, server_id)] = (digest, session)
+        return session
 
     async def get_latest_session(self, server_id: str, auth_token: str) -> SessionsEntity | None:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                self.URL_SESSIONS.format(host=self._host),
-                data={"server_id": server_id},
-                headers={"X-Auth-Token": auth_token},
-            ) as resp:
-                sessions = SessionsResponse(**await resp.json())
-                if not sessions.sessions:
-                    return None
-                return sessions.sessions[0]
+        return await self._get_latest_session(self.URL_SESSIONS, server_id, auth_token)
 
     async def get_new_session(self, server_id: str, auth_token: str) -> SessionsEntity | None:
         query_params = f"state={StatusEnum.NEW.value}&state={StatusEnum.HANDSHAKE.value}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                self.URL_SESSIONS.format(host=self._host) + query_params,
-                data={"server_id": server_id},
-                headers={"X-Auth-Token": auth_token},
-            ) as resp:
-                sessions = SessionsResponse(**await resp.json())
-                if not sessions.sessions:
-                    return None
-                return sessions.sessions[0]
-
-    async def get_product_info(self, product_id: UUID4, auth_token: str):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                self.URL_PRODUCT.format(host=self._host, product_id=product_id), headers={"X-Auth-Token": auth_token}
-            ) as resp:
-                product_info = ProductInfo(**await resp.json())
-                return product_info
-
-
-class FakeDrova:
+        return await self._get_latest_session(self.URL_SESSIONS + query_params, server_id, auth_token)
+
+    async def get_product_info(self, product_id: UUID4, auth_token: str) -> ProductInfo:
+        body = await self._get_body(
+            "product",
+            self.URL_PRODUCT.format(product_id=product_id),
+            headers={"X-Auth-Token": auth_token},
+        )
+        return ProductInfo.model_validate_json(body)
+
+    async def close(self) -> None:
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self) -> "DrovaService":
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+
+class FakeDrova:  # pylint: disable=R0902
     def __init__(self):
         app = web.Application()
         app.router.add_get("/set_desktop_new", self._set_desktop_new)
@@ -124,6 +342,9 @@ class FakeDrova:
             ]
         )
         self.product = ProductInfo(product_id=PRODUCT_UUID_BG3)
+        self.auth_token: str | None = None  # accepted token, any if not set
+        self.delays: list[float] = []  # seconds before answer of next sessions requests
+        self.errors: list[int] = []  # statuses of next sessions requests answered with error
 
     @property
     def faked_host(self):
@@ -139,13 +360,21 @@ class FakeDrova:
         await self._runner.cleanup()
         self._site = None
 
-    async def _get_session(self, _: web.Request):
+    async def _get_session(self, request: web.Request):
+        if self.auth_token and request.headers.get("X-Auth-Token") != self.auth_token:
+            return web.json_response({"error": "bad token"}, status=401)
+        if self.errors:
+            return web.json_response({"error": "unavailable"}, status=self.errors.pop(0))
+        if self.delays:
+            await asyncio.sleep(self.delays.pop(0))
         if self.session:
             return web.json_response(self.session.model_dump(mode="json"))
 
         return web.json_response({"sessions": []})
 
-    async def _get_product(self, _: web.Request):
+    async def _get_product(self, request: web.Request):
+        if self.auth_token and request.headers.get("X-Auth-Token") != self.auth_token:
+            return web.json_response({"error": "bad token"}, status=401)
         return web.json_response(self.product.model_dump(mode="json"))
 
     async def _set_desktop_new(self, _: web.Request):
@@ -1,18 +1,21 @@
 import asyncio
 import logging
-from typing import OrderedDict
+import time
 
+import aiohttp
 from asyncssh import SSHClientConnection
 from asyncssh import connect as connect_ssh
 from asyncssh.misc import ChannelOpenError
-from expiringdict import ExpiringDict  # type: ignore
+from pydantic import ValidationError
 
 from drova_desktop_keenetic.common.commands import NotFoundAuthCode, RegQueryEsme
 from drova_desktop_keenetic.common.config import Config
 from drova_desktop_keenetic.common.context import SessionHandlerContext
+from drova_desktop_keenetic.common.credentials import CredentialProvider
 from drova_desktop_keenetic.common.drive_protectors import ShadowDefender
 from drova_desktop_keenetic.common.drova import (
     PRODUCT_UUID_DESKTOP,
+    AuthTokenRejected,
     DrovaService,
     ProductInfo,
     SessionsEntity,
@@ -21,84 +24,210 @@ from drova_desktop_keenetic.common.drova import (
 from drova_desktop_keenetic.common.drova_session_transition import (
     DrovaSessionTransition,
 )
+from drova_desktop_keenetic.common.fingerprint_cache import FingerprintCache
 from drova_desktop_keenetic.common.helpers import (
     RebootRequired,
     to_str,
 )
+from drova_desktop_keenetic.common.host_facts import HostFacts
+from drova_desktop_keenetic.common.metrics import REGISTRY
+from drova_desktop_keenetic.common.metrics_server import MetricsServer
+from drova_desktop_keenetic.common.poll_scheduler import PollScheduler
+from drova_desktop_keenetic.common.product_cache import ProductCache
+from drova_desktop_keenetic.common.reconnect import ReconnectManager
+from drova_desktop_keenetic.common.remote_shell import RemoteShell
+from drova_desktop_keenetic.common.transition_journal import TransitionJournal
+
+COLD_START = REGISTRY.histogram(
+    "drova_cold_start_seconds",
+    "Time from service start to first successful poll, by credentials - persisted or queried",
+    buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, float("inf")),
+)
 
 
-class DrovaPoll:
+class DrovaPoll:  # pylint: disable=R0902
     logger = logging.getLogger(__name__)
 
-    def __init__(self, config: Config = Config()):
+    def __init__(
+        self,
+        config: Config = Config(),
+        drova_service: DrovaService | None = None,
+        product_cache: ProductCache | None = None,
+    ):
+        self.logger = self.logger.getChild(config.windows_host)
         self.stop_future = asyncio.get_event_loop().create_future()
 
-        self.dict_store: OrderedDict[str, str] = ExpiringDict(max_len=100, max_age_seconds=60)
-        self._dict_store_lock = asyncio.Lock()
+        self.credentials = CredentialProvider(
+            self._query_tokens,
+            host=config.windows_host,
+            location=config.cache_file(f"credentials_{config.windows_host}.json"),
+        )
+        self._started_at: float | None = None  # until first successful poll
 
-        self.drova_service = DrovaService(host=config.drova_service_host)
-        self.ctx = SessionHandlerContext(config=config, ssh=None, sftp=None)
-        self.drova_transition = DrovaSessionTransition(None, ShadowDefender(config), config)
+        self._own_drova_service = drova_service is None
+        self.drova_service = drova_service or DrovaService.from_config(config)
+        self.product_cache = product_cache or ProductCache(
+            config.cache_file("products.json"), ttl=config.product_cache_ttl, max_len=config.product_cache_size
+        )
+        self.ctx = SessionHandlerContext(
+            config=config,
+            ssh=None,
+            sftp=None,
+            fingerprints=FingerprintCache(config.cache_file(f"fingerprints_{config.windows_host}.json")),
+            facts=HostFacts(
+                config.cache_file(f"facts_{config.windows_host}.json"),
+                backend="cim" if config.host_facts_backend == "cim" else "wmic",
+            ),
+        )
+        self.drova_transition = DrovaSessionTransition(
+            None,
+            ShadowDefender(config),
+            config,
+            journal=TransitionJournal(config.cache_file(f"transition_{config.windows_host}.json")),
+        )
+        self.scheduler = PollScheduler(config)
+        self.reconnect = ReconnectManager(config)
 
     async def get_auth_token(self) -> str:
-        async with self._dict_store_lock:
-            if "auth_token" not in self.dict_store:
-                await self.refresh_actual_tokens()
-            return self.dict_store["auth_token"]
+        return (await self.credentials.get()).auth_token
 
     async def get_server_id(self) -> str:
-        async with self._dict_store_lock:
-            if "server_id" not in self.dict_store:
-                await self.refresh_actual_tokens()
-            return self.dict_store["server_id"]
+        return (await self.credentials.get()).server_id
 
     async def refresh_actual_tokens(self) -> tuple[str, str]:
+        credentials = await self.credentials.refresh()
+        return credentials.server_id, credentials.auth_token
+
+    async def _query_tokens(self) -> tuple[str, str]:
         if not self.ctx.ssh:
             self.logger.error("Bad configuration context")
             raise RebootRequired()
 
-        complete_process = await self.ctx.ssh.run(str(RegQueryEsme()))
+        complete_process = await self.ctx.run_ssh(RegQueryEsme())
         stdout = to_str(complete_process.stdout, "windows-1251")
 
         if complete_process.exit_status or complete_process.returncode:
             raise RebootRequired()
 
         try:
-            self.dict_store["server_id"], self.dict_store["auth_token"] = RegQueryEsme.parse_auth_code(stdout=stdout)
+            return RegQueryEsme.parse_auth_code(stdout=stdout)
         except NotFoundAuthCode as exc:
             raise RebootRequired from exc
-        return self.dict_store["server_id"], self.dict_store["auth_token"]
 
-    async def one_poll(self, conn: SSHClientConnection) -> None:
+    async def get_product_info(self, session: SessionsEntity) -> ProductInfo:
+        # product of session never changed - not need ask while same session
+        if self.ctx.session and self.ctx.product and self.ctx.session.uuid == session.uuid:
+            return self.ctx.product
+
+        product = self.product_cache.get(session.product_id)
+        if product is None:
+            product = await self.drova_service.get_product_info(session.product_id, await self.get_auth_token())
+            self.product_cache.put(session.product_id, product)
+        return product
+
+    async def _start_shell(self, conn: SSHClientConnection) -> None:
+        if self.ctx.shell:
+            # shell of lost connection - forgotten even if close failed
+            shell, self.ctx.shell = self.ctx.shell, None
+            try:
+                await shell.close()
+            except Exception:  # pylint: disable=W0718
+                self.logger.exception("Failed to close remote shell of previous connection")
+        if not self.ctx.config.remote_shell:
+            return
+        shell = RemoteShell(conn, timeout=self.ctx.config.remote_shell_timeout)
+        try:
+            await shell.start()
+            self.ctx.shell = shell
+        except Exception:  # pylint: disable=W0718
+            self.logger.exception("Failed to start remote shell - commands run over ssh channels")
+
+    async def _attach(self, conn: SSHClientConnection) -> bool:
         if self.ctx.ssh != conn:
+            self.ctx.ssh = conn
             self.ctx.sftp = None
-        self.ctx.ssh = conn
+            self.ctx.warmup.clear()
+            await self._start_shell(conn)
         if not self.ctx.sftp:
             try:
                 self.ctx.sftp = await conn.start_sftp_client()
             except Exception:  # pylint: disable=W0718
                 self.logger.exception("Failed to create SFTP client")
-                return
+                return False
+        return True
+
+    async def _wait_ready(self, conn: SSHClientConnection) -> None:
+        """After reconnect windows services start some time - wait sftp and esme token before poll"""
+        self.reconnect.stage("ssh")
+        deadline = self.reconnect.deadline()
+        while not await self._attach(conn):
+            if time.monotonic() > deadline:
+                raise RebootRequired()
+            await self.reconnect.backoff(self.stop_future)
+        self.reconnect.stage("sftp")
+
+        if await self._credentials_of_boot():
+            self.reconnect.ready(self.ctx)
+            return
+        while not self.stop_future.done():
+            try:
+                await self.refresh_actual_tokens()
+                break
+            except RebootRequired:
+                if time.monotonic() > deadline:
+                    raise
+                self.logger.debug("Esme token not found yet - wait")
+                await self.reconnect.backoff(self.stop_future)
+        self.reconnect.ready(self.ctx)
+
+    async def _credentials_of_boot(self) -> bool:
+        """Persisted credentials still valid - host not rebooted since query, not need wait esme"""
+        if not self.credentials.persistent:
+            return False
+        try:
+            boot_id = await self.ctx.facts.boot(self.ctx)
+        except Exception:  # pylint: disable=W0718
+            self.logger.exception("BootId query failed - query credentials")
+            boot_id = None
+        return self.credentials.on_boot(boot_id)
+
+    async def one_poll(self, conn: SSHClientConnection) -> None:
+        if not await self._attach(conn):
+            return
 
         session: SessionsEntity | None = await self.drova_service.get_latest_session(
             await self.get_server_id(), await self.get_auth_token()
         )
         if not session:
             await self.drova_transition.set_status(None, self.ctx)
+            self.drova_transition.warmup(self.ctx)
             return
+        self.scheduler.on_session(session)
 
-        product: ProductInfo = await self.drova_service.get_product_info(
-            session.product_id, await self.get_auth_token()
-        )
+        product: ProductInfo = await self.get_product_info(session)
 
         self.ctx.session = session
         self.ctx.product = product
 
         if product.product_id == PRODUCT_UUID_DESKTOP or product.use_default_desktop:
             await self.drova_transition.set_status(session.status, self.ctx)
+            # latest session of idle host is finished one - warmup after end transition
+            self.drova_transition.warmup(self.ctx)
+
+    def _first_poll(self) -> None:
+        if self._started_at is None:
+            return
+        cold_start = time.monotonic() - self._started_at
+        source = "persisted" if self.credentials.persisted else "queried"
+        COLD_START.observe(cold_start, host=self.ctx.config.windows_host, credentials=source)
+        self.logger.info(f"First poll {cold_start:.1f}s after start, credentials {source}")
+        self._started_at = None
 
     async def polling(self) -> None:
+        self._started_at = time.monotonic()
         while not self.stop_future.done():
+            if not await self.reconnect.wait_reachable(self.stop_future):
+                break
             try:
                 async with connect_ssh(
                     host=self.ctx.config.windows_host,
@@ -111,9 +240,23 @@ class DrovaPoll:
                     connect_timeout=10,
                 ) as conn:
                     try:
+                        await self._wait_ready(conn)
+                        await asyncio.wait((self.stop_future,), timeout=self.scheduler.phase_offset())
                         while not self.stop_future.done():
-                            await self.one_poll(conn)
-                            await asyncio.sleep(1)
+                            try:
+                                await self.one_poll(conn)
+                                delay = self.scheduler.on_success(self.drova_transition.state)
+                                self._first_poll()
+                            except AuthTokenRejected:
+                                self.credentials.invalidate()
+                                delay = self.scheduler.on_error()
+                                self.logger.warning(
+                                    f"Auth token rejected by drova api - query again after {delay:.1f}s"
+                                )
+                            except (aiohttp.ClientError, asyncio.TimeoutError, ValidationError):
+                                delay = self.scheduler.on_error()
+                                self.logger.exception(f"Drova api request failed - next poll after {delay:.1f}s")
+                            await asyncio.wait((self.stop_future,), timeout=delay)
                     except RebootRequired:
                         self.logger.info("Reboot required received!")
                         # simply finished/aborted not start reboot - need active->finished
@@ -125,14 +268,36 @@ class DrovaPoll:
 
             except (ChannelOpenError, OSError):
                 self.logger.info("Fail connect to windows - gaming or unavailable(reboot)")
+                await self.reconnect.backoff(self.stop_future)
             except Exception:  # pylint: disable=W0718
                 self.logger.exception("We have error")
+                await self.reconnect.backoff(self.stop_future)
+            self.reconnect.connection_lost()
 
     async def stop(self) -> None:
-        self.stop_future.set_result(True)
+        if not self.stop_future.done():
+            self.stop_future.set_result(True)
+
+    async def _polling_and_close(self) -> None:
+        metrics_server = MetricsServer(self.ctx.config.metrics_listen) if self.ctx.config.metrics_listen else None
+        try:
+            if metrics_server:
+                try:
+                    await metrics_server.start()
+                except OSError:
+                    # port taken (same env of other host) - host polled without metrics
+                    self.logger.exception(f"Metrics not served on {self.ctx.config.metrics_listen}")
+            await self.polling()
+        finally:
+            if self.ctx.shell:
+                await self.ctx.shell.close()
+            if self._own_drova_service:
+                await self.drova_service.close()
+            if metrics_server:
+                await metrics_server.close()
 
     async def serve(self, wait_forever: bool = False):
         if wait_forever:
-            await self.polling()
+            await self._polling_and_close()
         else:
-            asyncio.create_task(self.polling())
+            asyncio.create_task(self._polling_and_close())
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import time
+from collections.abc import Callable, Coroutine
+from typing import Any
+from uuid import UUID
+
+import aiohttp
+from aiohttp import web
+from pydantic import ValidationError
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.drova import (
+    AuthTokenRejected,
+    DrovaService,
+    ProductInfo,
+)
+from drova_desktop_keenetic.common.metrics import REGISTRY
+from drova_desktop_keenetic.common.product_cache import ProductCache
+
+PROXY_REQUESTS = REGISTRY.counter(
+    "drova_proxy_requests_total", "Requests of local pollers to proxy by result - cached, joined or upstream"
+)
+PROXY_PACING = REGISTRY.histogram(
+    "drova_proxy_pacing_seconds",
+    "Wait of upstream request for global rate limit",
+    buckets=(0.0, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf")),
+)
+
+Answer = tuple[int, bytes]
+
+
+class RateLimiter:
+    """Paces calls evenly - not more than rate per second for all callers together"""
+
+    def __init__(self, rate: float):
+        self._interval = 1 / rate if rate > 0 else 0.0
+        self._next_at = 0.0
+
+    async def wait(self) -> float:
+        now = time.monotonic()
+        at = max(now, self._next_at)
+        self._next_at = at + self._interval
+        if at > now:
+            await asyncio.sleep(at - now)
+        return at - now
+
+
+class DrovaProxy:  # pylint: disable=R0902
+    """Local cache of drova api for pollers of one router - DrovaService of pollers points to it by drova_service_host
+
+    Same requests in flight are joined into one upstream request, sessions answers are served from cache for short
+    ttl, product info is cached as by poller. Upstream requests of all pollers are paced by global rate limit.
+    Listens localhost http (host:port) or unix socket (unix:/path).
+    """
+
+    logger = logging.getLogger(__name__)
+    JSON = "application/json"
+    TOKEN_TTL = 3600  # token accepted by drova api is trusted for cached answers - pollers renew it every poll
+
+    def __init__(self, config: Config, upstream: DrovaService | None = None):
+        self.listen = config.proxy_listen
+        self._sessions_ttl = config.proxy_sessions_ttl
+        self._upstream = upstream or DrovaService.from_config(config)
+        self._limiter = RateLimiter(config.proxy_rate)
+        self._products = ProductCache(
+            config.cache_file("products.json"), ttl=config.product_cache_ttl, max_len=config.product_cache_size
+        )
+        # request -> (answered_at, answer) of sessions
+        self._sessions: dict[tuple[str, bytes, str], tuple[float, Answer]] = {}
+        self._in_flight: dict[object, asyncio.Task[Answer]] = {}
+        # token -> last time drova api accepted it
+        self._accepted: dict[str, float] = {}
+
+        app = web.Application()
+        app.router.add_get("/session-manager/sessions", self._get_sessions)
+        app.router.add_get("/server-manager/product/get/{product_id}", self._get_product)
+        self._runner = web.AppRunner(app, access_log=None)
+
+    async def start(self) -> None:
+        await self._runner.setup()
+        site: web.BaseSite
+        if self.listen.startswith(DrovaService.UNIX_PREFIX):
+            site = web.UnixSite(self._runner, self.listen.removeprefix(DrovaService.UNIX_PREFIX))
+        else:
+            host, _, port = self.listen.rpartition(":")
+            site = web.TCPSite(self._runner, host or "127.0.0.1", int(port))
+        await site.start()
+        self.logger.info(f"Drova api proxy on {self.listen}")
+
+    async def close(self) -> None:
+        await self._runner.cleanup()
+        await self._upstream.close()
+
+    async def __aenter__(self) -> "DrovaProxy":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    async def _get_sessions(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        auth_token = request.headers.get("X-Auth-Token", "")
+        key = (request.path_qs, body, auth_token)
+
+        cached = self._sessions.get(key)
+        if cached and time.monotonic() - cached[0] < self._sessions_ttl:
+            PROXY_REQUESTS.inc(endpoint="sessions", result="cached")
+            return self._response(cached[1])
+
+        async def fetch() -> Answer:
+            answer = await self._fetch(
+                "sessions", request.path_qs, auth_token, data=body, headers={"Content-Type": request.content_type}
+            )
+            now = time.monotonic()
+            # old answers of changed tokens not needed
+            for stale in [stale for stale, (at, _) in self._sessions.items() if now - at >= self._sessions_ttl]:
+                del self._sessions[stale]
+            if answer[0] == 200:
+                self._sessions[key] = (now, answer)
+            return answer
+
+        return self._response(await self._join("sessions", key, fetch))
+
+    async def _get_product(self, request: web.Request) -> web.Response:
+        try:
+            product_id = UUID(request.match_info["product_id"])
+        except ValueError:
+            return web.json_response({"error": "bad product id"}, status=400)
+        auth_token = request.headers.get("X-Auth-Token", "")
+        # catalogue same for all hosts - cached answer only for token accepted by drova api
+        product = self._products.get(product_id)
+        if product and self._is_accepted(auth_token):
+            PROXY_REQUESTS.inc(endpoint="product", result="cached")
+            return self._response((200, product.model_dump_json().encode()))
+
+        async def fetch() -> Answer:
+            answer = await self._fetch("product", request.path_qs, auth_token)
+            if answer[0] == 200:
+                try:
+                    self._products.put(product_id, ProductInfo.model_validate_json(answer[1]))
+                except ValidationError:
+                    self.logger.exception(f"Bad product {product_id} from drova api - not cached")
+            return answer
+
+        # rejected token of one poller not answered to others
+        return self._response(await self._join("product", (product_id, auth_token), fetch))
+
+    async def _join(self, endpoint: str, key: object, fetch: Callable[[], Coroutine[Any, Any, Answer]]) -> Answer:
+        task = self._in_flight.get(key)
+        if task is None:
+            PROXY_REQUESTS.inc(endpoint=endpoint, result="upstream")
+            task = asyncio.create_task(fetch())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            PROXY_REQUESTS.inc(endpoint=endpoint, result="joined")
+        # poller gone - upstream answer still needed by others
+        return await asyncio.shield(task)
+
+    def _is_accepted(self, auth_token: str) -> bool:
+        accepted_at = self._accepted.get(auth_token)
+        return accepted_at is not None and time.monotonic() - accepted_at < self.TOKEN_TTL
+
+    async def _fetch(self, endpoint: str, path_qs: str, auth_token: str, **kwargs) -> Answer:
+        PROXY_PACING.observe(await self._limiter.wait(), endpoint=endpoint)
+        kwargs["headers"] = {"X-Auth-Token": auth_token, **kwargs.get("headers", {})}
+        try:
+            answer = await self._upstream.request(endpoint, path_qs, **kwargs)
+        except AuthTokenRejected as exc:
+            self._accepted.pop(auth_token, None)
+            return exc.status, b'{"error": "auth token rejected"}'
+        except aiohttp.ClientResponseError as exc:
+            self.logger.warning(f"Drova api {endpoint} answered {exc.status}")
+            return exc.status, b'{"error": "drova api error"}'
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            self.logger.warning(f"Drova api {endpoint} request failed: {exc!r}")
+            return 502, b'{"error": "drova api unavailable"}'
+        now = time.monotonic()
+        # tokens of previous boots of hosts not kept
+        for stale in [token for token, at in self._accepted.items() if now - at >= self.TOKEN_TTL]:
+            del self._accepted[stale]
+        self._accepted[auth_token] = now
+        return answer
+
+    def _response(self, answer: Answer) -> web.Response:
+        status, body = answer
+        return web.Response(status=status, body=body, content_type=self.JSON)
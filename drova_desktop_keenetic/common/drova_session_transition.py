@@ -1,13 +1,46 @@
+import asyncio
 import logging
+import time
 from enum import Enum
+from itertools import groupby
+from operator import attrgetter
 
 from drova_desktop_keenetic.common.config import Config
-from drova_desktop_keenetic.common.drova import StatusEnum
+from drova_desktop_keenetic.common.context import CURRENT_PATCHER, CURRENT_TRANSITION
+from drova_desktop_keenetic.common.drova import ProductInfo, StatusEnum
+from drova_desktop_keenetic.common.host_facts import HostFacts
+from drova_desktop_keenetic.common.metrics import REGISTRY
 from drova_desktop_keenetic.common.patch import (
+    IBatchPatch,
     ISessionHandler,
     SessionHandlerContext,
+    kill_launchers,
     make_patchers,
+    run_batched,
 )
+from drova_desktop_keenetic.common.patch_plan import (
+    PatchPlan,
+    ProductRules,
+    prune_by_inventory,
+)
+from drova_desktop_keenetic.common.transition_journal import (
+    JournalEntry,
+    TransitionJournal,
+)
+
+TRANSITION_LATENCY = REGISTRY.histogram(
+    "drova_transition_seconds", "Time of protector and all patchers hooks for session transition"
+)
+WARMUP_LATENCY = REGISTRY.histogram("drova_warmup_seconds", "Time of protector and all patchers idle warmup")
+HOOK_LATENCY = REGISTRY.histogram("drova_hook_seconds", "Time of one protector or patcher hook")
+TRANSITIONS = REGISTRY.counter("drova_transitions_total", "Session transitions by new state")
+SESSION_START_LATENCY = REGISTRY.histogram(
+    "drova_session_start_seconds", "Time of session start transition by category of product - desktop, steam, ..."
+)
+RESUME_LATENCY = REGISTRY.histogram(
+    "drova_resume_seconds", "Time from service start to first transition resumed from journal"
+)
+SESSION_STATE = REGISTRY.gauge("drova_session_state", "Current session state of host - 1 for current state")
 
 
 def load_patchers():
@@ -36,20 +69,99 @@ class SessionState(Enum):
 
         return cls.NONE_SESSION
 
+    @property
+    def is_idle(self) -> bool:
+        """No session on host - ended session transition is already done when state is set"""
+        return self in (SessionState.NONE_SESSION, SessionState.SESSION_END, SessionState.SESSION_FORCE_CLOSE)
+
 
-class DrovaSessionTransition:
+class DrovaSessionTransition:  # pylint: disable=R0902
     logger = logging.getLogger(__file__)
 
-    def __init__(self, status: StatusEnum | None, protector: ISessionHandler, config: Config):
+    def __init__(
+        self,
+        status: StatusEnum | None,
+        protector: ISessionHandler,
+        config: Config,
+        journal: TransitionJournal | None = None,
+    ):
         self._state: SessionState = SessionState.from_status_enum(status)
+        self._journal = journal or TransitionJournal()
+        # transition of previous process - resumed on first status
+        entry = self._journal.entry
+        self._resume: JournalEntry | None = entry if entry and entry.state in SessionState.__members__ else None
+        self._resumed_done: frozenset[str] = frozenset()
+        self._started_at = time.monotonic()
+        if self._resume is not None:
+            self._state = SessionState[self._resume.state]
+            self.logger.info(f"Resume {self._state.name} of session {self._resume.session_uuid} from journal")
         load_patchers()
         self._patchers = make_patchers(config)
+        # pruned by inventory of host on session start, until session end - None is full set
+        self._session_patchers: list[ISessionHandler] | None = None
+        self._product_rules = ProductRules()
         self._protector = protector
+        self._config = config
+        self._warmup_task: asyncio.Task | None = None
+        self._warmed_ssh: object | None = None
+        self._export_state()
+
+    @property
+    def state(self) -> SessionState:
+        return self._state
+
+    def _export_state(self) -> None:
+        for state in SessionState:
+            SESSION_STATE.set(int(state == self._state), host=self._config.windows_host, state=state.name)
+
+    def warmup(self, ctx: SessionHandlerContext) -> None:
+        """Start idle warmup in background - once per ssh connection, host reboots after every session"""
+        if not self._config.session_warmup or not self._state.is_idle:
+            return
+        if self._warmed_ssh is ctx.ssh or (self._warmup_task and not self._warmup_task.done()):
+            return
+        self._warmed_ssh = ctx.ssh
+        self._warmup_task = asyncio.create_task(self._warmup(ctx))
+
+    async def _warmup(self, ctx: SessionHandlerContext) -> None:
+        # own task - own context, not need reset
+        CURRENT_TRANSITION.set("WARMUP")
+        started = time.perf_counter()
+        ctx.warmup.clear()
+        await self._run_hook(asyncio.Semaphore(1), self._protector, "on_warmup", ctx)
+        await self._run_patchers("on_warmup", ctx)
+        # inventory for plan of next session
+        await self._plan(ctx)
+        elapsed = time.perf_counter() - started
+        WARMUP_LATENCY.observe(elapsed, host=self._config.windows_host)
+        self.logger.info(f"Warmup done in {elapsed:.2f}s, prepared {sorted(ctx.warmup)}")
+
+    async def _wait_warmup(self) -> None:
+        if self._warmup_task and not self._warmup_task.done():
+            await self._warmup_task
+
+    def _drop_warmup(self, ctx: SessionHandlerContext) -> None:
+        # not used leftovers are stale after session start, warmup again on next idle
+        if self._state == SessionState.SESSION_START:
+            ctx.warmup.clear()
+            self._warmed_ssh = None
+        # protector reboots host after session - warmup on connection after reboot
+        elif self._state in (SessionState.SESSION_END, SessionState.SESSION_FORCE_CLOSE):
+            self._warmed_ssh = ctx.ssh
 
     async def set_status(self, new_status: StatusEnum | None, ctx: SessionHandlerContext):
         old_state = self._state
         new_state = SessionState.from_status_enum(new_status)
 
+        if self._resume is not None:
+            resume, self._resume = self._resume, None
+            try:
+                if old_state == new_state:
+                    await self._resume_transition(resume, ctx)
+                    return
+            finally:
+                RESUME_LATENCY.observe(time.monotonic() - self._started_at, host=self._config.windows_host)
+
         # not need any work if state not changed
         if old_state == new_state:
             return
@@ -63,59 +175,178 @@ class DrovaSessionTransition:
                 return  # skip from end session to none
 
         self._state = new_state
+        self._export_state()
+        TRANSITIONS.inc(host=self._config.windows_host, transition=self._state.name)
 
         self.logger.info("Session transition from %s to %s", old_state, self._state)
+        await self._run_transition(ctx)
 
-        task_protect = None
+    async def _resume_transition(self, resume: JournalEntry, ctx: SessionHandlerContext) -> None:
+        """Same state after restart - finish hooks not done by previous process"""
+        session_uuid = str(ctx.session.uuid) if ctx.session else None
+        same_session = self._state not in {SessionState.SESSION_START, SessionState.SESSION_ACTIVE} or (
+            resume.session_uuid == session_uuid
+        )
+        if resume.done and same_session:
+            self.logger.info(f"{self._state.name} already done before restart - nothing to resume")
+            return
+        self._resumed_done = frozenset(resume.finished) if same_session else frozenset()
+        self.logger.info(f"Resume {self._state.name}, done before restart {sorted(self._resumed_done)}")
+        try:
+            await self._run_transition(ctx)
+        finally:
+            self._resumed_done = frozenset()
+
+    async def _run_transition(self, ctx: SessionHandlerContext) -> None:
+        self._journal.begin(self._state.name, str(ctx.session.uuid) if ctx.session else None)
+        for name in self._resumed_done:
+            self._journal.finish(name)
+        transition_token = CURRENT_TRANSITION.set(self._state.name)
+        try:
+            await self._transition(ctx)
+        finally:
+            CURRENT_TRANSITION.reset(transition_token)
+        self._journal.complete()
+
+    async def _transition(self, ctx: SessionHandlerContext) -> None:
+        # session start must see all prepared - not race with warmup on same connection
+        await self._wait_warmup()
+        warm = bool(ctx.warmup)
+        # processes changed since previous transition
+        ctx.processes = None
+
+        hook = None
         task = None
         match self._state:
             case SessionState.NONE_SESSION:
-                task_protect = self._protector.on_idle(ctx)
+                hook = "on_idle"
                 task = self._on_idle(ctx)
             case SessionState.SESSION_START:
-                task_protect = self._protector.on_session_start(ctx)
+                hook = "on_session_start"
                 task = self._on_session_start(ctx)
             case SessionState.SESSION_ACTIVE:
-                task_protect = self._protector.on_session_active(ctx)
+                hook = "on_session_active"
                 task = self._on_session_active(ctx)
             case SessionState.SESSION_END | SessionState.SESSION_FORCE_CLOSE:
-                task_protect = self._protector.on_session_end(ctx)
+                hook = "on_session_end"
                 task = self._on_session_end(ctx)
-            case _:
-                task_protect = None
-                task = None
+        task_protect = None
+        # protector done before restart - not enter shadow mode or reboot twice
+        if hook and self._protector.__class__.__name__ not in self._resumed_done:
+            task_protect = self._timed_hook(self._protector, hook, ctx)
 
         self.logger.debug("Call task to execute %s", task)
+        started = time.perf_counter()
         if task_protect:
             await task_protect
 
         if task:
             await task
 
-    async def _on_idle(self, ctx: SessionHandlerContext):
-        for patch in self._patchers:
+        elapsed = time.perf_counter() - started
+        TRANSITION_LATENCY.observe(
+            elapsed, host=self._config.windows_host, transition=self._state.name, warm=str(int(warm))
+        )
+        self.logger.info(f"Session transition to {self._state.name} done in {elapsed:.2f}s, warm {warm}")
+        if self._state == SessionState.SESSION_START:
+            category = self._product_rules.category(ctx.product)
+            SESSION_START_LATENCY.observe(elapsed, host=self._config.windows_host, category=category)
+        self._drop_warmup(ctx)
+
+    async def _timed_hook(self, patch: ISessionHandler, hook: str, ctx: SessionHandlerContext) -> None:
+        name = patch.__class__.__name__
+        patcher_token = CURRENT_PATCHER.set(name)
+        try:
+            with HOOK_LATENCY.time(
+                host=self._config.windows_host, patcher=name, hook=hook, transition=CURRENT_TRANSITION.get()
+            ):
+                await getattr(patch, hook)(ctx)
+            if hook != "on_warmup":
+                self._journal.finish(name)
+        finally:
+            CURRENT_PATCHER.reset(patcher_token)
+
+    async def _run_hook(
+        self, semaphore: asyncio.Semaphore, patch: ISessionHandler, hook: str, ctx: SessionHandlerContext
+    ) -> None:
+        async with semaphore:
             try:
-                await patch.on_idle(ctx)
+                await self._timed_hook(patch, hook, ctx)
             except Exception:  # pylint: disable=W0718
-                self.logger.exception("_on_idle")
+                self.logger.exception(f"_{hook} {patch.__class__.__name__}")
 
-    async def _on_session_start(self, ctx: SessionHandlerContext):
-        for patch in self._patchers:
+    async def _run_batch(
+        self, semaphore: asyncio.Semaphore, patches: list[IBatchPatch], ctx: SessionHandlerContext
+    ) -> None:
+        async with semaphore:
+            patcher_token = CURRENT_PATCHER.set("CommandBatch")
             try:
-                await patch.on_session_start(ctx)
+                with HOOK_LATENCY.time(
+                    host=self._config.windows_host,
+                    patcher="CommandBatch",
+                    hook="on_session_start",
+                    transition=CURRENT_TRANSITION.get(),
+                ):
+                    await run_batched(ctx, patches)
+                for patch in patches:
+                    self._journal.finish(patch.__class__.__name__)
             except Exception:  # pylint: disable=W0718
-                self.logger.exception("_on_session_start")
+                self.logger.exception(f"_on_session_start batch of {[patch.__class__.__name__ for patch in patches]}")
+            finally:
+                CURRENT_PATCHER.reset(patcher_token)
+
+    async def _plan(self, ctx: SessionHandlerContext, product: ProductInfo | None = None) -> PatchPlan:
+        """Patchers of session - only launchers used by product and installed on host"""
+        plan = PatchPlan(patchers=list(self._patchers))
+        if not self._config.patchers_prune:
+            return plan
+        # client with desktop can log into any installed launcher - product rules not applied
+        if product and not product.use_default_desktop:
+            self._product_rules.prune(plan, product)
+        await prune_by_inventory(ctx, plan)
+        plan.export(self._config.windows_host)
+        self.logger.info(f"Patch plan: {plan.report()}")
+        return plan
+
+    def _pending(self, patchers: list[ISessionHandler]) -> list[ISessionHandler]:
+        # resumed transition - patchers finished by previous process not run again
+        return [patch for patch in patchers if patch.__class__.__name__ not in self._resumed_done]
+
+    async def _run_patchers(
+        self, hook: str, ctx: SessionHandlerContext, patchers: list[ISessionHandler] | None = None
+    ) -> None:
+        # patchers sorted by PRIORITY - same priority run together, next group waits previous
+        semaphore = asyncio.Semaphore(self._config.patcher_concurrency)
+        for _, group in groupby(
+            self._pending(self._patchers if patchers is None else patchers), key=attrgetter("PRIORITY")
+        ):
+            patches = list(group)
+            # session start of command only patchers - one remote call for all of group
+            batched = [patch for patch in patches if isinstance(patch, IBatchPatch)]
+            if hook != "on_session_start" or len(batched) < 2:
+                batched = []
+            tasks = [self._run_hook(semaphore, patch, hook, ctx) for patch in patches if patch not in batched]
+            if batched:
+                tasks.append(self._run_batch(semaphore, batched, ctx))
+            await asyncio.gather(*tasks)
+
+    async def _on_idle(self, ctx: SessionHandlerContext):
+        await self._run_patchers("on_idle", ctx)
+
+    async def _on_session_start(self, ctx: SessionHandlerContext):
+        patchers = self._session_patchers = (await self._plan(ctx, ctx.product)).patchers
+        # one tasklist and one taskkill for launchers of all patchers - in hooks they are already not running
+        try:
+            await kill_launchers(ctx, self._pending(patchers))
+        except Exception:  # pylint: disable=W0718
+            self.logger.exception("_on_session_start kill launchers")
+        await self._run_patchers("on_session_start", ctx, patchers)
 
     async def _on_session_active(self, ctx: SessionHandlerContext):
-        for patch in self._patchers:
-            try:
-                await patch.on_session_active(ctx)
-            except Exception:  # pylint: disable=W0718
-                self.logger.exception("_on_session_active")
+        await self._run_patchers("on_session_active", ctx, self._session_patchers)
 
     async def _on_session_end(self, ctx: SessionHandlerContext):
-        for patch in self._patchers:
-            try:
-                await patch.on_session_end(ctx)
-            except Exception:  # pylint: disable=W0718
-                self.logger.exception("_on_session_end")
+        await self._run_patchers("on_session_end", ctx, self._session_patchers)
+        self._session_patchers = None
+        # launcher can be installed while session - host without protector is not rolled back
+        ctx.facts.forget(HostFacts.INVENTORY)
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Iterable
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.drova import DrovaService
+from drova_desktop_keenetic.common.drova_poll import DrovaPoll
+from drova_desktop_keenetic.common.metrics_server import MetricsServer
+from drova_desktop_keenetic.common.product_cache import ProductCache
+
+
+class DuplicateHost(ValueError): ...
+
+
+def discover_env_files(locations: Iterable[str | os.PathLike]) -> list[Path]:
+    """Expand env locations - directory means all *.env files inside it"""
+    result: list[Path] = []
+    for location in locations:
+        path = Path(location)
+        if path.is_dir():
+            result += sorted(path.glob("*.env"))
+        else:
+            result.append(path)
+    return result
+
+
+class DrovaSupervisor:
+    """Run DrovaPoll for every configured windows host inside one event loop"""
+
+    logger = logging.getLogger(__name__)
+    RESTART_DELAY = 5  # seconds before restart polling of failed host
+
+    def __init__(self, configs: list[Config], metrics_listen: str | None = None):
+        hosts = [config.windows_host for config in configs]
+        if len(set(hosts)) != len(hosts):
+            raise DuplicateHost(f"Duplicate windows host in supervisor configs: {hosts}")
+
+        self.stop_future = asyncio.get_event_loop().create_future()
+        self._configs = configs
+        # one endpoint for all hosts - metrics labelled by host
+        self._metrics_server = MetricsServer(metrics_listen) if metrics_listen else None
+        # hosts with same drova api - share one service
+        self._services: dict[str, DrovaService] = {}
+        # product catalogue is same for all hosts
+        self._product_caches: dict[str, ProductCache] = {}
+        self.polls: dict[str, DrovaPoll] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    @classmethod
+    def from_env_files(
+        cls, locations: Iterable[str | os.PathLike], metrics_listen: str | None = None
+    ) -> "DrovaSupervisor":
+        return cls([Config.from_env_file(location) for location in discover_env_files(locations)], metrics_listen)
+
+    def _get_service(self, config: Config) -> DrovaService:
+        if config.drova_service_host not in self._services:
+            self._services[config.drova_service_host] = DrovaService.from_config(config)
+        return self._services[config.drova_service_host]
+
+    def _get_product_cache(self, config: Config) -> ProductCache:
+        if config.drova_service_host not in self._product_caches:
+            self._product_caches[config.drova_service_host] = ProductCache(
+                config.cache_file("products.json"), ttl=config.product_cache_ttl, max_len=config.product_cache_size
+            )
+        return self._product_caches[config.drova_service_host]
+
+    async def _supervise(self, config: Config) -> None:
+        host = config.windows_host
+        while not self.stop_future.done():
+            poll = DrovaPoll(
+                config, drova_service=self._get_service(config), product_cache=self._get_product_cache(config)
+            )
+            self.polls[host] = poll
+            try:
+                await poll.polling()
+            except Exception:  # pylint: disable=W0718
+                self.logger.exception(f"Polling of {host} failed")
+
+            if self.stop_future.done():
+                break
+            self.logger.info(f"Restart polling of {host} after {self.RESTART_DELAY}s")
+            await asyncio.wait((self.stop_future,), timeout=self.RESTART_DELAY)
+
+    async def serve(self) -> None:
+        if not self._configs:
+            self.logger.error("No hosts to supervise")
+            return
+
+        if self._metrics_server:
+            await self._metrics_server.start()
+        for config in self._configs:
+            self.logger.info(f"Start polling of {config.windows_host}")
+            self._tasks[config.windows_host] = asyncio.create_task(
+                self._supervise(config), name=f"drova_poll[{config.windows_host}]"
+            )
+        try:
+            await asyncio.wait(self._tasks.values())
+        finally:
+            for service in self._services.values():
+                await service.close()
+            if self._metrics_server:
+                await self._metrics_server.close()
+
+    async def stop(self) -> None:
+        if not self.stop_future.done():
+            self.stop_future.set_result(True)
+        for poll in self.polls.values():
+            await poll.stop()
+        if self._tasks:
+            await asyncio.wait(self._tasks.values())
@@ -0,0 +1,72 @@
+import logging
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from drova_desktop_keenetic.common.json_file import read_json, write_json
+from drova_desktop_keenetic.common.metrics import REGISTRY
+
+FINGERPRINT_HITS = REGISTRY.counter("drova_ipatch_clean_hits_total", "IPatch file already clean - patch skipped")
+FINGERPRINT_MISSES = REGISTRY.counter("drova_ipatch_clean_misses_total", "IPatch file unknown or changed - patched")
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    size: int
+    mtime: int
+    sha256: str
+
+
+class FingerprintCache:
+    """Known clean (already patched) states of remote files of one host, optionally persisted to json file
+
+    Few states per file - host rollback to baseline on every reboot, so same states come again.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, location: str | os.PathLike | None = None, max_per_file: int = 4):
+        self._location = Path(location) if location else None
+        self._max_per_file = max_per_file
+        # remote_file_location -> clean states, last recorded at end
+        self._files: dict[str, list[Fingerprint]] = {}
+        self._load()
+
+    def find(self, remote_location: str, size: int | None, mtime: int | None) -> Fingerprint | None:
+        """Clean state with same size and mtime - content still must be checked by hash"""
+        for fingerprint in self._files.get(remote_location, ()):
+            if fingerprint.size == size and fingerprint.mtime == mtime:
+                return fingerprint
+        return None
+
+    def record(self, remote_location: str, fingerprint: Fingerprint) -> None:
+        fingerprints = [known for known in self._files.get(remote_location, ()) if known != fingerprint]
+        fingerprints.append(fingerprint)
+        self._files[remote_location] = fingerprints[-self._max_per_file :]
+        self._save()
+
+    def forget(self, remote_location: str) -> None:
+        if self._files.pop(remote_location, None) is not None:
+            self._save()
+
+    def _load(self) -> None:
+        if not self._location:
+            return
+        try:
+            for remote_location, fingerprints in (read_json(self._location) or {}).items():
+                self._files[remote_location] = [Fingerprint(**fingerprint) for fingerprint in fingerprints]
+        except (OSError, ValueError, TypeError):
+            self.logger.exception(f"Bad fingerprint cache {self._location} - start empty")
+            self._files.clear()
+
+    def _save(self) -> None:
+        if not self._location:
+            return
+        content = {
+            remote_location: [asdict(fingerprint) for fingerprint in fingerprints]
+            for remote_location, fingerprints in self._files.items()
+        }
+        try:
+            write_json(self._location, content)
+        except OSError:
+            self.logger.exception(f"Can't save fingerprint cache {self._location}")
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Literal
+
+from drova_desktop_keenetic.common.commands import (
+    CimHostFacts,
+    CommandBatch,
+    RegQueryBootId,
+    WmicGetDesktopMonitors,
+    WmicGetLocalDrives,
+)
+from drova_desktop_keenetic.common.helpers import to_str
+from drova_desktop_keenetic.common.json_file import read_json, write_json
+from drova_desktop_keenetic.common.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from drova_desktop_keenetic.common.context import SessionHandlerContext
+
+FACTS_USED = REGISTRY.counter("drova_host_facts_used_total", "Host facts asked - hit if known for current boot")
+FACTS_QUERY_LATENCY = REGISTRY.histogram("drova_host_facts_query_seconds", "Query of host facts by backend")
+
+FactsBackend = Literal["wmic", "cim"]
+
+
+class HostFacts:
+    """Facts of windows host not changed until reboot - fixed drives, monitors, optionally persisted to json file
+
+    Facts are keyed by windows BootId: checked once per ssh connection, facts of previous boot are queried again.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    DRIVES = "drives"
+    MONITORS = "monitors"
+    INVENTORY = "inventory"  # installed launchers - path: exists
+    REQUIRED = (DRIVES,)  # queried again until known for current boot
+
+    def __init__(self, location: str | os.PathLike | None = None, backend: FactsBackend = "wmic"):
+        self._location = Path(location) if location else None
+        self._backend = backend
+        self.boot_id: str | None = None
+        self._facts: dict[str, Any] = {}
+        self._checked_ssh: object | None = None
+        self._lock = asyncio.Lock()
+        self._load()
+
+    def get(self, key: str) -> Any | None:
+        value = self._facts.get(key)
+        FACTS_USED.inc(fact=key, hit=str(int(value is not None)))
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._facts[key] = value
+        self._save()
+
+    def forget(self, key: str) -> None:
+        """Fact can be changed without reboot - query it again"""
+        if self._facts.pop(key, None) is not None:
+            self._save()
+
+    async def ensure(self, ctx: "SessionHandlerContext") -> "HostFacts":
+        """Facts of current boot - boot checked once per ssh connection, host can reboot only with reconnect"""
+        async with self._lock:
+            await self._check_boot(ctx)
+            # failed query of previous call - facts of other keys not enough
+            if any(key not in self._facts for key in self.REQUIRED):
+                await self._refresh(ctx)
+            return self
+
+    async def boot(self, ctx: "SessionHandlerContext") -> str | None:
+        """BootId of current boot, None if unknown - facts not queried"""
+        async with self._lock:
+            await self._check_boot(ctx)
+            return self.boot_id
+
+    async def _check_boot(self, ctx: "SessionHandlerContext") -> None:
+        if self._checked_ssh is ctx.ssh:
+            return
+        result = await ctx.run(RegQueryBootId())
+        boot_id = RegQueryBootId.parse(to_str(result.stdout, "windows-1251"))
+        # unknown boot id - not trust facts of previous connection
+        if boot_id is None or boot_id != self.boot_id:
+            self.logger.info(f"Boot {boot_id} of {ctx.config.windows_host} (was {self.boot_id}) - query facts")
+            self.boot_id = boot_id
+            self._facts.clear()
+        self._checked_ssh = ctx.ssh
+
+    async def refresh(self, ctx: "SessionHandlerContext") -> None:
+        """Query facts again - for facts appeared after boot (monitor of session)"""
+        async with self._lock:
+            await self._refresh(ctx)
+
+    async def _refresh(self, ctx: "SessionHandlerContext") -> None:
+        with FACTS_QUERY_LATENCY.time(host=ctx.config.windows_host, backend=self._backend):
+            facts = await (self._query_cim(ctx) if self._backend == "cim" else self._query_wmic(ctx))
+        self._facts.update(facts)
+        self._save()
+
+    async def _query_wmic(self, ctx: "SessionHandlerContext") -> dict[str, Any]:
+        drives, monitors = await ctx.run_batch(CommandBatch([WmicGetLocalDrives(), WmicGetDesktopMonitors()]))
+        facts: dict[str, Any] = {}
+        if drives.returncode == 0 and (letters := "".join(WmicGetLocalDrives.parse(drives.stdout))):
+            facts[self.DRIVES] = letters
+        if monitors.returncode == 0:
+            facts[self.MONITORS] = WmicGetDesktopMonitors.parse(monitors.stdout)
+        return facts
+
+    async def _query_cim(self, ctx: "SessionHandlerContext") -> dict[str, Any]:
+        result = await ctx.run(CimHostFacts())
+        return dict(CimHostFacts.parse(to_str(result.stdout, "windows-1251")))
+
+    def _load(self) -> None:
+        if not self._location:
+            return
+        try:
+            content = read_json(self._location)
+            if content is None:
+                return
+            self.boot_id = content["boot_id"]
+            self._facts = dict(content["facts"])
+        except (OSError, ValueError, TypeError, KeyError):
+            self.logger.exception(f"Bad host facts {self._location} - start empty")
+            self.boot_id = None
+            self._facts.clear()
+
+    def _save(self) -> None:
+        if not self._location:
+            return
+        content = {"boot_id": self.boot_id, "facts": self._facts}
+        try:
+            write_json(self._location, content)
+        except OSError:
+            self.logger.exception(f"Can't save host facts {self._location}")
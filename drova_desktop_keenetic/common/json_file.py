@@ -0,0 +1,37 @@
+import json
+import os
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+
+def read_json(location: Path) -> Any:
+    """Content of json file, None if file not exists"""
+    if not location.exists():
+        return None
+    with open(location, "r", encoding="utf8") as f:
+        return json.load(f)
+
+
+def write_json(location: Path, content: Any, *, mode: int | None = None, sync: bool = False) -> None:
+    """Replace json file atomically - readers see old or new content, never half written one
+
+    Every writer has own temp file - pollers of many hosts can share file. mode - permissions of file,
+    sync - content on disk before replace, file survives power loss.
+    """
+    location.parent.mkdir(parents=True, exist_ok=True)
+    temp_location = location.with_name(f"{location.name}.{uuid4().hex}.tmp")
+    fd = os.open(temp_location, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600 if mode is not None else 0o666)
+    try:
+        with open(fd, "w", encoding="utf8") as f:
+            if mode is not None:
+                # mode of open is masked by umask
+                os.fchmod(f.fileno(), mode)
+            json.dump(content, f)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_location, location)
+    except BaseException:
+        temp_location.unlink(missing_ok=True)
+        raise
@@ -0,0 +1,170 @@
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+
+LabelValues = tuple[tuple[str, str], ...]
+
+
+def _label_values(labels: dict[str, str]) -> LabelValues:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: LabelValues) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:  # pylint: disable=R0903
+    TYPE = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+
+    def samples(self) -> Iterator[tuple[str, LabelValues, float]]:
+        return iter(())
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.TYPE}"]
+        lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines) + "\n"
+
+
+class _ValueMetric(Metric):
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: dict[LabelValues, float] = {}
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(_label_values(labels), 0.0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def samples(self) -> Iterator[tuple[str, LabelValues, float]]:
+        for labels, value in self._values.items():
+            yield self.name, labels, value
+
+
+class Counter(_ValueMetric):
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _label_values(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_ValueMetric):
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[_label_values(labels)] = value
+
+
+class Histogram(Metric):
+    """Prometheus-like histogram + last WINDOW samples for percentiles"""
+
+    TYPE = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+    WINDOW = 1024
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+        self._samples: dict[LabelValues, deque[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_values(labels)
+        if key not in self._counts:
+            self._counts[key] = [0] * len(self.buckets)
+            self._sums[key] = 0.0
+            self._samples[key] = deque(maxlen=self.WINDOW)
+
+        counts = self._counts[key]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        self._sums[key] += value
+        self._samples[key].append(value)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        counts = self._counts.get(_label_values(labels))
+        return counts[-1] if counts else 0
+
+    def percentile(self, percent: float, **labels: str) -> float | None:
+        samples = self._samples.get(_label_values(labels))
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(percent / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def samples(self) -> Iterator[tuple[str, LabelValues, float]]:
+        for labels, counts in self._counts.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", labels + (("le", _format_value(bound)),), bucket_count
+            yield f"{self.name}_sum", labels, self._sums[labels]
+            yield f"{self.name}_count", labels, counts[-1]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def _get_or_create(self, cls: type[Metric], name: str, documentation: str, **kwargs) -> Metric:
+        if name not in self._metrics:
+            self._metrics[name] = cls(name, documentation, **kwargs)
+        metric = self._metrics[name]
+        if not isinstance(metric, cls):
+            raise TypeError(f"Metric {name} already registered as {metric.TYPE}")
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        metric = self._get_or_create(Counter, name, documentation)
+        assert isinstance(metric, Counter)
+        return metric
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        metric = self._get_or_create(Gauge, name, documentation)
+        assert isinstance(metric, Gauge)
+        return metric
+
+    def histogram(
+        self, name: str, documentation: str, buckets: tuple[float, ...] = Histogram.DEFAULT_BUCKETS
+    ) -> Histogram:
+        metric = self._get_or_create(Histogram, name, documentation, buckets=buckets)
+        assert isinstance(metric, Histogram)
+        return metric
+
+    def __iter__(self) -> Iterator[Metric]:
+        return iter(self._metrics.values())
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4"""
+        return "".join(metric.render() for metric in self)
+
+
+REGISTRY = MetricsRegistry()
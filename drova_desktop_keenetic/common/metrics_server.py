@@ -0,0 +1,40 @@
+import logging
+
+from aiohttp import web
+
+from drova_desktop_keenetic.common.metrics import REGISTRY, MetricsRegistry
+
+
+class MetricsServer:
+    """/metrics endpoint with registry in prometheus text format"""
+
+    logger = logging.getLogger(__name__)
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, listen: str, registry: MetricsRegistry = REGISTRY):
+        host, _, port = listen.rpartition(":")
+        self.host = host or "0.0.0.0"
+        self.port = int(port)
+        self._registry = registry
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+
+    async def start(self) -> None:
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.logger.info(f"Metrics served on http://{self.host}:{self.port}/metrics")
+
+    async def close(self) -> None:
+        await self._runner.cleanup()
+
+    async def __aenter__(self) -> "MetricsServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    async def _metrics(self, _: web.Request) -> web.Response:
+        return web.Response(body=self._registry.render().encode(), headers={"Content-Type": self.CONTENT_TYPE})
@@ -1,21 +1,48 @@
 import asyncio
+import hashlib
 import logging
+import time
 from abc import ABC, abstractmethod
+from collections.abc import Iterable
+from dataclasses import dataclass
 from operator import attrgetter
 from pathlib import Path, PureWindowsPath
 from typing import Any
 
 from aiofiles.tempfile import NamedTemporaryFile
-from asyncssh import SFTPNoSuchFile
+from asyncssh import SFTPAttrs, SFTPNoSuchFile
 
 from drova_desktop_keenetic.common.commands import (
-    TaskKill,
+    CertUtilHashFile,
+    CommandBatch,
+    CommandResult,
+    ICommandBuilder,
+    PurgeTombstones,
+    RmDir,
+    RmDirFast,
 )
 from drova_desktop_keenetic.common.config import Config
 from drova_desktop_keenetic.common.context import SessionHandlerContext
+from drova_desktop_keenetic.common.fingerprint_cache import (
+    FINGERPRINT_HITS,
+    FINGERPRINT_MISSES,
+    Fingerprint,
+)
+from drova_desktop_keenetic.common.helpers import to_str
+from drova_desktop_keenetic.common.metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
+PATCH_LATENCY = REGISTRY.histogram("drova_ipatch_seconds", "Download, patch and upload of one IPatch file")
+PATCH_BYTES = REGISTRY.histogram(
+    "drova_ipatch_bytes",
+    "Size of IPatch file - memory mode keep it in buffer, file mode write it to local disk",
+    buckets=(1024.0, 4096.0, 16384.0, 65536.0, 262144.0, 1048576.0, 4194304.0, 16777216.0, float("inf")),
+)
+DIR_DELETE_LATENCY = REGISTRY.histogram(
+    "drova_dir_delete_seconds", "Delete of profile directory - rename to tombstone, rmdir or purge of tombstones"
+)
+
 
 class ISessionHandler(ABC):
     PRIORITY = 50  # set more if need call AFTER all
@@ -27,6 +54,19 @@ class ISessionHandler(ABC):
     async def on_idle(self, ctx: SessionHandlerContext):
         pass
 
+    async def on_warmup(self, ctx: SessionHandlerContext):  # pylint: disable=W0613
+        """Prepare on_session_start while host idle - only read or stage, host is not under protection yet"""
+        return None
+
+    def session_start_kills(self) -> list[str]:
+        """Images killed by on_session_start - transition kills them for all handlers at once"""
+        return []
+
+    @property
+    def inventory(self) -> list[PureWindowsPath]:
+        """Files of launcher on host - handler skipped if none of them exist, empty - needed on every host"""
+        return []
+
     @abstractmethod
     async def on_session_start(self, ctx: SessionHandlerContext):
         pass
@@ -40,31 +80,143 @@ class ISessionHandler(ABC):
         pass
 
 
+@dataclass
+class PrefetchedFile:
+    size: int | None
+    mtime: int | None
+    content: bytes
+
+    def is_actual(self, attrs: SFTPAttrs) -> bool:
+        return self.size == attrs.size and self.mtime == attrs.mtime
+
+
 class IPatch(ISessionHandler):
+    """Rewrite one remote file - small files patched in memory, big files through local temp file"""
+
     TASKKILL_IMAGE: str
 
     remote_file_location: PureWindowsPath
 
     @abstractmethod
-    async def _patch(self, file: Path, ctx: SessionHandlerContext) -> None: ...
+    async def _patch_content(self, content: bytes, ctx: SessionHandlerContext) -> bytes: ...
 
-    async def patch(self, ctx: SessionHandlerContext) -> None:
-        assert ctx.ssh
+    async def _patch(self, file: Path, ctx: SessionHandlerContext) -> None:
+        # file mode - override for patch without read all file to memory
+        with open(file, "rb") as f:
+            content = f.read()
+        with open(file, "wb") as f:
+            f.write(await self._patch_content(content, ctx))
+
+    async def _read(self, ctx: SessionHandlerContext, limit: int) -> bytes | None:
+        """Whole remote file or None if it bigger than limit"""
+        assert ctx.sftp
+        with ctx.sftp_timer("get"):
+            async with ctx.sftp.open(str(self.remote_file_location), "rb") as f:
+                content = await f.read(limit + 1)
+        assert isinstance(content, bytes)
+        return content if len(content) <= limit else None
+
+    async def _write(self, ctx: SessionHandlerContext, content: bytes) -> None:
+        assert ctx.sftp
+        with ctx.sftp_timer("put"):
+            async with ctx.sftp.open(str(self.remote_file_location), "wb") as f:
+                await f.write(content)
+
+    async def _patch_file(self, ctx: SessionHandlerContext) -> str:
+        """Patch through local temp file, return sha256 of patched content"""
         assert ctx.sftp
         async with NamedTemporaryFile("ab") as temp_file:
             await temp_file.close()
-            await ctx.sftp.get(str(self.remote_file_location), str(temp_file.name))
+            with ctx.sftp_timer("get"):
+                await ctx.sftp.get(str(self.remote_file_location), str(temp_file.name))
+            original = _sha256_file(Path(str(temp_file.name)))
             await self._patch(Path(str(temp_file.name)), ctx)
-            await ctx.sftp.put(str(temp_file.name), str(self.remote_file_location))
+            patched = _sha256_file(Path(str(temp_file.name)))
+            if patched != original:
+                with ctx.sftp_timer("put"):
+                    await ctx.sftp.put(str(temp_file.name), str(self.remote_file_location))
+        return patched
+
+    async def _is_clean(self, ctx: SessionHandlerContext, attrs: SFTPAttrs) -> bool:
+        """File is in state recorded after previous patch - same size, mtime and remote sha256"""
+        fingerprint = ctx.fingerprints.find(str(self.remote_file_location), attrs.size, attrs.mtime)
+        if fingerprint is None:
+            return False
+        result = await ctx.run(CertUtilHashFile(file=self.remote_file_location))
+        return CertUtilHashFile.parse(to_str(result.stdout, "windows-1251")) == fingerprint.sha256
+
+    async def _remember_clean(self, ctx: SessionHandlerContext, sha256: str) -> None:
+        assert ctx.sftp
+        attrs = await ctx.sftp.stat(str(self.remote_file_location))
+        if attrs.size is None or attrs.mtime is None:
+            return
+        ctx.fingerprints.record(
+            str(self.remote_file_location), Fingerprint(size=attrs.size, mtime=attrs.mtime, sha256=sha256)
+        )
+
+    async def patch(self, ctx: SessionHandlerContext) -> None:
+        assert ctx.ssh
+        assert ctx.sftp
+        started = time.perf_counter()
+        limit = ctx.config.ipatch_memory_limit
+        attrs = await ctx.sftp.stat(str(self.remote_file_location))
+        prefetched = ctx.take_warm(self.__class__.__name__)
+
+        labels = {"host": ctx.config.windows_host, "patcher": self.__class__.__name__}
+        if not ctx.config.ipatch_force_refresh:
+            if await self._is_clean(ctx, attrs):
+                FINGERPRINT_HITS.inc(1, **labels)
+                logger.info(f"{self.__class__.__name__}: {self.remote_file_location} already clean - skip patch")
+                return
+            FINGERPRINT_MISSES.inc(1, **labels)
+
+        content: bytes | None = None
+        if prefetched and prefetched.is_actual(attrs):
+            content = prefetched.content
+        elif (attrs.size or 0) <= limit:
+            content = await self._read(ctx, limit)
+
+        if content is None:
+            sha256 = await self._patch_file(ctx)
+            await self._remember_clean(ctx, sha256)
+            PATCH_BYTES.observe(attrs.size or 0, mode="file", **labels)
+            PATCH_LATENCY.observe(time.perf_counter() - started, mode="file", **labels)
+            return
+
+        patched = await self._patch_content(content, ctx)
+        # already logged out - keep file and its mtime, state is recorded as clean
+        if patched != content:
+            await self._write(ctx, patched)
+        await self._remember_clean(ctx, hashlib.sha256(patched).hexdigest())
+        PATCH_BYTES.observe(len(content), mode="memory", **labels)
+        PATCH_LATENCY.observe(time.perf_counter() - started, mode="memory", **labels)
 
     async def on_idle(self, ctx: SessionHandlerContext):
         pass
 
+    def session_start_kills(self) -> list[str]:
+        return [self.TASKKILL_IMAGE] if self.TASKKILL_IMAGE else []
+
+    @property
+    def inventory(self) -> list[PureWindowsPath]:
+        return [self.remote_file_location]
+
+    async def on_warmup(self, ctx: SessionHandlerContext):
+        # only download - _patch can touch registry or other files, it must run under protection
+        assert ctx.sftp
+        try:
+            # stat before read - file changed while read is not equal on session start
+            attrs = await ctx.sftp.stat(str(self.remote_file_location))
+            content = await self._read(ctx, ctx.config.ipatch_memory_limit)
+        except SFTPNoSuchFile:
+            return
+        if content is None:
+            return
+        ctx.warmup[self.__class__.__name__] = PrefetchedFile(size=attrs.size, mtime=attrs.mtime, content=content)
+
     async def on_session_start(self, ctx: SessionHandlerContext):
         assert ctx.ssh
-        if self.TASKKILL_IMAGE:
-            await ctx.ssh.run(str(TaskKill(image=self.TASKKILL_IMAGE)))
-            await asyncio.sleep(0.1)  # wait killed
+        await kill_launchers(ctx, [self])
         try:
             return await self.patch(ctx)
         except SFTPNoSuchFile as e:
@@ -79,6 +231,120 @@ class IPatch(ISessionHandler):
         return None
 
 
+class IBatchPatch(ISessionHandler):
+    """Session start is only remote commands - handlers of same priority joined to one batch by transition"""
+
+    TASKKILL_IMAGE: str = ""
+
+    @abstractmethod
+    def batch_commands(self) -> list[ICommandBuilder]:
+        """Commands to run after TASKKILL_IMAGE exited"""
+
+    def on_batch_result(  # pylint: disable=W0613
+        self, ctx: SessionHandlerContext, results: list[CommandResult]
+    ) -> None:
+        """Results of batch_commands, in same order"""
+        for result in results:
+            if result.returncode is None:
+                logger.error(f"{self.__class__.__name__}: batch broken before command")
+
+    def session_start_kills(self) -> list[str]:
+        return [self.TASKKILL_IMAGE] if self.TASKKILL_IMAGE else []
+
+    async def on_idle(self, ctx: SessionHandlerContext):
+        pass
+
+    async def on_session_start(self, ctx: SessionHandlerContext):
+        await run_batched(ctx, [self])
+
+    async def on_session_active(self, ctx: SessionHandlerContext):
+        pass
+
+    async def on_session_end(self, ctx: SessionHandlerContext):
+        pass
+
+
+class IClearDir(IBatchPatch):
+    """Kill launcher and remove its directory with auth data
+
+    Fast delete renames directory to tombstone on session start, tombstones are removed by warmup while idle.
+    """
+
+    remote_dir_clear: PureWindowsPath
+
+    def __init__(self, config: Config):
+        super().__init__(config)
+        self._fast_delete = config.fast_delete
+        self._purge_task: asyncio.Task | None = None
+
+    def batch_commands(self) -> list[ICommandBuilder]:
+        if self._fast_delete:
+            return [RmDirFast(dir=self.remote_dir_clear, tombstone=RmDirFast.tombstone_name(self.remote_dir_clear))]
+        return [RmDir(dir=self.remote_dir_clear)]
+
+    @property
+    def inventory(self) -> list[PureWindowsPath]:
+        return [self.remote_dir_clear]
+
+    def on_batch_result(self, ctx: SessionHandlerContext, results: list[CommandResult]) -> None:
+        super().on_batch_result(ctx, results)
+        for result in results:
+            if result.elapsed is not None:
+                DIR_DELETE_LATENCY.observe(
+                    result.elapsed,
+                    host=ctx.config.windows_host,
+                    patcher=self.__class__.__name__,
+                    operation="rename" if self._fast_delete else "rmdir",
+                )
+
+    async def on_warmup(self, ctx: SessionHandlerContext):
+        # not awaited - session start must not wait delete of gigabytes
+        if self._purge_task is None or self._purge_task.done():
+            self._purge_task = asyncio.create_task(self._purge(ctx))
+
+    async def _purge(self, ctx: SessionHandlerContext) -> None:
+        labels = {"host": ctx.config.windows_host, "patcher": self.__class__.__name__, "operation": "purge"}
+        try:
+            with DIR_DELETE_LATENCY.time(**labels):
+                # own channel - not hold shell queue of session start
+                await ctx.run_ssh(PurgeTombstones(dir=self.remote_dir_clear))
+        except Exception:  # pylint: disable=W0718
+            logger.exception(f"{self.__class__.__name__}: purge of tombstones failed")
+
+
+async def kill_launchers(ctx: SessionHandlerContext, handlers: Iterable[ISessionHandler]) -> list[str]:
+    """Kill running launchers of all handlers by one taskkill, not running are not touched"""
+    killed = await ctx.kill([image for handler in handlers for image in handler.session_start_kills()])
+    if killed:
+        # files of launcher are locked until it exit
+        await ctx.wait_exit(images=killed)
+    return killed
+
+
+async def run_batched(ctx: SessionHandlerContext, handlers: list[IBatchPatch]) -> None:
+    """Session start of many handlers by one remote call after launchers killed"""
+    await kill_launchers(ctx, handlers)
+
+    commands = [handler.batch_commands() for handler in handlers]
+    batch = CommandBatch([command for handler_commands in commands for command in handler_commands])
+    if not batch:
+        return
+    results = await ctx.run_batch(batch)
+    for command, result in zip(batch.commands, results):
+        logger.debug(f"{command} exited with {result.returncode} in {result.elapsed}s")
+    for handler, handler_commands in zip(handlers, commands):
+        handler.on_batch_result(ctx, results[: len(handler_commands)])
+        results = results[len(handler_commands) :]
+
+
+def _sha256_file(location: Path) -> str:
+    digest = hashlib.sha256()
+    with open(location, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def patcher(cls: Any) -> type[ISessionHandler]:
     if not issubclass(cls, ISessionHandler):
         raise RuntimeError("Please implement basic ISessionHandler/IPatch class")
@@ -0,0 +1,146 @@
+import logging
+from dataclasses import dataclass, field
+from pathlib import PureWindowsPath
+from uuid import UUID
+
+from drova_desktop_keenetic.common.commands import IfExist
+from drova_desktop_keenetic.common.context import SessionHandlerContext
+from drova_desktop_keenetic.common.drova import PRODUCT_UUID_DESKTOP, ProductInfo
+from drova_desktop_keenetic.common.helpers import to_str
+from drova_desktop_keenetic.common.host_facts import HostFacts
+from drova_desktop_keenetic.common.metrics import REGISTRY
+from drova_desktop_keenetic.common.patch import ISessionHandler
+
+logger = logging.getLogger(__name__)
+
+PATCHER_PLANNED = REGISTRY.gauge("drova_patcher_planned", "Patcher in plan of host - 1 run on session start, 0 skipped")
+
+
+@dataclass
+class PatchPlan:
+    """Patchers run on session of this host and skipped ones with reason"""
+
+    patchers: list[ISessionHandler]
+    skipped: dict[str, str] = field(default_factory=dict)
+
+    def report(self) -> str:
+        skipped = "; ".join(f"{name} - {reason}" for name, reason in self.skipped.items())
+        return (
+            f"{len(self.patchers)} of {len(self.patchers) + len(self.skipped)} patchers, skipped: {skipped or 'none'}"
+        )
+
+    def skip(self, patch: ISessionHandler, reason: str) -> None:
+        self.patchers.remove(patch)
+        self.skipped[patch.__class__.__name__] = reason
+
+    def export(self, host: str) -> None:
+        for patch in self.patchers:
+            PATCHER_PLANNED.set(1, host=host, patcher=patch.__class__.__name__)
+        for name in self.skipped:
+            PATCHER_PLANNED.set(0, host=host, patcher=name)
+
+
+async def scan_inventory(ctx: SessionHandlerContext, patchers: list[ISessionHandler]) -> dict[str, bool]:
+    """Which launcher files exist on host - scanned once per boot, after session scanned again"""
+    paths = sorted({str(path) for patch in patchers for path in patch.inventory})
+    if not paths:
+        return {}
+    facts = await ctx.facts.ensure(ctx)
+    known: dict[str, bool] = facts.get(HostFacts.INVENTORY) or {}
+    if all(path in known for path in paths):
+        return known
+
+    command = IfExist([PureWindowsPath(path) for path in paths])
+    result = await ctx.run(command)
+    if result.returncode != 0:
+        raise RuntimeError(f"inventory scan failed with {result.returncode}")
+    scanned = {str(path): exists for path, exists in command.parse(to_str(result.stdout, "windows-1251")).items()}
+    inventory = {**known, **scanned}
+    facts.set(HostFacts.INVENTORY, inventory)
+    logger.info(f"Inventory of {ctx.config.windows_host}: found {[path for path, found in scanned.items() if found]}")
+    return inventory
+
+
+def prune_not_installed(plan: PatchPlan, inventory: dict[str, bool]) -> None:
+    """Skip patchers of launchers not installed - path not scanned is treated as existing"""
+    for patch in list(plan.patchers):
+        paths = [str(path) for path in patch.inventory]
+        if paths and not any(inventory.get(path, True) for path in paths):
+            plan.skip(patch, f"not installed, not found {', '.join(paths)}")
+
+
+async def prune_by_inventory(ctx: SessionHandlerContext, plan: PatchPlan) -> None:
+    """Skip not installed launchers of host, plan not changed if scan failed"""
+    try:
+        inventory = await scan_inventory(ctx, plan.patchers)
+    except Exception:  # pylint: disable=W0718
+        logger.exception("Inventory scan failed - run all patchers")
+        return
+    prune_not_installed(plan, inventory)
+
+
+@dataclass(frozen=True)
+class ProductRule:
+    """Launcher patchers needed by product - matched by product id or by marker in game path, work path or args"""
+
+    category: str
+    patchers: frozenset[str] | None  # None - all launchers
+    product_ids: frozenset[UUID] = frozenset()
+    markers: tuple[str, ...] = ()  # lower case
+
+    def matches(self, product: ProductInfo) -> bool:
+        if product.product_id in self.product_ids:
+            return True
+        where = f"{product.game_path}|{product.work_path}|{product.args}".lower()
+        return any(marker in where for marker in self.markers)
+
+
+# first matched rule wins, product without rule gets all launchers
+PRODUCT_RULES: tuple[ProductRule, ...] = (
+    ProductRule("desktop", None, product_ids=frozenset({PRODUCT_UUID_DESKTOP})),
+    ProductRule("steam", frozenset({"SteamAuthDiscard"}), markers=("\\steam\\", "\\steamapps\\", "steam.exe")),
+    ProductRule("epic", frozenset({"EpicGamesAuthDiscard"}), markers=("\\epic games\\", "-epicportal")),
+    ProductRule("battlenet", frozenset({"BattleNet"}), markers=("\\battle.net\\",)),
+    ProductRule("ea", frozenset({"EA"}), markers=("\\ea games\\", "\\electronic arts\\")),
+    ProductRule("ubisoft", frozenset({"UbisoftAuthDiscard"}), markers=("\\ubisoft\\",)),
+    ProductRule("wargaming", frozenset({"WargamingAuthDiscard"}), markers=("\\wargaming.net\\",)),
+    ProductRule("lesta", frozenset({"Lesta"}), markers=("\\lesta\\",)),
+    ProductRule("bsg", frozenset({"BsgLauncher"}), markers=("\\battlestate games\\",)),
+    ProductRule("arena_breakout", frozenset({"ArenaBreakout"}), markers=("arena_breakout",)),
+    ProductRule("gryphline", frozenset({"Grypholink"}), markers=("\\gryphline\\",)),
+)
+
+
+class ProductRules:
+    """Prune launcher patchers not used by product of session, rule of product cached by product_id
+
+    Patchers not named by any rule (browsers, windows settings, obs) are needed by every product.
+    """
+
+    OTHER = "other"
+
+    def __init__(self, rules: tuple[ProductRule, ...] = PRODUCT_RULES):
+        self._rules = rules
+        self._launchers = frozenset(name for rule in rules for name in rule.patchers or ())
+        self._cache: dict[UUID, ProductRule | None] = {}
+
+    def match(self, product: ProductInfo) -> ProductRule | None:
+        if product.product_id not in self._cache:
+            self._cache[product.product_id] = next((rule for rule in self._rules if rule.matches(product)), None)
+        return self._cache[product.product_id]
+
+    def category(self, product: ProductInfo | None) -> str:
+        rule = self.match(product) if product else None
+        return rule.category if rule else self.OTHER
+
+    def prune(self, plan: PatchPlan, product: ProductInfo) -> None:
+        # desktop of any product - launchers can be used by client
+        if product.use_default_desktop:
+            return
+        rule = self.match(product)
+        if rule is None or rule.patchers is None:
+            return
+        for patch in list(plan.patchers):
+            name = patch.__class__.__name__
+            if name in self._launchers and name not in rule.patchers:
+                plan.skip(patch, f"not used by {rule.category} product {product.title}")
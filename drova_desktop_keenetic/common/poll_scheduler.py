@@ -0,0 +1,71 @@
+import random
+import time
+from datetime import datetime
+from uuid import UUID
+from zlib import crc32
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.drova import SessionsEntity
+from drova_desktop_keenetic.common.drova_session_transition import SessionState
+from drova_desktop_keenetic.common.metrics import REGISTRY
+
+DETECTION_LATENCY = REGISTRY.histogram(
+    "drova_session_detection_seconds", "Time from session creation on drova to detection by poll"
+)
+
+
+class PollScheduler:
+    """Choose delay before next poll by session state, recent history and api errors"""
+
+    IDLE_GROWTH = 1.5  # idle delay grows from fast to idle interval after session
+    END_FAST_WINDOW = 10.0  # seconds of fast polls after session end, then ended session is idle host
+
+    def __init__(self, config: Config):
+        self._config = config
+        self._idle_delay = config.poll_interval_idle
+        self._errors = 0
+        self._detected_uuid: UUID | None = None
+        self._state: SessionState | None = None
+        self._state_since = 0.0
+
+    def phase_offset(self) -> float:
+        # stable per host - fleet of hosts not poll api at the same moment
+        return crc32(self._config.windows_host.encode()) % 1000 / 1000 * self._config.poll_interval_idle
+
+    def on_success(self, state: SessionState) -> float:
+        self._errors = 0
+        if state != self._state:
+            self._state, self._state_since = state, time.monotonic()
+        match state:
+            case SessionState.SESSION_ACTIVE:
+                return self._config.poll_interval_active
+            case SessionState.SESSION_END | SessionState.SESSION_FORCE_CLOSE if (
+                time.monotonic() - self._state_since < self.END_FAST_WINDOW
+            ):
+                # just ended - reboot and next session expected soon
+                self._idle_delay = self._config.poll_interval_fast
+                return self._config.poll_interval_fast
+            case SessionState.NONE_SESSION | SessionState.SESSION_END | SessionState.SESSION_FORCE_CLOSE:
+                # latest session of idle host is ended one
+                delay = self._idle_delay
+                self._idle_delay = min(self._config.poll_interval_idle, self._idle_delay * self.IDLE_GROWTH)
+                return delay
+            case _:
+                # start of session - next status expected soon
+                self._idle_delay = self._config.poll_interval_fast
+                return self._config.poll_interval_fast
+
+    def on_error(self) -> float:
+        self._errors += 1
+        delay = min(self._config.poll_backoff_max, self._config.poll_interval_idle * 2 ** (self._errors - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def on_session(self, session: SessionsEntity) -> None:
+        if SessionState.from_status_enum(session.status) != SessionState.SESSION_START:
+            return
+        if self._detected_uuid == session.uuid:
+            return
+        self._detected_uuid = session.uuid
+        created_on = session.created_on
+        now = datetime.now(created_on.tzinfo) if created_on.tzinfo else datetime.now()
+        DETECTION_LATENCY.observe(max(0.0, (now - created_on).total_seconds()), host=self._config.windows_host)
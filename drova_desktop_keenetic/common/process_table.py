@@ -0,0 +1,39 @@
+from collections.abc import Iterable
+
+
+class ProcessTable:
+    """Snapshot of remote processes by one tasklist - shared by all handlers of transition
+
+    Not complete table (tasklist failed) not know what is running - every image is treated as running.
+    """
+
+    def __init__(self, processes: Iterable[tuple[str, int]] = (), complete: bool = True):
+        # image in lower case (windows names are case insensitive) -> pids
+        self._images: dict[str, set[int]] = {}
+        for image, pid in processes:
+            self._images.setdefault(image.lower(), set()).add(pid)
+        self.complete = complete
+        self._gone: set[str] = set()
+
+    def __contains__(self, image: str) -> bool:
+        image = image.lower()
+        return image not in self._gone and (not self.complete or image in self._images)
+
+    def __len__(self) -> int:
+        return sum(len(pids) for pids in self._images.values())
+
+    def running(self, images: Iterable[str]) -> list[str]:
+        """Images from list found in snapshot, without duplicates"""
+        return [image for image in dict.fromkeys(images) if image in self]
+
+    def pids(self, image: str) -> list[int]:
+        return sorted(self._images.get(image.lower(), ()))
+
+    def has_pid(self, pid: int) -> bool:
+        return any(pid in pids for pids in self._images.values())
+
+    def discard(self, images: Iterable[str]) -> None:
+        """Forget killed images - next handlers not kill them again"""
+        for image in images:
+            self._images.pop(image.lower(), None)
+            self._gone.add(image.lower())
@@ -0,0 +1,96 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from uuid import UUID
+
+from pydantic import ValidationError
+
+from drova_desktop_keenetic.common.drova import ProductInfo
+from drova_desktop_keenetic.common.json_file import read_json, write_json
+from drova_desktop_keenetic.common.metrics import REGISTRY
+
+CACHE_HITS = REGISTRY.counter("drova_product_cache_hits_total", "Product info served from cache")
+CACHE_MISSES = REGISTRY.counter("drova_product_cache_misses_total", "Product info requested from drova api")
+
+
+class ProductCache:
+    """LRU cache of ProductInfo with TTL, optionally persisted to json file"""
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, location: str | os.PathLike | None = None, ttl: float = 24 * 60 * 60, max_len: int = 256):
+        self._location = Path(location) if location else None
+        self._ttl = ttl
+        self._max_len = max_len
+        # product_id -> (stored_at unix time, product)
+        self._products: OrderedDict[UUID, tuple[float, ProductInfo]] = OrderedDict()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    def get(self, product_id: UUID) -> ProductInfo | None:
+        stored = self._products.get(product_id)
+        if stored is None or time.time() - stored[0] > self._ttl:
+            self._products.pop(product_id, None)
+            CACHE_MISSES.inc()
+            return None
+
+        self._products.move_to_end(product_id)
+        CACHE_HITS.inc()
+        return stored[1]
+
+    def put(self, product_id: UUID, product: ProductInfo) -> None:
+        self._products[product_id] = (time.time(), product)
+        self._products.move_to_end(product_id)
+        while len(self._products) > self._max_len:
+            self._products.popitem(last=False)
+        self._save()
+
+    def _load(self) -> None:
+        try:
+            self._products.update(self._read())
+        except (OSError, ValueError, TypeError, ValidationError):
+            self.logger.exception(f"Bad product cache {self._location} - start empty")
+            self._products.clear()
+
+    def _read(self) -> dict[UUID, tuple[float, ProductInfo]]:
+        """Not expired products of file"""
+        if not self._location:
+            return {}
+        return {
+            UUID(product_id): (stored_at, ProductInfo(**product))
+            for product_id, (stored_at, product) in (read_json(self._location) or {}).items()
+            if time.time() - stored_at <= self._ttl
+        }
+
+    def _merge(self) -> None:
+        """File is shared by pollers of all hosts - products stored by others kept, newer one wins"""
+        try:
+            stored = self._read()
+        except (OSError, ValueError, TypeError, ValidationError):
+            return
+        for product_id, (stored_at, product) in stored.items():
+            if product_id not in self._products:
+                self._products[product_id] = (stored_at, product)
+                # not used by this process - first to be evicted
+                self._products.move_to_end(product_id, last=False)
+            elif stored_at > self._products[product_id][0]:
+                self._products[product_id] = (stored_at, product)
+        while len(self._products) > self._max_len:
+            self._products.popitem(last=False)
+
+    def _save(self) -> None:
+        if not self._location:
+            return
+        self._merge()
+        content = {
+            str(product_id): (stored_at, product.model_dump(mode="json"))
+            for product_id, (stored_at, product) in self._products.items()
+        }
+        try:
+            write_json(self._location, content)
+        except OSError:
+            self.logger.exception(f"Can't save product cache {self._location}")
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import random
+import time
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.context import SessionHandlerContext
+from drova_desktop_keenetic.common.metrics import REGISTRY
+
+READY_LATENCY = REGISTRY.histogram(
+    "drova_ready_seconds",
+    "Time from connection lost to readiness stage - tcp, ssh, sftp, token(ready for session)",
+    buckets=(1.0, 5.0, 10.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 180.0, 300.0, float("inf")),
+)
+REBOOT_TURNAROUND = REGISTRY.histogram(
+    "drova_reboot_turnaround_seconds",
+    "Time from reboot after session to host ready for next session",
+    buckets=(10.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 180.0, 300.0, 600.0, float("inf")),
+)
+
+
+class ReconnectManager:
+    """Wait windows host back after reboot - cheap tcp probes of ssh port with jittered backoff
+
+    Readiness is by stages: tcp port open, ssh connected, sftp started, esme token found in registry.
+    """
+
+    SSH_PORT = 22
+    PROBE_TIMEOUT = 2
+
+    def __init__(self, config: Config):
+        self._config = config
+        self.logger = logging.getLogger(__name__).getChild(config.windows_host)
+        self._attempt = 0
+        self._down_since: float | None = None
+        # readiness deadline counted from host answering again, not from time of being down (gaming, reboot)
+        self._reachable_since: float | None = None
+
+    def delay(self) -> float:
+        delay = min(self._config.reconnect_backoff_max, self._config.reconnect_interval * 2**self._attempt)
+        self._attempt += 1
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def backoff(self, stop_future: asyncio.Future) -> None:
+        await asyncio.wait((stop_future,), timeout=self.delay())
+
+    async def probe(self) -> bool:
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(self._config.windows_host, self.SSH_PORT), timeout=self.PROBE_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return True
+
+    def connection_lost(self) -> None:
+        if self._down_since is None:
+            self._down_since = time.monotonic()
+
+    async def wait_reachable(self, stop_future: asyncio.Future) -> bool:
+        """Probe ssh port until open, False if stopped while waiting"""
+        self.connection_lost()
+        logged = False
+        while not stop_future.done():
+            if await self.probe():
+                self.reachable()
+                self.stage("tcp")
+                return True
+            # port still open right after reboot command - deadline from host back
+            self._reachable_since = None
+            if not logged:
+                self.logger.info("Windows unreachable - gaming or reboot, wait ssh port")
+                logged = True
+            await self.backoff(stop_future)
+        return False
+
+    def reachable(self) -> float:
+        """Host answered tcp probe or ssh connect - time of first answer since it was unreachable"""
+        if self._reachable_since is None:
+            self._reachable_since = time.monotonic()
+        return self._reachable_since
+
+    def deadline(self) -> float:
+        return self.reachable() + self._config.ready_timeout
+
+    def stage(self, name: str) -> None:
+        if self._down_since is not None:
+            READY_LATENCY.observe(time.monotonic() - self._down_since, host=self._config.windows_host, stage=name)
+
+    def ready(self, ctx: SessionHandlerContext) -> None:
+        self.stage("ready")
+        # host can answer some seconds after reboot command - count only if connection was lost after it
+        if ctx.rebooted_at is not None and self._down_since is not None and self._down_since >= ctx.rebooted_at:
+            turnaround = time.monotonic() - ctx.rebooted_at
+            REBOOT_TURNAROUND.observe(turnaround, host=self._config.windows_host)
+            self.logger.info(f"Windows ready {turnaround:.1f}s after reboot")
+            ctx.rebooted_at = None
+        self._down_since = None
+        self._reachable_since = None
+        self._attempt = 0
@@ -0,0 +1,237 @@
+import logging
+import time
+from hashlib import sha1
+from pathlib import PureWindowsPath
+from uuid import uuid4
+
+from asyncssh import SFTPNoSuchFile
+from pydantic import BaseModel
+
+from drova_desktop_keenetic.common.commands import (
+    CommandBatch,
+    ICommandBuilder,
+    RegAdd,
+    RegDel,
+    RegDelActionRemoveAllValues,
+    RegDelActionRemoveDefault,
+    RegDelActionRemoveValue,
+    RegImport,
+    RegQuery,
+    RegValueType,
+)
+from drova_desktop_keenetic.common.context import SessionHandlerContext
+from drova_desktop_keenetic.common.helpers import to_str
+from drova_desktop_keenetic.common.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_APPLY_LATENCY = REGISTRY.histogram(
+    "drova_registry_apply_seconds", "Time to apply registry patches - batch (reg import) or fanout (reg add)"
+)
+
+ROOT_KEYS = {
+    "HKLM": "HKEY_LOCAL_MACHINE",
+    "HKCU": "HKEY_CURRENT_USER",
+    "HKCR": "HKEY_CLASSES_ROOT",
+    "HKU": "HKEY_USERS",
+    "HKCC": "HKEY_CURRENT_CONFIG",
+}
+
+
+class RegistryPatch(BaseModel):
+    reg_directory: str
+    value_name: str
+    value_type: RegValueType
+    value: str | int | bytes
+
+
+def full_key(key: str) -> str:
+    """reg import understand only full root names - HKCU\\... -> HKEY_CURRENT_USER\\..."""
+    root, _, path = key.partition("\\")
+    root = ROOT_KEYS.get(root.upper(), root.upper())
+    return f"{root}\\{path}" if path else root
+
+
+def _hex(value: bytes) -> str:
+    return ",".join(f"{byte:02x}" for byte in value)
+
+
+def _reg_string(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def render_value(patch: RegistryPatch) -> str:
+    match patch.value_type:
+        case RegValueType.REG_SZ:
+            return _reg_string(str(patch.value))
+        case RegValueType.REG_DWORD | RegValueType.REG_DWORD_LITTLE_ENDIAN:
+            return f"dword:{int(patch.value):08x}"
+        case RegValueType.REG_EXPAND_SZ:
+            return "hex(2):" + _hex((str(patch.value) + "\0").encode("utf-16-le"))
+        case RegValueType.REG_MULTI_SZ:
+            return "hex(7):" + _hex((str(patch.value) + "\0\0").encode("utf-16-le"))
+        case RegValueType.REG_BINARY:
+            value = patch.value if isinstance(patch.value, bytes) else str(patch.value).encode()
+            return "hex:" + _hex(value)
+    raise ValueError(f"Registry batch not support {patch.value_type}")
+
+
+def _is_wipe(operation: RegistryPatch | RegDel) -> bool:
+    return isinstance(operation, RegDel) and isinstance(operation.action, RegDelActionRemoveAllValues)
+
+
+def _to_command(operation: RegistryPatch | RegDel) -> ICommandBuilder:
+    if isinstance(operation, RegDel):
+        return operation
+    return RegAdd(
+        operation.reg_directory, value_name=operation.value_name, value_type=operation.value_type, value=operation.value
+    )
+
+
+class RegistryBatch:
+    """Many registry changes as one .reg file - uploaded by sftp and applied by one `reg import`
+
+    .reg can remove all values of key only with subkeys - such deletes run before import as `reg delete /va`.
+    """
+
+    REMOTE_DIR = PureWindowsPath(r"AppData\Local\Temp")
+
+    def __init__(self, operations: tuple[RegistryPatch | RegDel, ...] | list[RegistryPatch | RegDel] = ()):
+        self._operations: list[RegistryPatch | RegDel] = list(operations)
+        # patchers work in parallel - every batch need own file
+        self.remote_location = self.REMOTE_DIR / f"drova_registry_{uuid4().hex}.reg"
+        self.staged = False
+
+    def add(self, operation: RegistryPatch | RegDel) -> None:
+        self._operations.append(operation)
+
+    def __len__(self) -> int:
+        return len(self._operations)
+
+    def render(self) -> str:
+        lines = ["Windows Registry Editor Version 5.00"]
+        section: str | None = None
+
+        def open_section(key: str) -> None:
+            nonlocal section
+            if section != key:
+                lines.extend(("", f"[{key}]"))
+                section = key
+
+        for operation in self._operations:
+            if isinstance(operation, RegistryPatch):
+                open_section(full_key(operation.reg_directory))
+                name = _reg_string(operation.value_name) if operation.value_name else "@"
+                lines.append(f"{name}={render_value(operation)}")
+                continue
+
+            key = full_key(operation.key)
+            match operation.action:
+                case RegDelActionRemoveAllValues():
+                    # [-key] removes subkeys too - values removed by reg delete before import
+                    continue
+                case RegDelActionRemoveValue(value_name=value_name):
+                    open_section(key)
+                    lines.append(f"{_reg_string(value_name)}=-")
+                case RegDelActionRemoveDefault():
+                    open_section(key)
+                    lines.append("@=-")
+                case _:
+                    raise ValueError(f"Registry batch not support {operation.action}")
+        lines.append("")
+        return "\r\n".join(lines)
+
+    def encode(self) -> bytes:
+        # regedit 5.00 format is utf-16 with BOM
+        return self.render().encode("utf-16")
+
+    def find_failures(self, actual: dict[str, dict[str, tuple[str, str]]]) -> list[RegistryPatch | RegDel]:
+        failures: list[RegistryPatch | RegDel] = []
+        for operation in self._operations:
+            if isinstance(operation, RegistryPatch):
+                values = actual.get(full_key(operation.reg_directory).upper(), {})
+                value = values.get((operation.value_name or "(Default)").upper())
+                if value is None or value[0] != operation.value_type.value:
+                    failures.append(operation)
+                elif operation.value_type in {RegValueType.REG_DWORD, RegValueType.REG_DWORD_LITTLE_ENDIAN}:
+                    if int(value[1], 16) != int(operation.value):
+                        failures.append(operation)
+                elif operation.value_type == RegValueType.REG_SZ and value[1] != str(operation.value):
+                    failures.append(operation)
+                continue
+
+            values = actual.get(full_key(operation.key).upper(), {})
+            match operation.action:
+                case RegDelActionRemoveAllValues():
+                    if values:
+                        failures.append(operation)
+                case RegDelActionRemoveValue(value_name=value_name):
+                    if value_name.upper() in values:
+                        failures.append(operation)
+        return failures
+
+    def _keys(self) -> list[str]:
+        keys = (
+            full_key(operation.reg_directory if isinstance(operation, RegistryPatch) else operation.key)
+            for operation in self._operations
+        )
+        return list(dict.fromkeys(keys))
+
+    async def upload(self, ctx: SessionHandlerContext) -> None:
+        assert ctx.sftp
+        with ctx.sftp_timer("put"):
+            async with ctx.sftp.open(str(self.remote_location), "wb") as f:
+                await f.write(self.encode())
+
+    async def stage(self, ctx: SessionHandlerContext) -> None:
+        """Upload file before apply - name by content, file staged on previous boot is only checked"""
+        assert ctx.sftp
+        content = self.encode()
+        # staged outside of protection - same name every time, not leave new file per boot
+        self.remote_location = self.REMOTE_DIR / f"drova_registry_{sha1(content).hexdigest()[:16]}.reg"
+        try:
+            if (await ctx.sftp.stat(str(self.remote_location))).size == len(content):
+                self.staged = True
+                return
+        except SFTPNoSuchFile:
+            pass
+        await self.upload(ctx)
+        self.staged = True
+
+    async def verify(self, ctx: SessionHandlerContext) -> list[RegistryPatch | RegDel]:
+        assert ctx.ssh
+        result = await ctx.run(RegQuery(self._keys()), check=False)
+        return self.find_failures(RegQuery.parse(to_str(result.stdout, "windows-1251")))
+
+    async def apply(self, ctx: SessionHandlerContext) -> list[RegistryPatch | RegDel]:
+        """Apply all changes, entries not found in registry after import applied one by one
+
+        Return operations still not applied.
+        """
+        assert ctx.ssh
+        assert ctx.sftp
+        started = time.perf_counter()
+        wipes = [operation for operation in self._operations if _is_wipe(operation)]
+        if wipes:
+            await ctx.run_batch(CommandBatch([_to_command(operation) for operation in wipes]))
+        if len(wipes) < len(self):
+            if not self.staged or not await ctx.sftp.exists(str(self.remote_location)):
+                await self.upload(ctx)
+            result = await ctx.run(RegImport(self.remote_location), check=False)
+            if result.returncode:
+                logger.error(f"reg import failed with {result.returncode}: {to_str(result.stderr, 'windows-1251')}")
+            await ctx.sftp.remove(str(self.remote_location))
+
+        failures = await self.verify(ctx)
+        if failures:
+            logger.warning(f"Registry batch: {len(failures)} entries not applied - apply one by one")
+            for failure in failures:
+                # value can have '!' - not for CommandBatch
+                await ctx.run(_to_command(failure), check=False)
+            failures = await RegistryBatch(failures).verify(ctx)
+        elapsed = time.perf_counter() - started
+        REGISTRY_APPLY_LATENCY.observe(elapsed, host=ctx.config.windows_host, mode="batch")
+        logger.info(f"Registry batch of {len(self)} entries applied in {elapsed:.2f}s, failed {len(failures)}")
+        for failure in failures:
+            logger.error(f"Registry entry not applied: {failure}")
+        return failures
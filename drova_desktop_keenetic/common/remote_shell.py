@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import count
+
+from asyncssh import (
+    ProcessError,
+    SSHClientConnection,
+    SSHClientProcess,
+    SSHCompletedProcess,
+)
+
+from drova_desktop_keenetic.common.commands import ICommandBuilder
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteShellClosed(RuntimeError): ...
+
+
+@dataclass
+class _PendingCommand:
+    index: int
+    command: str
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_event_loop().create_future())
+    stdout: list[str] = field(default_factory=list)
+    stderr: list[str] = field(default_factory=list)
+    returncode: int | None = None
+    stderr_done: bool = False
+
+
+class RemoteShell:
+    """One long-living cmd.exe per ssh connection - commands written to its stdin one after another
+
+    Every command wrapped by begin/end markers in stdout and stderr, end marker carry %errorlevel%.
+    Commands not wait previous result before write - pipelined, results come back in order.
+    Command not finished in timeout closes shell - cmd.exe is blocked by it, caller runs over ssh channel.
+    """
+
+    SHELL = "cmd.exe /Q /D"
+    BEGIN = "__DROVA_BEGIN_{index}__"
+    END = "__DROVA_END_{index}__"
+    r_end = re.compile(r"__DROVA_END_(?P<index>\d+)__(?: (?P<returncode>-?\d+))?")
+    r_begin = re.compile(r"__DROVA_BEGIN_(?P<index>\d+)__")
+
+    def __init__(self, conn: SSHClientConnection, timeout: float | None = None):
+        self._conn = conn
+        self._timeout = timeout
+        self._process: SSHClientProcess | None = None
+        self._pending: deque[_PendingCommand] = deque()
+        self._readers: list[asyncio.Task] = []
+        self._counter = count()
+        self._closed = False
+
+    @property
+    def is_running(self) -> bool:
+        return self._process is not None and not self._closed
+
+    async def start(self) -> None:
+        self._process = await self._conn.create_process(self.SHELL)
+        self._readers = [
+            asyncio.create_task(self._read_stdout()),
+            asyncio.create_task(self._read_stderr()),
+        ]
+
+    def _format(self, pending: _PendingCommand) -> str:
+        begin = self.BEGIN.format(index=pending.index)
+        end = self.END.format(index=pending.index)
+        # stdin of command is nul - command can't eat next commands from our stdin
+        return (
+            f"echo {begin}& echo {begin} 1>&2\r\n"
+            f"({pending.command}) < nul\r\n"
+            f"echo {end} %errorlevel%& echo {end} 1>&2\r\n"
+        )
+
+    async def run(self, command: ICommandBuilder | str, check: bool = False) -> SSHCompletedProcess:
+        if not self.is_running:
+            raise RemoteShellClosed()
+        assert self._process
+
+        pending = _PendingCommand(index=next(self._counter), command=str(command))
+        self._pending.append(pending)
+        self._process.stdin.write(self._format(pending))
+        try:
+            await asyncio.wait_for(pending.future, self._timeout)
+        except asyncio.TimeoutError as exc:
+            logger.warning(f"Command not finished in {self._timeout}s - close shell: {pending.command}")
+            await self.close()
+            raise RemoteShellClosed(f"Shell command timed out: {pending.command}") from exc
+
+        stdout, stderr = "".join(pending.stdout), "".join(pending.stderr)
+        if check and pending.returncode:
+            raise ProcessError(
+                env=None,
+                command=pending.command,
+                subsystem=None,
+                exit_status=pending.returncode,
+                exit_signal=None,
+                returncode=pending.returncode,
+                stdout=stdout,
+                stderr=stderr,
+            )
+        return SSHCompletedProcess(
+            env=None,
+            command=pending.command,
+            subsystem=None,
+            exit_status=pending.returncode,
+            exit_signal=None,
+            returncode=pending.returncode,
+            stdout=stdout,
+            stderr=stderr,
+        )
+
+    async def run_many(self, commands: list[ICommandBuilder | str]) -> list[SSHCompletedProcess]:
+        return list(await asyncio.gather(*(self.run(command) for command in commands)))
+
+    def _find(self, index: int) -> _PendingCommand | None:
+        for pending in self._pending:
+            if pending.index == index:
+                return pending
+        return None
+
+    def _complete(self, pending: _PendingCommand) -> None:
+        if pending.returncode is None or not pending.stderr_done:
+            return
+        self._pending.remove(pending)
+        if not pending.future.done():
+            pending.future.set_result(None)
+
+    async def _read_stdout(self) -> None:
+        assert self._process
+        current: _PendingCommand | None = None
+        try:
+            async for line in self._process.stdout:
+                if match := self.r_begin.search(line):
+                    current = self._find(int(match["index"]))
+                elif match := self.r_end.search(line):
+                    if pending := self._find(int(match["index"])):
+                        pending.returncode = int(match["returncode"] or 0)
+                        self._complete(pending)
+                    current = None
+                elif current:
+                    current.stdout.append(line)
+        finally:
+            self._fail_pending()
+
+    async def _read_stderr(self) -> None:
+        assert self._process
+        current: _PendingCommand | None = None
+        try:
+            async for line in self._process.stderr:
+                if match := self.r_begin.search(line):
+                    current = self._find(int(match["index"]))
+                elif match := self.r_end.search(line):
+                    if pending := self._find(int(match["index"])):
+                        pending.stderr_done = True
+                        self._complete(pending)
+                    current = None
+                elif current:
+                    current.stderr.append(line)
+        finally:
+            self._fail_pending()
+
+    def _fail_pending(self) -> None:
+        self._closed = True
+        while self._pending:
+            pending = self._pending.popleft()
+            if not pending.future.done():
+                pending.future.set_exception(RemoteShellClosed(f"Shell closed before finish {pending.command}"))
+
+    async def close(self) -> None:
+        if self._process:
+            try:
+                # connection can be already lost (reboot) - channel not open for sending
+                if not self._closed:
+                    self._process.stdin.write("exit\r\n")
+                self._process.close()
+            except OSError as exc:
+                logger.debug(f"Shell channel already closed: {exc!r}")
+        for reader in self._readers:
+            reader.cancel()
+        self._fail_pending()
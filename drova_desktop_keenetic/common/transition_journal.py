@@ -0,0 +1,64 @@
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from drova_desktop_keenetic.common.json_file import read_json, write_json
+
+
+@dataclass
+class JournalEntry:
+    state: str  # SessionState name
+    session_uuid: str | None = None
+    # protector and patchers finished hook of state
+    finished: list[str] = field(default_factory=list)
+    done: bool = False
+
+
+class TransitionJournal:
+    """Last session transition of host, optionally persisted to json file
+
+    Restarted service resumes state from journal - not go through idle to force close (and reboot of host).
+    Written on every finished hook, file replaced atomically and synced - readable after crash at any moment.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, location: str | os.PathLike | None = None):
+        self._location = Path(location) if location else None
+        self.entry: JournalEntry | None = None
+        self._load()
+
+    def begin(self, state: str, session_uuid: str | None) -> None:
+        self.entry = JournalEntry(state=state, session_uuid=session_uuid)
+        self._save()
+
+    def finish(self, name: str) -> None:
+        if self.entry is None or name in self.entry.finished:
+            return
+        self.entry.finished.append(name)
+        self._save()
+
+    def complete(self) -> None:
+        if self.entry is None:
+            return
+        self.entry.done = True
+        self._save()
+
+    def _load(self) -> None:
+        if not self._location:
+            return
+        try:
+            content = read_json(self._location)
+            self.entry = JournalEntry(**content) if content is not None else None
+        except (OSError, ValueError, TypeError):
+            self.logger.exception(f"Bad transition journal {self._location} - start from idle")
+            self.entry = None
+
+    def _save(self) -> None:
+        if not self._location or self.entry is None:
+            return
+        try:
+            write_json(self._location, asdict(self.entry), sync=True)
+        except OSError:
+            self.logger.exception(f"Can't save transition journal {self._location}")
@@ -1,13 +1,13 @@
-import asyncio
+import io
 import json
 import logging
+import time
 from asyncio import create_task, sleep, wait
 from configparser import ConfigParser
-from pathlib import Path, PureWindowsPath
+from pathlib import PureWindowsPath
 from typing import Generator
 
-from asyncssh import ChannelOpenError, ProcessError
-from pydantic import BaseModel
+from asyncssh import ChannelOpenError, ProcessError, SFTPError
 
 from drova_desktop_keenetic.common.commands import (
     PsExec,
@@ -16,14 +16,19 @@ from drova_desktop_keenetic.common.commands import (
     RegDelActionRemoveAllValues,
     RegValueType,
     RmDir,
-    TaskKill,
 )
 from drova_desktop_keenetic.common.patch import (
+    IClearDir,
     IPatch,
     ISessionHandler,
     SessionHandlerContext,
     patcher,
 )
+from drova_desktop_keenetic.common.registry import (
+    REGISTRY_APPLY_LATENCY,
+    RegistryBatch,
+    RegistryPatch,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -37,19 +42,20 @@ class EpicGamesAuthDiscard(IPatch):
         r"AppData\Local\EpicGamesLauncher\Saved\Config\WindowsEditor\GameUserSettings.ini"
     )
 
-    async def _patch(self, file: Path, ctx: SessionHandlerContext) -> None:
-        assert ctx.ssh
-        assert ctx.sftp
+    async def _patch_content(self, content: bytes, ctx: SessionHandlerContext) -> bytes:
         config = ConfigParser(strict=False)
         self.logger.info("read GameUserSettings.ini")
-        config.read(file, encoding="UTF-8")
+        config.read_string(content.decode("utf-8"))
 
-        config.remove_section("RememberMe")
-        config.remove_section("Offline")
+        # not rewrite already clean file - same bytes are recorded as clean state
+        removed = [config.remove_section(section) for section in ("RememberMe", "Offline")]
+        if not any(removed):
+            return content
         self.logger.info("Write without auth section")
 
-        with open(file, "w", encoding="utf8") as f:
-            config.write(f)
+        result = io.StringIO()
+        config.write(result)
+        return result.getvalue().encode("utf-8")
 
 
 @patcher
@@ -59,13 +65,10 @@ class SteamAuthDiscard(IPatch):
     # remote_file_location = PureWindowsPath(r'c:\Program Files (x86)\Steam\config\config.vdf')
     remote_file_location = PureWindowsPath(r"c:\Program Files (x86)\Steam\config\loginusers.vdf")
 
-    async def _patch(self, file: Path, ctx: SessionHandlerContext) -> None:
-        with open(file, mode="w", encoding="utf8") as f:
-            f.write(
-                """"users"
+    async def _patch_content(self, content: bytes, ctx: SessionHandlerContext) -> bytes:
+        return b""""users"
 {
 }"""
-            )
 
 
 @patcher
@@ -81,11 +84,17 @@ class UbisoftAuthDiscard(ISessionHandler):
     async def on_idle(self, ctx: SessionHandlerContext):
         return None
 
+    def session_start_kills(self) -> list[str]:
+        return [self.TASKKILL_IMAGE]
+
+    @property
+    def inventory(self) -> list[PureWindowsPath]:
+        return [PureWindowsPath(file) for file in self.to_remove]
+
     async def on_session_start(self, ctx: SessionHandlerContext) -> None:
         assert ctx.ssh
         assert ctx.sftp
-        if self.TASKKILL_IMAGE:
-            await ctx.ssh.run(str(TaskKill(image=self.TASKKILL_IMAGE)))
+        await ctx.kill(self.session_start_kills())
 
         for file in self.to_remove:
             if await ctx.sftp.exists(file):
@@ -109,11 +118,17 @@ class WargamingAuthDiscard(ISessionHandler):
     async def on_idle(self, ctx: SessionHandlerContext):
         return None
 
+    def session_start_kills(self) -> list[str]:
+        return [self.TASKKILL_IMAGE]
+
+    @property
+    def inventory(self) -> list[PureWindowsPath]:
+        return [PureWindowsPath(file) for file in self.to_remove]
+
     async def on_session_start(self, ctx: SessionHandlerContext) -> None:
         assert ctx.ssh
         assert ctx.sftp
-        if self.TASKKILL_IMAGE:
-            await ctx.ssh.run(str(TaskKill(image=self.TASKKILL_IMAGE)))
+        await ctx.kill(self.session_start_kills())
 
         for file in self.to_remove:
             if await ctx.sftp.exists(file):
@@ -133,16 +148,15 @@ class BsgLauncher(IPatch):
 
     remote_file_location = PureWindowsPath(r"AppData\Roaming\Battlestate Games\BsgLauncher\settings")
 
-    async def _patch(self, file: Path, ctx: SessionHandlerContext):
-        content = {}
-        with open(file=file, mode="r", encoding="utf-8") as f:
-            content = json.loads(f.read())
-            del content["login"]
-            del content["at"]
-            del content["atet"]
-            del content["rt"]
-        with open(file=file, mode="w", encoding="utf-8") as f:
-            f.write(json.dumps(content, indent=4))
+    async def _patch_content(self, content: bytes, ctx: SessionHandlerContext) -> bytes:
+        settings = json.loads(content.decode("utf-8"))
+        if not {"login", "at", "atet", "rt"} & settings.keys():
+            return content
+        settings.pop("login", None)
+        settings.pop("at", None)
+        settings.pop("atet", None)
+        settings.pop("rt", None)
+        return json.dumps(settings, indent=4).encode("utf-8")
 
 
 @patcher
@@ -157,199 +171,85 @@ class BattleNet(IPatch):
     unif_auth = r"HKEY_CURRENT_USER\SOFTWARE\Blizzard Entertainment\Battle.net\UnifiedAuth"
     encrypt_key = r"HKEY_CURRENT_USER\SOFTWARE\Blizzard Entertainment\Battle.net\EncryptionKey"
 
-    async def _patch(self, file: Path, ctx: SessionHandlerContext):
+    async def on_session_start(self, ctx: SessionHandlerContext):
+        await super().on_session_start(ctx)
+        # login is kept out of config file too - removed every session, even if config is already clean
+        try:
+            await self._logout(ctx)
+        except Exception:  # pylint: disable=W0718
+            logger.exception(f"Error on logout of {self.__class__.__name__}")
+
+    async def _logout(self, ctx: SessionHandlerContext) -> None:
         assert ctx.ssh
         assert ctx.sftp
-        content = {}
-        with open(file=file, mode="r", encoding="utf-8") as f:
-            content = json.loads(f.read())
-            del content["Client"]
-            # del content["Client"]["SavedAccountNames"]
-            # del content["Client"]["GaClientId"]
-        with open(file=file, mode="w", encoding="utf-8") as f:
-            f.write(json.dumps(content, indent=4))
-
-        await ctx.ssh.run(str(RmDir(dir=self.account_db_location)))
-        await ctx.ssh.run(str(RegDel(key=self.reg_identity, action=RegDelActionRemoveAllValues())))
-        await ctx.ssh.run(str(RegDel(key=self.unif_auth, action=RegDelActionRemoveAllValues())))
-        await ctx.ssh.run(str(RegDel(key=self.encrypt_key, action=RegDelActionRemoveAllValues())))
+        await ctx.run(RmDir(dir=self.account_db_location))
         # удалить "HKEY_CURRENT_USER\\SOFTWARE\\Blizzard Entertainment\\Battle.net\\Identity" + ещё пару ключей
+        await RegistryBatch(
+            [
+                RegDel(key=self.reg_identity, action=RegDelActionRemoveAllValues()),
+                RegDel(key=self.unif_auth, action=RegDelActionRemoveAllValues()),
+                RegDel(key=self.encrypt_key, action=RegDelActionRemoveAllValues()),
+            ]
+        ).apply(ctx)
+
+    async def _patch_content(self, content: bytes, ctx: SessionHandlerContext) -> bytes:
+        config = json.loads(content.decode("utf-8"))
+        client = config.pop("Client", None)
+        # del config["Client"]["SavedAccountNames"]
+        # del config["Client"]["GaClientId"]
+        if client is None:
+            return content
+        return json.dumps(config, indent=4).encode("utf-8")
 
 
 @patcher
-class Grypholink(ISessionHandler):
+class Grypholink(IClearDir):
     TASKKILL_IMAGE = "Games.exe"
 
     remote_dir_clear = PureWindowsPath(r"AppData\LocalLow\Gryphline\Endfield")
 
-    async def on_idle(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_start(self, ctx: SessionHandlerContext):
-        assert ctx.ssh
-        assert ctx.sftp
-        if self.TASKKILL_IMAGE:
-            await ctx.ssh.run(str(TaskKill(image=self.TASKKILL_IMAGE)))
-            await asyncio.sleep(0.1)  # wait exit launcher
-        await ctx.ssh.run(str(RmDir(dir=self.remote_dir_clear)))
-
-    async def on_session_active(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_end(self, ctx: SessionHandlerContext):
-        pass
-
 
 @patcher
-class EA(ISessionHandler):
+class EA(IClearDir):
     TASKKILL_IMAGE = "EADesktop.exe"
 
     remote_dir_clear = PureWindowsPath(r"AppData\Local\Electronic Arts\EA Desktop")
 
-    async def on_idle(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_start(self, ctx: SessionHandlerContext):
-        assert ctx.ssh
-        assert ctx.sftp
-        if self.TASKKILL_IMAGE:
-            await ctx.ssh.run(str(TaskKill(image=self.TASKKILL_IMAGE)))
-            await asyncio.sleep(0.1)  # wait exit launcher
-        await ctx.ssh.run(str(RmDir(dir=self.remote_dir_clear)))
-
-    async def on_session_active(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_end(self, ctx: SessionHandlerContext):
-        pass
-
 
 @patcher
-class Lesta(ISessionHandler):
+class Lesta(IClearDir):
     TASKKILL_IMAGE = "lgc.exe"
 
     remote_dir_clear = PureWindowsPath(r"AppData\Roaming\Lesta\GameCenter")
 
-    async def on_idle(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_start(self, ctx: SessionHandlerContext):
-        assert ctx.ssh
-        assert ctx.sftp
-        if self.TASKKILL_IMAGE:
-            await ctx.ssh.run(str(TaskKill(image=self.TASKKILL_IMAGE)))
-            await asyncio.sleep(0.1)  # wait exit launcher
-        await ctx.ssh.run(str(RmDir(dir=self.remote_dir_clear)))
-
-    async def on_session_active(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_end(self, ctx: SessionHandlerContext):
-        pass
-
 
 @patcher
-class ArenaBreakout(ISessionHandler):
+class ArenaBreakout(IClearDir):
     TASKKILL_IMAGE = "arena_breakout_infinite_launcher.exe"
 
     remote_dir_clear = PureWindowsPath(r"AppData\Roaming\arena_breakout_infinite_launcher")
 
-    async def on_idle(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_start(self, ctx: SessionHandlerContext):
-        assert ctx.ssh
-        assert ctx.sftp
-        if self.TASKKILL_IMAGE:
-            await ctx.ssh.run(str(TaskKill(image=self.TASKKILL_IMAGE)))
-            await asyncio.sleep(0.1)  # wait exit launcher
-        await ctx.ssh.run(str(RmDir(dir=self.remote_dir_clear)))
-
-    async def on_session_active(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_end(self, ctx: SessionHandlerContext):
-        pass
-
 
 @patcher
-class Edge(ISessionHandler):
+class Edge(IClearDir):
     TASKKILL_IMAGE = "msedge.exe"
 
     remote_dir_clear = PureWindowsPath(r"AppData\Local\Microsoft\Edge\User Data")
 
-    async def on_idle(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_start(self, ctx: SessionHandlerContext):
-        assert ctx.ssh
-        assert ctx.sftp
-        if self.TASKKILL_IMAGE:
-            await ctx.ssh.run(str(TaskKill(image=self.TASKKILL_IMAGE)))
-            await asyncio.sleep(0.1)  # wait exit launcher
-        await ctx.ssh.run(str(RmDir(dir=self.remote_dir_clear)))
-
-    async def on_session_active(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_end(self, ctx: SessionHandlerContext):
-        pass
-
 
 @patcher
-class Firefox(ISessionHandler):
+class Firefox(IClearDir):
     TASKKILL_IMAGE = "firefox.exe"
 
     remote_dir_clear = PureWindowsPath(r"AppData\Local\Mozilla\Firefox\Profiles")
 
-    async def on_idle(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_start(self, ctx: SessionHandlerContext):
-        assert ctx.ssh
-        assert ctx.sftp
-        if self.TASKKILL_IMAGE:
-            await ctx.ssh.run(str(TaskKill(image=self.TASKKILL_IMAGE)))
-            await asyncio.sleep(0.1)  # wait exit launcher
-        await ctx.ssh.run(str(RmDir(dir=self.remote_dir_clear)))
-
-    async def on_session_active(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_end(self, ctx: SessionHandlerContext):
-        pass
-
 
 @patcher
-class Chrome(ISessionHandler):
+class Chrome(IClearDir):
     TASKKILL_IMAGE = "chrome.exe"
 
     remote_dir_clear = PureWindowsPath(r"AppData\Local\Google\Chrome\User Data")
 
-    async def on_idle(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_start(self, ctx: SessionHandlerContext):
-        assert ctx.ssh
-        assert ctx.sftp
-        if self.TASKKILL_IMAGE:
-            await ctx.ssh.run(str(TaskKill(image=self.TASKKILL_IMAGE)))
-            await asyncio.sleep(0.1)  # wait exit launcher
-        await ctx.ssh.run(str(RmDir(dir=self.remote_dir_clear)))
-
-    async def on_session_active(self, ctx: SessionHandlerContext):
-        pass
-
-    async def on_session_end(self, ctx: SessionHandlerContext):
-        pass
-
-
-class RegistryPatch(BaseModel):
-    reg_directory: str
-    value_name: str
-    value_type: RegValueType
-    value: str | int | bytes
-
 
 @patcher
 class PatchWindowsSettings(ISessionHandler):
@@ -469,13 +369,10 @@ class PatchWindowsSettings(ISessionHandler):
         try:
             self.logger.info(f"Run {str(RegAdd(patch.reg_directory))}")
 
-            await ctx.ssh.run(str(RegAdd(patch.reg_directory)), check=True)
+            await ctx.run(RegAdd(patch.reg_directory), check=True)
 
             self.logger.info(f"Run {str(command_patch)}")  # pylint: disable=C0301
-            await ctx.ssh.run(
-                str(command_patch),
-                check=True,
-            )
+            await ctx.run(command_patch, check=True)
         except ChannelOpenError:
             self.logger.exception(f"Bad settings ssh - don't apply {str(command_patch)}")
 
@@ -489,14 +386,30 @@ class PatchWindowsSettings(ISessionHandler):
     async def on_idle(self, ctx: SessionHandlerContext):
         return None
 
-    async def on_session_start(self, ctx: SessionHandlerContext) -> None:
-        assert ctx.ssh
+    async def _apply_reg_patches_fanout(self, ctx: SessionHandlerContext) -> None:
+        started = time.perf_counter()
         tasks = [create_task(self._apply_reg_patch(ctx, patch)) for patch in self._get_patches()]
         await wait(tasks)
+        REGISTRY_APPLY_LATENCY.observe(time.perf_counter() - started, host=ctx.config.windows_host, mode="fanout")
+
+    async def on_warmup(self, ctx: SessionHandlerContext):
+        # only upload - import outside of protection stay in registry forever
+        batch = RegistryBatch(self._get_patches())
+        await batch.stage(ctx)
+        ctx.warmup[self.NAME] = batch
+
+    async def on_session_start(self, ctx: SessionHandlerContext) -> None:
+        assert ctx.ssh
+        try:
+            await (ctx.take_warm(self.NAME) or RegistryBatch(self._get_patches())).apply(ctx)
+        except (SFTPError, ChannelOpenError, OSError):
+            self.logger.exception("Registry batch failed - apply patches one by one")
+            await self._apply_reg_patches_fanout(ctx)
 
-        await ctx.ssh.run("gpupdate /target:user /force", check=True)
+        await ctx.run("gpupdate /target:user /force", check=True)
         await sleep(1)
-        await ctx.ssh.run(str(PsExec(command="explorer.exe")), check=False)
+        explorer = PsExec(command="explorer.exe", user=ctx.config.windows_login, password=ctx.config.windows_password)
+        await ctx.run_ssh(explorer, check=False)
 
     async def on_session_active(self, ctx: SessionHandlerContext):
         return None
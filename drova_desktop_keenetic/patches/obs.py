@@ -5,9 +5,9 @@ import logging
 from configparser import ConfigParser
 from pathlib import PureWindowsPath
 
-from drova_desktop_keenetic.common.commands import ObsStartStreaming, PsExec
+from drova_desktop_keenetic.common.commands import ObsStartStreaming, PsExec, TaskKill
 from drova_desktop_keenetic.common.config import Config
-from drova_desktop_keenetic.common.helpers import to_str
+from drova_desktop_keenetic.common.host_facts import HostFacts
 from drova_desktop_keenetic.common.patch import (
     ISessionHandler,
     SessionHandlerContext,
@@ -21,12 +21,16 @@ logger = logging.getLogger(__name__)
 class ObsRecordDesktop(ISessionHandler):
     PRIORITY = 100
     TASKKILL_IMAGE = "obs64.exe"
+    WARMUP_PROFILE = "drova_warmup"  # profile not depend on session - prepared while idle
+    MONITOR_FACT = "drova_monitor"
+    DEFAULT_MONITOR = "\\\\?\\DISPLAY#DRO00DD#1&28a6823a&0&UID256#{e6f07b5f-ee97-4a90-b076-33f57bf4eaa7}"
+    START_TIMEOUT = 10  # psexec return before obs process created
 
     def __init__(self, config: Config):
         super().__init__(config)
         self.rtmp_server = config.obs_remote_url
         self.stream_key = config.windows_host
-        self.obs_pid: str | None = None
+        self.obs_pid: int | None = None
 
     @property
     def rtmp_url(self):
@@ -35,6 +39,15 @@ class ObsRecordDesktop(ISessionHandler):
     async def on_idle(self, ctx: SessionHandlerContext):
         return
 
+    async def on_warmup(self, ctx: SessionHandlerContext):
+        if not self.rtmp_server:
+            return
+        await self._create_obs_profile(ctx, self.WARMUP_PROFILE)
+        ctx.warmup[self.WARMUP_PROFILE] = self.WARMUP_PROFILE
+        # path of drova monitor prepared - session start only checks monitor is present
+        if monitor_device_path := self._find_drova_monitor(await ctx.facts.ensure(ctx)):
+            ctx.facts.set(self.MONITOR_FACT, monitor_device_path)
+
     async def on_session_start(self, ctx: SessionHandlerContext):
         assert ctx.ssh
         assert ctx.sftp
@@ -47,8 +60,11 @@ class ObsRecordDesktop(ISessionHandler):
             # Full RTMP URL
 
             # Создаём временный профиль OBS на Windows
-            profile_name = f"session_{ctx.session.uuid}"
-            await self._create_obs_profile(ctx, profile_name)
+            profile_name = ctx.take_warm(self.WARMUP_PROFILE)
+            if not profile_name:
+                profile_name = f"session_{ctx.session.uuid}"
+                await self._create_obs_profile(ctx, profile_name)
+            await self._create_obs_scenes(ctx)
 
             # Запускаем OBS с нужным профилем
             await self._start_obs(ctx, profile_name)
@@ -70,23 +86,20 @@ class ObsRecordDesktop(ISessionHandler):
             if self.obs_pid:
                 logger.info(f"[ObsRecordDesktop] Stopping OBS process {self.obs_pid}")
 
-                await ctx.ssh.run(f"taskkill /PID {self.obs_pid}", check=False)
-                await asyncio.sleep(2)
+                await ctx.run(TaskKill(pid=self.obs_pid, force=False), check=False)
 
-                # check finished process
-                check_cmd = f'tasklist /FI "PID eq {self.obs_pid}" /NH'
-                result = await ctx.ssh.run(check_cmd, check=False)
-
-                if "obs64.exe" in to_str(result.stdout):
+                # obs stops stream and saves files before exit
+                await ctx.wait_exit(pids=[self.obs_pid])
+                processes = await ctx.process_table()
+                if self.obs_pid in processes.pids(self.TASKKILL_IMAGE):
                     logger.warning(f"[ObsRecordDesktop] Process {self.obs_pid} still running, forcing...")
-                    await ctx.ssh.run(f"taskkill /F /PID {self.obs_pid}", check=False)
+                    await ctx.run(TaskKill(pid=self.obs_pid), check=False)
+                    await ctx.wait_exit(pids=[self.obs_pid])
             else:
-                # if not pid - close force by name
+                # if not pid - close force by name, if running
                 logger.info("[ObsRecordDesktop] No PID, closing by image name")
-                await ctx.ssh.run(f"taskkill /F /IM {self.TASKKILL_IMAGE}", check=False)
-
-            # 3. Даём время на сохранение файлов
-            await asyncio.sleep(2)
+                if killed := await ctx.kill([self.TASKKILL_IMAGE]):
+                    await ctx.wait_exit(images=killed)
 
             logger.info("[ObsRecordDesktop] OBS stopped successfully")
 
@@ -98,7 +111,6 @@ class ObsRecordDesktop(ISessionHandler):
     async def _create_obs_profile(self, ctx: SessionHandlerContext, profile_name: str):
         assert ctx.ssh
         assert ctx.sftp
-        assert ctx.session
 
         app_name = "live"
 
@@ -169,6 +181,12 @@ class ObsRecordDesktop(ISessionHandler):
         async with ctx.sftp.open(profile_path / "service.json", "w") as f:
             await f.write(json.dumps(service_config, indent=2))
 
+        logger.info(f"[ObsRecordDesktop] Profile '{profile_name}' created with ConfigParser")
+        logger.debug(f"[ObsRecordDesktop] RTMP server: {self.rtmp_server}, stream key: {self.stream_key}")
+
+    async def _create_obs_scenes(self, ctx: SessionHandlerContext):
+        assert ctx.sftp
+        appdata = PureWindowsPath(r"AppData\Roaming")
         monitor_device_path = await self._wait_drova_monitor(ctx)
 
         # ===== 3. Создаём базовую сцену (опционально) =====
@@ -315,29 +333,32 @@ class ObsRecordDesktop(ISessionHandler):
         async with ctx.sftp.open(scenes_path, "w") as f:
             await f.write(json.dumps(scenes, indent=2))
 
-        logger.info(f"[ObsRecordDesktop] Profile '{profile_name}' created with ConfigParser")
-        logger.debug(f"[ObsRecordDesktop] RTMP server: {self.rtmp_server}, stream key: {self.stream_key}")
-
-    async def _wait_drova_monitor(self, ctx: SessionHandlerContext):
-        assert ctx.ssh
-        for _ in range(30):  # wait 30 seconds
+    @staticmethod
+    def _find_drova_monitor(facts: HostFacts) -> str | None:
+        # Ищем Device Path формата \\?\DISPLAY#
+        for pnp_device_id in facts.get(HostFacts.MONITORS) or ():
+            if "DRO00DD" in pnp_device_id:  # use only DROVA monitor
+                return "\\\\?\\" + pnp_device_id.replace("\\", "#") + "#{e6f07b5f-ee97-4a90-b076-33f57bf4eaa7}"
+        return None
+
+    async def _wait_drova_monitor(self, ctx: SessionHandlerContext) -> str:
+        facts = await ctx.facts.ensure(ctx)
+        for attempt in range(30):  # wait 30 seconds
+            if attempt:
+                await asyncio.sleep(1)  # wait monitor create
+            # monitors of warmup can be gone - obs started only with monitor present now
+            facts.forget(HostFacts.MONITORS)
             try:
-                # Запрос всех подключенных мониторов из реестра
-                reg_cmd = "wmic desktopmonitor get pnpdeviceid"
-                result = await ctx.ssh.run(reg_cmd, check=False)
-
-                if result.exit_status == 0 and result.stdout:
-                    output = to_str(result.stdout)
-                    # Ищем строки с Device Path формата \\?\DISPLAY#
-                    for line in output.split("\n"):
-                        line = line.strip()
-                        if "DRO00DD" in line:  # use only DROVA monitor
-                            return "\\\\?\\" + line.replace("\\", "#") + "#{e6f07b5f-ee97-4a90-b076-33f57bf4eaa7}"
+                await facts.refresh(ctx)
             except Exception as e:  # pylint: disable=W0718
-                logger.warning(f"[ObsRecordDesktop] Failed to query registry for monitor: {e}")
-
-            await asyncio.sleep(1)  # wait monitor create
-        return "\\\\?\\DISPLAY#DRO00DD#1&28a6823a&0&UID256#{e6f07b5f-ee97-4a90-b076-33f57bf4eaa7}"
+                logger.warning(f"[ObsRecordDesktop] Failed to query monitors: {e}")
+                continue
+            if monitor_device_path := self._find_drova_monitor(facts):
+                # path of current boot - not built again
+                monitor_device_path = facts.get(self.MONITOR_FACT) or monitor_device_path
+                facts.set(self.MONITOR_FACT, monitor_device_path)
+                return monitor_device_path
+        return self.DEFAULT_MONITOR
 
     async def _start_obs(self, ctx: SessionHandlerContext, profile: str):
         assert ctx.ssh
@@ -346,21 +367,18 @@ class ObsRecordDesktop(ISessionHandler):
         cmd = PsExec(
             command=ObsStartStreaming(profile=profile, collection="scene", scene="scene"),
             working_directory=ObsStartStreaming.OBS_PATH.parent,
+            user=ctx.config.windows_login,
+            password=ctx.config.windows_password,
         )
 
-        await ctx.ssh.run(str(cmd), check=False)
-
-        await asyncio.sleep(1)
+        await ctx.run_ssh(cmd, check=False)
 
-        pid_cmd = 'for /f "tokens=2" %a in (\'tasklist /fi "imagename eq obs64.exe" /nh\') do @echo %a'
-
-        pid_result = await ctx.ssh.run(pid_cmd, check=False)
-        self.obs_pid = to_str(pid_result.stdout).strip()
+        pids = await ctx.wait_started(self.TASKKILL_IMAGE, timeout=self.START_TIMEOUT)
+        self.obs_pid = pids[0] if pids else None
 
         if self.obs_pid:
             logger.info(f"[ObsRecordDesktop] OBS PID: {self.obs_pid}")
         else:
-            self.obs_pid = None
             logger.warning("[ObsRecordDesktop] Could not get OBS PID")
 
     async def _create_remote_dirs(self, ctx: SessionHandlerContext, path: PureWindowsPath):
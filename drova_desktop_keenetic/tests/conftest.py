@@ -1 +1,2 @@
-from .fixtures.fake_drova import fake_drova  # pylint: disable=W0611
+from .fixtures.config import no_cache_location  # pylint: disable=W0611
+from .fixtures.fake_drova import drova_services, fake_drova  # pylint: disable=W0611
@@ -0,0 +1,14 @@
+import pytest
+
+from drova_desktop_keenetic.common.config import Config
+
+
+@pytest.fixture(autouse=True)
+def no_cache_location(monkeypatch):
+    """Config of tests not persist to cache dir of developer env - only to cache_location given by test"""
+    init = Config.__init__
+
+    def config_init(self, *args, cache_location: str | None = None, **kwargs):
+        init(self, *args, cache_location=cache_location, **kwargs)
+
+    monkeypatch.setattr(Config, "__init__", config_init)
@@ -1,6 +1,6 @@
 import pytest_asyncio
 
-from drova_desktop_keenetic.common.drova import FakeDrova
+from drova_desktop_keenetic.common.drova import DrovaService, FakeDrova
 
 
 @pytest_asyncio.fixture
@@ -9,3 +9,17 @@ async def fake_drova():
     await server.start()
     yield server
     await server.close()
+
+
+@pytest_asyncio.fixture
+async def drova_services(fake_drova: FakeDrova):  # pylint: disable=W0621
+    """Factory of clients of fake drova api - sessions of clients closed after test"""
+    services: list[DrovaService] = []
+
+    def make() -> DrovaService:
+        services.append(DrovaService(fake_drova.faked_host))
+        return services[-1]
+
+    yield make
+    for service in services:
+        await service.close()
@@ -1,4 +1,22 @@
-from drova_desktop_keenetic.common.commands import WmicGetLocalDrives
+from pathlib import PureWindowsPath
+
+import pytest
+
+from drova_desktop_keenetic.common.commands import (
+    CertUtilHashFile,
+    CimHostFacts,
+    CommandBatch,
+    CommandResult,
+    IfExist,
+    RegQueryBootId,
+    RmDir,
+    RmDirFast,
+    TaskKill,
+    TaskList,
+    WmicGetDesktopMonitors,
+    WmicGetLocalDrives,
+)
+from drova_desktop_keenetic.common.process_table import ProcessTable
 
 
 def test_WmicGetLocalDrives():  # pylint: disable=C0103
@@ -20,3 +38,130 @@ X:\\"""
     assert len(parse_cx) == 2
     assert parse_cx[0] == "C"
     assert parse_cx[1] == "X"
+
+
+def test_CertUtilHashFile():  # pylint: disable=C0103
+    command = CertUtilHashFile(file=PureWindowsPath(r"c:\Program Files (x86)\Steam\config\loginusers.vdf"))
+    assert str(command) == 'certutil -hashfile "c:\\Program Files (x86)\\Steam\\config\\loginusers.vdf" SHA256'
+
+    digest = "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+    assert (
+        CertUtilHashFile.parse(
+            f"SHA256 hash of loginusers.vdf:\r\n{digest}\r\nCertUtil: -hashfile command completed successfully.\r\n"
+        )
+        == digest
+    )
+    spaced = " ".join(digest[i : i + 2] for i in range(0, len(digest), 2))
+    assert CertUtilHashFile.parse(f"SHA256 hash of file loginusers.vdf:\r\n{spaced}\r\n") == digest
+    assert CertUtilHashFile.parse("CertUtil: -hashfile command FAILED: 0x80070002") is None
+
+
+def test_CommandBatch():  # pylint: disable=C0103
+    batch = CommandBatch([TaskKill(image="steam.exe"), RmDir(dir=PureWindowsPath(r"AppData\Local\EA Desktop"))])
+    assert str(batch) == (
+        'cmd /D /V:ON /S /C "echo __drova_batch_start_0_!time! & '
+        "(call ) & (taskkill.exe /f /IM steam.exe) & echo __drova_batch_0_!errorlevel!_!time! & "
+        '(call ) & (rmdir /S /Q "AppData\\Local\\EA Desktop") & echo __drova_batch_1_!errorlevel!_!time!"'
+    )
+
+    assert batch.parse("SUCCESS: terminated\r\n__drova_batch_0_0 \r\n__drova_batch_1_2\r\n") == [
+        CommandResult(returncode=0, stdout="SUCCESS: terminated\r\n"),
+        CommandResult(returncode=2, stdout=""),
+    ]
+    # output without newline before marker, batch broken on second command
+    assert batch.parse("no newline__drova_batch_0_128\r\n") == [
+        CommandResult(returncode=128, stdout="no newline"),
+        CommandResult(returncode=None, stdout=""),
+    ]
+
+    # time of every command by windows clock, any locale and over midnight
+    assert batch.parse(
+        "__drova_batch_start_0_23:59:59.90 \r\n__drova_batch_0_0_ 0:00:00,15\r\n__drova_batch_1_0_0:00:02.15\r\n"
+    ) == [
+        CommandResult(returncode=0, stdout="", elapsed=0.25),
+        CommandResult(returncode=0, stdout="", elapsed=2.0),
+    ]
+
+    with pytest.raises(ValueError):
+        str(CommandBatch(["echo hello!"]))
+
+
+def test_TaskKill_TaskList():  # pylint: disable=C0103
+    assert str(TaskKill(image="steam.exe")) == "taskkill.exe /f /IM steam.exe"
+    assert str(TaskKill(image=["steam.exe", "upc.exe"])) == "taskkill.exe /f /IM steam.exe /IM upc.exe"
+    assert str(TaskKill(pid=1200, force=False)) == "taskkill.exe /PID 1200"
+
+    output = (
+        '"System Idle Process","0","Services","0","8 K"\r\n'
+        '"obs64.exe","5520","Console","1","120 512 K"\r\n'
+        "\r\n"
+        "INFO: No tasks are running which match the specified criteria.\r\n"
+    )
+    assert TaskList.parse(output) == [("System Idle Process", 0), ("obs64.exe", 5520)]
+
+
+def test_ProcessTable():  # pylint: disable=C0103
+    table = ProcessTable([("Steam.exe", 10), ("steam.exe", 11), ("obs64.exe", 20)])
+    assert table.running(["STEAM.EXE", "upc.exe", "steam.exe"]) == ["STEAM.EXE", "steam.exe"]
+    assert table.pids("steam.exe") == [10, 11]
+    table.discard(["steam.exe"])
+    assert not table.running(["steam.exe"])
+
+    # tasklist failed - kill everything asked, but only once
+    unknown = ProcessTable(complete=False)
+    assert unknown.running(["upc.exe"]) == ["upc.exe"]
+    unknown.discard(["upc.exe"])
+    assert not unknown.running(["upc.exe"])
+
+
+def test_RmDirFast():  # pylint: disable=C0103
+    directory = PureWindowsPath(r"AppData\Local\Google\Chrome\User Data")
+    tombstone = RmDirFast.tombstone_name(directory)
+    assert tombstone.startswith("User Data.drova-tombstone-") and tombstone != RmDirFast.tombstone_name(directory)
+    assert str(RmDirFast(dir=directory, tombstone="User Data.drova-tombstone-1")) == (
+        r'ren "AppData\Local\Google\Chrome\User Data" "User Data.drova-tombstone-1"'
+        r' || rmdir /S /Q "AppData\Local\Google\Chrome\User Data"'
+    )
+
+
+def test_host_facts_commands():
+    assert WmicGetDesktopMonitors.parse(
+        "PNPDeviceID  \r\r\nDISPLAY\\DEL4242\\5&1A2B3C&0&UID4352  \r\r\n"
+        "DISPLAY\\DRO00DD\\1&28A6823A&0&UID256  \r\r\n\r\r\n"
+    ) == ["DISPLAY\\DEL4242\\5&1A2B3C&0&UID4352", "DISPLAY\\DRO00DD\\1&28A6823A&0&UID256"]
+    assert WmicGetDesktopMonitors.parse("PNPDeviceID\r\r\n") == []
+
+    assert CimHostFacts.parse('{"drives":"CD","monitors":["DISPLAY\\\\DRO00DD\\\\1"]}') == {
+        "drives": "CD",
+        "monitors": ["DISPLAY\\DRO00DD\\1"],
+    }
+    # powershell 5 - one monitor is not array
+    assert CimHostFacts.parse('{"drives":"C","monitors":"DISPLAY\\\\DRO00DD\\\\1"}')["monitors"] == [
+        "DISPLAY\\DRO00DD\\1"
+    ]
+    assert not CimHostFacts.parse("Get-CimInstance : Access denied")
+
+    assert RegQueryBootId.parse(
+        "\r\nHKEY_LOCAL_MACHINE\\SYSTEM\\CurrentControlSet\\Control\\Session Manager\\Memory Management"
+        "\\PrefetchParameters\r\n    BootId    REG_DWORD    0x1a3\r\n\r\n"
+    ) == "0x1a3"
+    assert RegQueryBootId.parse("ERROR: The system was unable to find the specified registry key or value.") is None
+
+
+def test_IfExist():  # pylint: disable=C0103
+    paths = [
+        PureWindowsPath(r"c:\Program Files (x86)\Steam\config\loginusers.vdf"),
+        PureWindowsPath(r"AppData\Local\Electronic Arts\EA Desktop"),
+        PureWindowsPath(r"AppData\Roaming\Lesta\GameCenter"),
+    ]
+    command = IfExist(paths)
+    assert str(command) == (
+        '(if exist "c:\\Program Files (x86)\\Steam\\config\\loginusers.vdf" echo __drova_exists_0) & '
+        '(if exist "AppData\\Local\\Electronic Arts\\EA Desktop" echo __drova_exists_1) & '
+        "(if exist AppData\\Roaming\\Lesta\\GameCenter echo __drova_exists_2)"
+    )
+    assert command.parse("__drova_exists_0\r\n__drova_exists_2 \r\n") == {
+        paths[0]: True,
+        paths[1]: False,
+        paths[2]: True,
+    }
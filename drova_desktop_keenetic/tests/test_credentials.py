@@ -0,0 +1,137 @@
+import asyncio
+import os
+
+import pytest
+
+from drova_desktop_keenetic.common.credentials import (
+    REFRESH_LATENCY,
+    STALE_SERVED,
+    CredentialProvider,
+    Credentials,
+)
+from drova_desktop_keenetic.common.helpers import RebootRequired
+
+
+class FakeEsme:
+    """Registry of esme - every query gives next token after delay"""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.queries = 0
+        self.fail = False
+
+    async def fetch(self) -> tuple[str, str]:
+        self.queries += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RebootRequired()
+        return "server", f"token{self.queries}"
+
+
+@pytest.mark.asyncio
+async def test_credentials_single_flight():
+    esme = FakeEsme()
+    provider = CredentialProvider(esme.fetch, host="single-host")
+
+    # first get waits query, concurrent getters join it
+    results = await asyncio.gather(*(provider.get() for _ in range(5)), provider.refresh())
+    assert set(results) == {Credentials(server_id="server", auth_token="token1")}
+    assert esme.queries == 1
+    assert REFRESH_LATENCY.count(host="single-host", outcome="ok") == 1
+
+    # fresh - not queried
+    await provider.get()
+    assert esme.queries == 1
+
+
+@pytest.mark.asyncio
+async def test_credentials_refresh_ahead():
+    esme = FakeEsme(delay=0.2)
+    provider = CredentialProvider(esme.fetch, host="ahead-host", ttl=0.2, refresh_ahead=0.1, max_stale=10)
+    await provider.get()
+
+    # close to expiry - old pair served, refresh in background
+    await asyncio.sleep(0.12)
+    assert (await provider.get()).auth_token == "token1"
+    await asyncio.sleep(0)
+    assert esme.queries == 2
+    # expired while refresh in flight - still served, counted as stale
+    await asyncio.sleep(0.1)
+    assert (await provider.get()).auth_token == "token1"
+    assert esme.queries == 2
+    assert STALE_SERVED.value(host="ahead-host") == 1
+
+    await asyncio.sleep(0.15)
+    assert (await provider.get()).auth_token == "token2"
+
+
+@pytest.mark.asyncio
+async def test_credentials_refresh_failure():
+    esme = FakeEsme(delay=0.01)
+    provider = CredentialProvider(esme.fetch, host="failure-host", ttl=0.05, refresh_ahead=0.01, max_stale=0.2)
+    await provider.get()
+
+    # failed background refresh - last good pair served until max_stale
+    esme.fail = True
+    await asyncio.sleep(0.05)
+    assert (await provider.get()).auth_token == "token1"
+    await asyncio.sleep(0.02)
+    assert REFRESH_LATENCY.count(host="failure-host", outcome="error") == 1
+    assert (await provider.get()).auth_token == "token1"
+
+    await asyncio.sleep(0.2)
+    with pytest.raises(RebootRequired):
+        await provider.get()
+
+
+@pytest.mark.asyncio
+async def test_credentials_persisted(tmp_path):
+    location = tmp_path / "credentials.json"
+    esme = FakeEsme(delay=0)
+    provider = CredentialProvider(esme.fetch, host="persisted-host", location=location)
+    assert not provider.on_boot("0x1a3")
+    await provider.get()
+    assert location.stat().st_mode & 0o777 == 0o600
+
+    # restart - used at once, host not rebooted
+    provider = CredentialProvider(esme.fetch, host="persisted-host", location=location)
+    assert provider.persisted
+    assert provider.on_boot("0x1a3")
+    assert (await provider.get()).auth_token == "token1"
+    assert esme.queries == 1
+
+    # host rebooted - queried again
+    provider = CredentialProvider(esme.fetch, host="persisted-host", location=location)
+    assert not provider.on_boot("0x2b4")
+    assert (await provider.get()).auth_token == "token2"
+
+    # rejected by api - file removed
+    provider.invalidate()
+    assert not location.exists()
+    assert CredentialProvider(esme.fetch, host="persisted-host", location=location).on_boot("0x2b4") is False
+
+
+@pytest.mark.asyncio
+async def test_credentials_persisted_not_refreshed(tmp_path):
+    location = tmp_path / "credentials.json"
+    esme = FakeEsme(delay=0)
+    provider = CredentialProvider(esme.fetch, host="boot-host", ttl=0.05, refresh_ahead=0.01, location=location)
+    provider.on_boot("0x1a3")
+    await provider.get()
+
+    # pair of current boot - not queried again by ttl
+    await asyncio.sleep(0.06)
+    assert (await provider.get()).auth_token == "token1"
+    await asyncio.sleep(0)
+    assert esme.queries == 1
+
+    # boot unknown - refreshed by ttl, file not rewritten by same pair
+    async def same_pair() -> tuple[str, str]:
+        return "server", "token1"
+
+    provider = CredentialProvider(same_pair, host="boot-host", ttl=0.05, refresh_ahead=0.01, location=location)
+    os.utime(location, (0, 0))
+    await provider.refresh()
+    assert location.stat().st_mtime == 0
+    provider.set(Credentials(server_id="server", auth_token="token2"))
+    assert location.stat().st_mtime > 0
@@ -1,10 +1,24 @@
+import asyncio
+import time
+
+import aiohttp
 import pytest
+from pydantic import ValidationError
 
+from drova_desktop_keenetic.common.circuit_breaker import CircuitBreaker, CircuitOpen
 from drova_desktop_keenetic.common.drova import (
+    CALL_LATENCY,
+    CALL_P99,
+    HANDSHAKES,
+    HEDGED,
+    REQUEST_LATENCY,
+    UNCHANGED,
     DrovaService,
     FakeDrova,
     ProductInfo,
     SessionsEntity,
+    StatusEnum,
+    parse_latest_session,
 )
 
 FAKE_AUTH_TOKEN = "test"
@@ -12,12 +26,127 @@ FAKE_AUTH_TOKEN = "test"
 
 @pytest.mark.asyncio
 async def test_DrovaServiceWithFake(fake_drova: FakeDrova):  # pylint: disable=C0103,W0621
-    service = DrovaService(fake_drova.faked_host)
+    async with DrovaService(fake_drova.faked_host) as service:
+        session: SessionsEntity = await service.get_latest_session("", FAKE_AUTH_TOKEN)
+        assert session
+        assert session.client_id
+
+        product: ProductInfo = await service.get_product_info("test", FAKE_AUTH_TOKEN)
+        assert product
+        assert product.product_id
+
+
+@pytest.mark.asyncio
+async def test_DrovaServiceKeepAlive(fake_drova: FakeDrova):  # pylint: disable=C0103,W0621
+    handshakes = HANDSHAKES.value(api=fake_drova.faked_host)
+    requests = REQUEST_LATENCY.count(api=fake_drova.faked_host, endpoint="sessions")
+
+    async with DrovaService(fake_drova.faked_host) as service:
+        for _ in range(5):
+            await service.get_latest_session("", FAKE_AUTH_TOKEN)
+
+    assert HANDSHAKES.value(api=fake_drova.faked_host) - handshakes == 1
+    assert REQUEST_LATENCY.count(api=fake_drova.faked_host, endpoint="sessions") - requests == 5
+    assert REQUEST_LATENCY.percentile(99, api=fake_drova.faked_host, endpoint="sessions")
+
+
+@pytest.mark.asyncio
+async def test_DrovaServiceUnchanged(fake_drova: FakeDrova):  # pylint: disable=C0103,W0621
+    unchanged = UNCHANGED.value(api=fake_drova.faked_host, endpoint="sessions")
+
+    async with DrovaService(fake_drova.faked_host) as service:
+        session = await service.get_latest_session("", FAKE_AUTH_TOKEN)
+        assert await service.get_latest_session("", FAKE_AUTH_TOKEN) is session
+        assert UNCHANGED.value(api=fake_drova.faked_host, endpoint="sessions") - unchanged == 1
+
+        fake_drova.session.sessions[0].status = StatusEnum.ACTIVE
+        session = await service.get_latest_session("", FAKE_AUTH_TOKEN)
+        assert session.status == StatusEnum.ACTIVE
+        assert UNCHANGED.value(api=fake_drova.faked_host, endpoint="sessions") - unchanged == 1
+
+
+def test_parse_latest_session():
+    assert parse_latest_session(b'{"sessions": []}') is None
+    assert parse_latest_session(b'{"sessions": null}') is None
+    # only newest session validated
+    with pytest.raises(ValidationError):
+        parse_latest_session(b'{"sessions": [{"uuid": "bad"}, {}]}')
+    with pytest.raises(ValidationError):
+        parse_latest_session(b"<html>502 Bad Gateway</html>")
+
+
+@pytest.mark.asyncio
+async def test_DrovaServiceDeadline(fake_drova: FakeDrova):  # pylint: disable=C0103,W0621
+    errors = CALL_LATENCY.count(api=fake_drova.faked_host, endpoint="sessions", outcome="error")
+    fake_drova.delays = [1]
+
+    async with DrovaService(fake_drova.faked_host, deadline=0.1) as service:
+        started = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await service.get_latest_session("", FAKE_AUTH_TOKEN)
+        assert time.monotonic() - started < 0.5
+        assert CALL_LATENCY.count(api=fake_drova.faked_host, endpoint="sessions", outcome="error") == errors + 1
+
+        assert await service.get_latest_session("", FAKE_AUTH_TOKEN)
+        assert CALL_P99.value(api=fake_drova.faked_host, endpoint="sessions") > 0
+
+
+@pytest.mark.asyncio
+async def test_DrovaServiceHedge(fake_drova: FakeDrova):  # pylint: disable=C0103,W0621
+    async with DrovaService(fake_drova.faked_host, hedge=True) as service:
+        # p95 of fast answers known
+        for _ in range(DrovaService.HEDGE_MIN_SAMPLES):
+            await service.get_latest_session("", FAKE_AUTH_TOKEN)
+        hedged = HEDGED.value(api=fake_drova.faked_host, endpoint="sessions", winner="hedge")
+
+        # stalled request - second one answers
+        fake_drova.delays = [1]
+        started = time.monotonic()
+        assert await service.get_latest_session("", FAKE_AUTH_TOKEN)
+        assert time.monotonic() - started < 0.5
+        assert HEDGED.value(api=fake_drova.faked_host, endpoint="sessions", winner="hedge") == hedged + 1
+
+
+@pytest.mark.asyncio
+async def test_DrovaServiceErrorStatus(fake_drova: FakeDrova):  # pylint: disable=C0103,W0621
+    fake_drova.errors = [503] * 3
+    breaker = CircuitBreaker(failures=3, cooldown=0.1, cooldown_max=0.1)
+
+    async with DrovaService(fake_drova.faked_host, breaker=breaker) as service:
+        # error page of api is failure, not session data
+        for _ in range(3):
+            with pytest.raises(aiohttp.ClientResponseError) as exc_info:
+                await service.get_latest_session("", FAKE_AUTH_TOKEN)
+            assert exc_info.value.status == 503
+        assert breaker.is_open
+        with pytest.raises(CircuitOpen):
+            await service.get_latest_session("", FAKE_AUTH_TOKEN)
+
+        # api recovered - trial call closes circuit
+        await asyncio.sleep(0.1)
+        assert await service.get_latest_session("", FAKE_AUTH_TOKEN)
+        assert not breaker.is_open
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failures=2, cooldown=0.05, cooldown_max=0.05)
+    breaker.failure()
+    breaker.check()
+    breaker.failure()
+    with pytest.raises(CircuitOpen):
+        breaker.check()
 
-    session: SessionsEntity = await service.get_latest_session("", FAKE_AUTH_TOKEN)
-    assert session
-    assert session.client_id
+    # after cooldown - only one trial call
+    time.sleep(0.05)
+    breaker.check()
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    breaker.failure()
+    with pytest.raises(CircuitOpen):
+        breaker.check()
 
-    product: ProductInfo = await service.get_product_info("test", FAKE_AUTH_TOKEN)
-    assert product
-    assert product.product_id
+    time.sleep(0.05)
+    breaker.check()
+    breaker.success()
+    assert not breaker.is_open
+    breaker.check()
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import pytest
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.drova import (
+    PRODUCT_UUID_BG3,
+    REQUEST_LATENCY,
+    AuthTokenRejected,
+    DrovaService,
+    FakeDrova,
+)
+from drova_desktop_keenetic.common.drova_proxy import DrovaProxy, RateLimiter
+
+FAKE_AUTH_TOKEN = "test"
+
+
+def upstream_requests(fake_drova: FakeDrova, endpoint: str) -> int:
+    return REQUEST_LATENCY.count(api=fake_drova.faked_host, endpoint=endpoint)
+
+
+@pytest.mark.asyncio
+async def test_proxy_dedupe(fake_drova: FakeDrova):  # pylint: disable=W0621
+    config = Config(
+        drova_service_host=fake_drova.faked_host, proxy_listen="127.0.0.1:7987", proxy_rate=0, proxy_sessions_ttl=0.2
+    )
+    products = upstream_requests(fake_drova, "product")
+    sessions = upstream_requests(fake_drova, "sessions")
+
+    async with DrovaProxy(config):
+        pollers = [DrovaService("http://127.0.0.1:7987") for _ in range(3)]
+        try:
+            # same product asked by all pollers at once - one upstream request, then cached
+            for _ in range(2):
+                results = await asyncio.gather(
+                    *(poller.get_product_info(PRODUCT_UUID_BG3, FAKE_AUTH_TOKEN) for poller in pollers)
+                )
+                assert {product.product_id for product in results} == {PRODUCT_UUID_BG3}
+            assert upstream_requests(fake_drova, "product") - products == 1
+
+            # same sessions request reused while ttl
+            for poller in pollers:
+                assert await poller.get_latest_session("server", FAKE_AUTH_TOKEN)
+            assert upstream_requests(fake_drova, "sessions") - sessions == 1
+            await asyncio.sleep(0.2)
+            await pollers[0].get_latest_session("server", FAKE_AUTH_TOKEN)
+            assert upstream_requests(fake_drova, "sessions") - sessions == 2
+
+            # rejected token passed to poller, cached product not answered to token not accepted by drova api
+            fake_drova.auth_token = "other"
+            with pytest.raises(AuthTokenRejected):
+                await pollers[0].get_latest_session("server", "rejected")
+            with pytest.raises(AuthTokenRejected):
+                await pollers[0].get_product_info(PRODUCT_UUID_BG3, "rejected")
+            # rejection of one token not joined to request of accepted one
+            rejected, accepted = await asyncio.gather(
+                pollers[0].get_product_info(PRODUCT_UUID_BG3, "unknown"),
+                pollers[1].get_product_info(PRODUCT_UUID_BG3, "other"),
+                return_exceptions=True,
+            )
+            assert isinstance(rejected, AuthTokenRejected)
+            assert accepted.product_id == PRODUCT_UUID_BG3
+        finally:
+            for poller in pollers:
+                await poller.close()
+
+
+@pytest.mark.asyncio
+async def test_proxy_unix_socket(fake_drova: FakeDrova, tmp_path):  # pylint: disable=W0621
+    socket = tmp_path / "drova_proxy.sock"
+    config = Config(drova_service_host=fake_drova.faked_host, proxy_listen=f"unix:{socket}")
+
+    async with DrovaProxy(config):
+        async with DrovaService(f"unix:{socket}") as poller:
+            session = await poller.get_latest_session("server", FAKE_AUTH_TOKEN)
+            assert session == fake_drova.session.sessions[0]
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter():
+    limiter = RateLimiter(20)
+    started = time.monotonic()
+    waits = await asyncio.gather(*(limiter.wait() for _ in range(5)))
+    assert time.monotonic() - started >= 0.19
+    assert waits[0] == 0
+    assert waits == sorted(waits)
@@ -1,15 +1,36 @@
+import asyncio
 from logging import DEBUG, basicConfig
-from unittest.mock import AsyncMock
+from pathlib import PureWindowsPath
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
+from asyncssh import SSHCompletedProcess
 
 from drova_desktop_keenetic.common.config import Config
-from drova_desktop_keenetic.common.context import SessionHandlerContext
-from drova_desktop_keenetic.common.drova import StatusEnum
+from drova_desktop_keenetic.common.context import (
+    CURRENT_PATCHER,
+    CURRENT_TRANSITION,
+    PROCESS_WAIT,
+    SessionHandlerContext,
+)
+from drova_desktop_keenetic.common.drova import (
+    PRODUCT_UUID_DESKTOP,
+    ProductInfo,
+    StatusEnum,
+)
 from drova_desktop_keenetic.common.drova_session_transition import (
+    HOOK_LATENCY,
+    SESSION_START_LATENCY,
+    SESSION_STATE,
+    TRANSITIONS,
     DrovaSessionTransition,
 )
-from drova_desktop_keenetic.common.patch import ISessionHandler
+from drova_desktop_keenetic.common.patch import (
+    DIR_DELETE_LATENCY,
+    IClearDir,
+    ISessionHandler,
+)
+from drova_desktop_keenetic.common.patch_plan import PATCHER_PLANNED, ProductRules
 
 basicConfig(level=DEBUG)
 
@@ -47,6 +68,7 @@ async def test_drova_session_transition(mocker, fake_protector):
         p.on_session_start = AsyncMock()
         p.on_session_active = AsyncMock()
         p.on_session_end = AsyncMock()
+        p.session_start_kills = MagicMock(return_value=[])
 
     mocker.patch("drova_desktop_keenetic.common.drova_session_transition.make_patchers", return_value=patchers)
 
@@ -94,6 +116,7 @@ async def test_drova_session_transition_active_from_aborted(mocker, fake_protect
         p.on_session_start = AsyncMock()
         p.on_session_active = AsyncMock()
         p.on_session_end = AsyncMock()
+        p.session_start_kills = MagicMock(return_value=[])
 
     mocker.patch("drova_desktop_keenetic.common.drova_session_transition.make_patchers", return_value=patchers)
 
@@ -123,6 +146,7 @@ async def test_drova_session_transition_active(mocker, fake_protector):
         p.on_session_start = AsyncMock()
         p.on_session_active = AsyncMock()
         p.on_session_end = AsyncMock()
+        p.session_start_kills = MagicMock(return_value=[])
 
     mocker.patch("drova_desktop_keenetic.common.drova_session_transition.make_patchers", return_value=patchers)
 
@@ -137,3 +161,325 @@ async def test_drova_session_transition_active(mocker, fake_protector):
 
     for patch in patchers:
         patch.on_idle.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_drova_session_transition_parallel(mocker, fake_protector):
+    ctx = SessionHandlerContext(config=None, ssh=None, sftp=None)
+    events: list[str] = []
+    running = {"now": 0, "max": 0}
+
+    def make_patcher(name: str, priority: int, fail: bool = False) -> ISessionHandler:
+        class Patcher(ISessionHandler):
+            PRIORITY = priority
+
+            async def on_idle(self, ctx):
+                return None
+
+            async def on_session_start(self, ctx):
+                running["now"] += 1
+                running["max"] = max(running["max"], running["now"])
+                events.append(f"start {name}")
+                await asyncio.sleep(0.01)
+                running["now"] -= 1
+                events.append(f"end {name}")
+                if fail:
+                    raise RuntimeError(name)
+
+            async def on_session_active(self, ctx):
+                return None
+
+            async def on_session_end(self, ctx):
+                return None
+
+        return Patcher(Config())
+
+    patchers = [
+        make_patcher("a", 50),
+        make_patcher("b", 50, fail=True),
+        make_patcher("c", 50),
+        make_patcher("d", 50),
+        make_patcher("obs", 100),
+    ]
+    mocker.patch("drova_desktop_keenetic.common.drova_session_transition.make_patchers", return_value=patchers)
+
+    session_manager = DrovaSessionTransition(None, fake_protector, Config(patcher_concurrency=2))
+    await session_manager.set_status(StatusEnum.NEW, ctx)
+
+    # limited concurrency inside priority group, failed patcher not stop others
+    assert running["max"] == 2
+    assert {event for event in events if event.startswith("end")} == {"end a", "end b", "end c", "end d", "end obs"}
+    # next priority group starts after previous finished
+    assert events[-2:] == ["start obs", "end obs"]
+
+
+@pytest.mark.asyncio
+async def test_drova_session_transition_warmup(mocker, fake_protector):
+    ssh = object()
+    ctx = SessionHandlerContext(config=Config(), ssh=ssh, sftp=None)
+    prepared: list[str | None] = []
+
+    class Patcher(ISessionHandler):
+        async def on_idle(self, ctx):
+            return None
+
+        async def on_warmup(self, ctx):
+            await asyncio.sleep(0.01)
+            ctx.warmup["patcher"] = "staged"
+
+        async def on_session_start(self, ctx):
+            prepared.append(ctx.take_warm("patcher"))
+
+        async def on_session_active(self, ctx):
+            return None
+
+        async def on_session_end(self, ctx):
+            return None
+
+    patcher = Patcher(Config())
+    on_warmup = mocker.spy(patcher, "on_warmup")
+    mocker.patch("drova_desktop_keenetic.common.drova_session_transition.make_patchers", return_value=[patcher])
+
+    session_manager = DrovaSessionTransition(None, fake_protector, Config(session_warmup=True))
+    session_manager.warmup(ctx)
+    # once per connection
+    session_manager.warmup(ctx)
+    # session start wait running warmup and use it
+    await session_manager.set_status(StatusEnum.NEW, ctx)
+    assert on_warmup.await_count == 1
+    assert prepared == ["staged"]
+    assert not ctx.warmup
+
+    # not warm while session
+    session_manager.warmup(ctx)
+    assert on_warmup.await_count == 1
+
+    await session_manager.set_status(StatusEnum.ACTIVE, ctx)
+    await session_manager.set_status(StatusEnum.FINISHED, ctx)
+    await session_manager.set_status(None, ctx)
+    await session_manager.set_status(StatusEnum.NEW, ctx)
+    assert prepared == ["staged", None]
+
+    disabled = DrovaSessionTransition(None, fake_protector, Config(session_warmup=False))
+    disabled.warmup(SessionHandlerContext(config=Config(), ssh=object(), sftp=None))
+    assert on_warmup.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_drova_session_transition_metrics(mocker, fake_protector):
+    config = Config(windows_host="metrics-host")
+    ctx = SessionHandlerContext(config=config, ssh=None, sftp=None)
+    seen: list[tuple[str, str]] = []
+
+    class Recorder(ISessionHandler):
+        async def on_idle(self, ctx):
+            return None
+
+        async def on_session_start(self, ctx):
+            seen.append((CURRENT_PATCHER.get(), CURRENT_TRANSITION.get()))
+
+        async def on_session_active(self, ctx):
+            return None
+
+        async def on_session_end(self, ctx):
+            return None
+
+    mocker.patch(
+        "drova_desktop_keenetic.common.drova_session_transition.make_patchers", return_value=[Recorder(config)]
+    )
+
+    session_manager = DrovaSessionTransition(None, fake_protector, config)
+    assert SESSION_STATE.value(host="metrics-host", state="NONE_SESSION") == 1
+    await session_manager.set_status(StatusEnum.NEW, ctx)
+
+    assert seen == [("Recorder", "SESSION_START")]
+    # labels not leak out of transition
+    assert (CURRENT_PATCHER.get(), CURRENT_TRANSITION.get()) == ("none", "none")
+    assert HOOK_LATENCY.count(
+        host="metrics-host", patcher="Recorder", hook="on_session_start", transition="SESSION_START"
+    )
+    assert HOOK_LATENCY.count(
+        host="metrics-host", patcher="FakeProtector", hook="on_session_start", transition="SESSION_START"
+    )
+    assert TRANSITIONS.value(host="metrics-host", transition="SESSION_START") == 1
+    assert SESSION_STATE.value(host="metrics-host", state="NONE_SESSION") == 0
+    assert SESSION_STATE.value(host="metrics-host", state="SESSION_START") == 1
+
+
+@pytest.mark.asyncio
+async def test_drova_session_transition_batch(mocker, fake_protector):
+    class Launcher(IClearDir):
+        TASKKILL_IMAGE = "launcher.exe"
+        remote_dir_clear = PureWindowsPath(r"AppData\Local\Launcher")
+
+    class Browser(IClearDir):
+        TASKKILL_IMAGE = "browser.exe"
+        remote_dir_clear = PureWindowsPath(r"AppData\Local\Browser")
+
+    running = ['"System","4","Services","0","1 234 K"', '"Launcher.exe","1200","Console","1","50 000 K"']
+
+    async def run(command: str, **_) -> SSHCompletedProcess:
+        if command.startswith("tasklist"):
+            stdout = "\r\n".join(running)
+        elif command.startswith("taskkill"):
+            # exit not at once - seen by first wait poll
+            asyncio.get_running_loop().call_later(0.01, running.pop)
+            stdout = ""
+        else:
+            stdout = "".join(f"__drova_batch_{i}_0\r\n" for i in range(command.count("__drova_batch")))
+        return SSHCompletedProcess(
+            env=None, command=command, subsystem=None, exit_status=0, returncode=0, stdout=stdout, stderr=""
+        )
+
+    config = Config(windows_host="batch-host", patchers_prune=False)
+    ssh = AsyncMock()
+    ssh.run = AsyncMock(side_effect=run)
+    ctx = SessionHandlerContext(config=config, ssh=ssh, sftp=None)
+    mocker.patch(
+        "drova_desktop_keenetic.common.drova_session_transition.make_patchers",
+        return_value=[Launcher(config), Browser(config)],
+    )
+
+    await DrovaSessionTransition(None, fake_protector, config).set_status(StatusEnum.NEW, ctx)
+
+    # one snapshot, only running launcher killed and waited, all directories removed by one call
+    tasklist, kill, *waits, clear = (call.args[0] for call in ssh.run.await_args_list)
+    assert tasklist == "tasklist /FO CSV /NH"
+    assert kill == "taskkill.exe /f /IM launcher.exe"
+    assert len(waits) >= 2 and set(waits) == {"tasklist /FO CSV /NH"}
+    assert r"ren AppData\Local\Launcher Launcher.drova-tombstone-" in clear
+    assert r"ren AppData\Local\Browser Browser.drova-tombstone-" in clear
+    assert HOOK_LATENCY.count(
+        host="batch-host", patcher="CommandBatch", hook="on_session_start", transition="SESSION_START"
+    )
+    assert PROCESS_WAIT.count(
+        host="batch-host", patcher="none", transition="SESSION_START", wait="exit", outcome="done"
+    )
+
+
+@pytest.mark.asyncio
+async def test_drova_session_transition_plan(mocker, fake_protector):
+    class Launcher(IClearDir):
+        TASKKILL_IMAGE = "launcher.exe"
+        remote_dir_clear = PureWindowsPath(r"AppData\Local\Launcher")
+
+    class Missing(IClearDir):
+        TASKKILL_IMAGE = "missing.exe"
+        remote_dir_clear = PureWindowsPath(r"AppData\Local\Missing")
+
+    class Always(ISessionHandler):
+        async def on_idle(self, ctx):
+            return None
+
+        async def on_session_start(self, ctx):
+            return None
+
+        async def on_session_active(self, ctx):
+            return None
+
+        async def on_session_end(self, ctx):
+            return None
+
+    async def run(command: str, check: bool = False) -> SSHCompletedProcess:
+        if "if exist" in command:
+            checks = command.split(" & ")
+            stdout = "".join(f"__drova_exists_{i}\r\n" for i, check in enumerate(checks) if "Launcher" in check)
+        elif "__drova_batch" in command:
+            stdout = "".join(f"__drova_batch_{i}_0\r\n" for i in range(command.count("__drova_batch")))
+        else:
+            stdout = ""
+        return SSHCompletedProcess(
+            env=None, command=command, subsystem=None, exit_status=0, returncode=0, stdout=stdout, stderr=""
+        )
+
+    config = Config(windows_host="plan-host")
+    ssh = AsyncMock()
+    ssh.run = AsyncMock(side_effect=run)
+    ctx = SessionHandlerContext(config=config, ssh=ssh, sftp=None)
+    always = Always(config)
+    always.on_session_start = AsyncMock()
+    mocker.patch(
+        "drova_desktop_keenetic.common.drova_session_transition.make_patchers",
+        return_value=[Launcher(config), Missing(config), always],
+    )
+
+    session_manager = DrovaSessionTransition(None, fake_protector, config)
+    await session_manager.set_status(StatusEnum.NEW, ctx)
+
+    commands = [call.args[0] for call in ssh.run.await_args_list]
+    scans = [command for command in commands if "if exist" in command]
+    assert len(scans) == 1 and r"AppData\Local\Missing" in scans[0]
+    # not installed launcher - not killed, not removed
+    assert not any("Missing" in command or "missing.exe" in command for command in commands if command not in scans)
+    assert any(r"ren AppData\Local\Launcher" in command for command in commands)
+    always.on_session_start.assert_awaited_once()
+    assert PATCHER_PLANNED.value(host="plan-host", patcher="Launcher") == 1
+    assert PATCHER_PLANNED.value(host="plan-host", patcher="Missing") == 0
+    assert SESSION_START_LATENCY.count(host="plan-host", category="other") == 1
+
+    # inventory scanned again after session
+    await session_manager.set_status(StatusEnum.FINISHED, ctx)
+    await session_manager.set_status(None, ctx)
+    await session_manager.set_status(StatusEnum.NEW, ctx)
+    assert len([call for call in ssh.run.await_args_list if "if exist" in call.args[0]]) == 2
+
+    # desktop product - product rules not applied, inventory still pruned
+    ssh.run.reset_mock()
+    desktop = ProductInfo(product_id=PRODUCT_UUID_DESKTOP, title="Desktop", use_default_desktop=True)
+    desktop_ctx = SessionHandlerContext(config=config, ssh=ssh, sftp=None, product=desktop)
+    product_rules = mocker.patch.object(ProductRules, "prune")
+    await DrovaSessionTransition(None, fake_protector, config).set_status(StatusEnum.NEW, desktop_ctx)
+    product_rules.assert_not_called()
+    assert any("if exist" in call.args[0] for call in ssh.run.await_args_list)
+    assert any(r"ren AppData\Local\Launcher" in call.args[0] for call in ssh.run.await_args_list)
+    assert not any(r"ren AppData\Local\Missing" in call.args[0] for call in ssh.run.await_args_list)
+
+    # full set forced
+    ssh.run.reset_mock()
+    full = Config(windows_host="plan-host", patchers_prune=False)
+    await DrovaSessionTransition(None, fake_protector, full).set_status(StatusEnum.NEW, ctx)
+    assert any(r"ren AppData\Local\Missing" in call.args[0] for call in ssh.run.await_args_list)
+
+
+@pytest.mark.asyncio
+async def test_wait_exit_timeout():
+    async def run(command: str, **_) -> SSHCompletedProcess:
+        return SSHCompletedProcess(
+            env=None,
+            command=command,
+            subsystem=None,
+            exit_status=0,
+            returncode=0,
+            stdout='"obs64.exe","5520","Console","1","120 512 K"\r\n',
+            stderr="",
+        )
+
+    ssh = AsyncMock()
+    ssh.run = AsyncMock(side_effect=run)
+    ctx = SessionHandlerContext(config=Config(windows_host="wait-host"), ssh=ssh, sftp=None)
+
+    assert await ctx.wait_exit(pids=[5520], timeout=0.2) >= 0.2
+    assert PROCESS_WAIT.count(host="wait-host", patcher="none", transition="none", wait="exit", outcome="timeout")
+    assert await ctx.wait_exit(images=["steam.exe"], pids=[1]) < 0.2
+    assert await ctx.wait_started("obs64.exe", timeout=1) == [5520]
+
+
+@pytest.mark.asyncio
+async def test_clear_dir_purge_on_warmup():
+    class Browser(IClearDir):
+        TASKKILL_IMAGE = "browser.exe"
+        remote_dir_clear = PureWindowsPath(r"AppData\Local\Browser\User Data")
+
+    ssh = AsyncMock()
+    ctx = SessionHandlerContext(config=Config(windows_host="purge-host"), ssh=ssh, sftp=None)
+    browser = Browser(ctx.config)
+    await browser.on_warmup(ctx)
+    await browser._purge_task  # pylint: disable=W0212
+
+    ssh.run.assert_awaited_once_with(
+        r'for /D %d in ("AppData\Local\Browser\User Data.drova-tombstone-*") do rmdir /S /Q "%~d"', check=False
+    )
+    assert DIR_DELETE_LATENCY.count(host="purge-host", patcher="Browser", operation="purge") == 1
+
+    slow = Browser(Config(fast_delete=False))
+    assert [str(command) for command in slow.batch_commands()] == [r'rmdir /S /Q "AppData\Local\Browser\User Data"']
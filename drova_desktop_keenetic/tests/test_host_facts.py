@@ -0,0 +1,104 @@
+from pathlib import Path
+from unittest.mock import AsyncMock
+
+import pytest
+from asyncssh import SSHCompletedProcess
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.context import SessionHandlerContext
+from drova_desktop_keenetic.common.host_facts import HostFacts
+
+DROVA_MONITOR = "DISPLAY\\DRO00DD\\1&28A6823A&0&UID256"
+
+
+def fake_host(boot_id: str, monitors: list[str] | None = None) -> AsyncMock:
+    """ssh of windows with current BootId, fixed drives C and D, drova monitor (or monitors of list changed by test)"""
+
+    async def run(command: str, **_) -> SSHCompletedProcess:
+        if "BootId" in command:
+            return SSHCompletedProcess(
+                exit_status=0,
+                stdout=f"\r\nHKEY_LOCAL_MACHINE\\...\\PrefetchParameters\r\n    BootId    REG_DWORD    {boot_id}\r\n",
+            )
+        assert "wmic" in command
+        return SSHCompletedProcess(
+            exit_status=0,
+            stdout=(
+                "__drova_batch_start_0_10:00:00.00\r\n"
+                "Name  \r\r\nC:    \r\r\nD:    \r\r\n\r\r\n__drova_batch_0_0_10:00:00.20\r\n"
+                "PNPDeviceID\r\r\n"
+                + "".join(f"{monitor}\r\r\n" for monitor in (monitors if monitors is not None else [DROVA_MONITOR]))
+                + "\r\r\n__drova_batch_1_0_10:00:00.40\r\n"
+            ),
+        )
+
+    ssh = AsyncMock()
+    ssh.run.side_effect = run
+    return ssh
+
+
+@pytest.mark.asyncio
+async def test_host_facts_boot_scoped(tmp_path: Path):
+    location = tmp_path / "facts.json"
+    ctx = SessionHandlerContext(config=Config(), ssh=fake_host("0x1a3"), sftp=None, facts=HostFacts(location))
+
+    facts = await ctx.facts.ensure(ctx)
+    assert facts.get(HostFacts.DRIVES) == "CD"
+    assert facts.get(HostFacts.MONITORS) == [DROVA_MONITOR]
+    facts.set("drova_monitor", "\\\\?\\DISPLAY#DRO00DD")
+    assert ctx.ssh.run.call_count == 2  # boot id + one batch of wmic
+
+    # boot checked once per connection
+    await ctx.facts.ensure(ctx)
+    assert ctx.ssh.run.call_count == 2
+
+    # same boot after restart of service - facts from file
+    ctx = SessionHandlerContext(config=Config(), ssh=fake_host("0x1a3"), sftp=None, facts=HostFacts(location))
+    facts = await ctx.facts.ensure(ctx)
+    assert facts.get("drova_monitor") == "\\\\?\\DISPLAY#DRO00DD"
+    assert ctx.ssh.run.call_count == 1
+
+    # reboot - facts of previous boot not used
+    ctx.ssh = fake_host("0x1a4")
+    facts = await ctx.facts.ensure(ctx)
+    assert facts.boot_id == "0x1a4"
+    assert facts.get("drova_monitor") is None
+    assert facts.get(HostFacts.DRIVES) == "CD"
+    assert ctx.ssh.run.call_count == 2
+
+    # drives not known (failed query) - queried again, even with other facts known
+    facts.set("drova_monitor", "\\\\?\\DISPLAY#DRO00DD")
+    facts.forget(HostFacts.DRIVES)
+    await ctx.facts.ensure(ctx)
+    assert facts.get(HostFacts.DRIVES) == "CD"
+    assert ctx.ssh.run.call_count == 3
+
+    location.write_text("{broken", encoding="utf8")
+    assert HostFacts(location).boot_id is None
+
+
+@pytest.mark.asyncio
+async def test_obs_waits_drova_monitor(mocker):
+    # import of patcher not registers it for other tests
+    mocker.patch("drova_desktop_keenetic.common.patch._ALL_PATCHES", [])
+    from drova_desktop_keenetic.patches.obs import (  # pylint: disable=C0415
+        ObsRecordDesktop,
+    )
+
+    monitors: list[str] = []
+    ctx = SessionHandlerContext(config=Config(), ssh=fake_host("0x1a3", monitors), sftp=None)
+    obs = ObsRecordDesktop(Config(obs_remote_url="rtmp://127.0.0.1/live"))
+    # path known from warmup, monitor not created yet
+    facts = await ctx.facts.ensure(ctx)
+    facts.set(ObsRecordDesktop.MONITOR_FACT, "\\\\?\\DISPLAY#DRO00DD#cached")
+    run = ctx.ssh.run.side_effect
+
+    async def create_monitor(command: str, **kwargs) -> SSHCompletedProcess:
+        # monitor created while obs waits it
+        if ctx.ssh.run.call_count == 4:
+            monitors.append(DROVA_MONITOR)
+        return await run(command, **kwargs)
+
+    ctx.ssh.run.side_effect = create_monitor
+    assert await obs._wait_drova_monitor(ctx) == "\\\\?\\DISPLAY#DRO00DD#cached"  # pylint: disable=W0212
+    assert ctx.ssh.run.call_count == 4  # boot id, query of warmup, query without monitor, query with monitor
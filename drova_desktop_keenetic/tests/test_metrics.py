@@ -0,0 +1,69 @@
+import aiohttp
+import pytest
+
+from drova_desktop_keenetic.common.metrics import MetricsRegistry
+from drova_desktop_keenetic.common.metrics_server import MetricsServer
+
+
+def test_counter():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "test")
+    counter.inc(host="a")
+    counter.inc(2, host="a")
+    counter.inc(host="b")
+
+    assert registry.counter("test_total", "test") is counter
+    assert counter.value(host="a") == 3
+    assert counter.value(host="c") == 0
+    assert counter.total() == 4
+
+    with pytest.raises(TypeError):
+        registry.histogram("test_total", "test")
+
+
+def test_histogram_percentile():
+    histogram = MetricsRegistry().histogram("test_seconds", "test", buckets=(0.5, 1.0, float("inf")))
+    assert histogram.percentile(50) is None
+
+    for value in range(1, 101):
+        histogram.observe(value / 100)
+
+    assert histogram.count() == 100
+    assert histogram.percentile(50) == 0.5
+    assert histogram.percentile(99) == 0.99
+    assert histogram.percentile(100) == 1.0
+
+
+def test_render():
+    registry = MetricsRegistry()
+    registry.counter("test_total", "test counter").inc(host='a"b')
+    registry.gauge("test_state", "test gauge").set(1, state="NONE_SESSION")
+    registry.histogram("test_seconds", "test histogram", buckets=(0.5, float("inf"))).observe(0.25, host="a")
+
+    assert registry.render().splitlines() == [
+        "# HELP test_total test counter",
+        "# TYPE test_total counter",
+        'test_total{host="a\\"b"} 1.0',
+        "# HELP test_state test gauge",
+        "# TYPE test_state gauge",
+        'test_state{state="NONE_SESSION"} 1.0',
+        "# HELP test_seconds test histogram",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{host="a",le="0.5"} 1.0',
+        'test_seconds_bucket{host="a",le="+Inf"} 1.0',
+        'test_seconds_sum{host="a"} 0.25',
+        'test_seconds_count{host="a"} 1.0',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_metrics_server(unused_tcp_port):
+    registry = MetricsRegistry()
+    registry.counter("test_total", "test").inc()
+
+    async with MetricsServer(f"127.0.0.1:{unused_tcp_port}", registry):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{unused_tcp_port}/metrics") as response:
+                assert response.status == 200
+                assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+                assert "test_total 1.0" in await response.text()
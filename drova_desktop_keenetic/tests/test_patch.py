@@ -0,0 +1,202 @@
+import hashlib
+import json
+from pathlib import Path, PureWindowsPath
+from unittest.mock import AsyncMock
+
+import pytest
+from asyncssh import SFTPAttrs, SFTPNoSuchFile, SSHCompletedProcess
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.context import SessionHandlerContext
+from drova_desktop_keenetic.common.fingerprint_cache import (
+    FINGERPRINT_HITS,
+    Fingerprint,
+    FingerprintCache,
+)
+from drova_desktop_keenetic.common.patch import PATCH_BYTES, IPatch, PrefetchedFile
+
+SETTINGS = {"login": "user", "at": "1", "atet": "2", "rt": "3", "language": "ru"}
+
+
+# not registered by @patcher - registry of real patchers checked by test_basic_patchers
+class BsgLauncher(IPatch):
+    TASKKILL_IMAGE = ""
+    remote_file_location = PureWindowsPath(r"AppData\Roaming\Battlestate Games\BsgLauncher\settings")
+
+    async def _patch_content(self, content: bytes, ctx: SessionHandlerContext) -> bytes:
+        settings = json.loads(content)
+        for key in ("login", "at", "atet", "rt"):
+            settings.pop(key, None)
+        return json.dumps(settings).encode()
+
+
+class FakeFile:
+    def __init__(self, sftp: "FakeSFTP", path: str, mode: str):
+        self._sftp = sftp
+        self._path = path
+        if "w" in mode:
+            sftp.files[path] = b""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        return None
+
+    async def read(self, size: int = -1) -> bytes:
+        content = self._sftp.files[self._path]
+        return content if size < 0 else content[:size]
+
+    async def write(self, data: bytes) -> None:
+        self._sftp.files[self._path] += data
+
+
+class FakeSFTP:
+    def __init__(self, files: dict[str, bytes]):
+        self.files = files
+        self.calls: list[str] = []
+
+    async def stat(self, path: str) -> SFTPAttrs:
+        if path not in self.files:
+            raise SFTPNoSuchFile(path)
+        return SFTPAttrs(size=len(self.files[path]), mtime=1)
+
+    def open(self, path: str, mode: str) -> FakeFile:
+        self.calls.append(f"open {mode}")
+        return FakeFile(self, path, mode)
+
+    async def get(self, path: str, local: str) -> None:
+        self.calls.append("get")
+        Path(local).write_bytes(self.files[path])
+
+    async def put(self, local: str, path: str) -> None:
+        self.calls.append("put")
+        self.files[path] = Path(local).read_bytes()
+
+
+def make_ctx(sftp: FakeSFTP, **config) -> SessionHandlerContext:
+    return SessionHandlerContext(config=Config(windows_host="ipatch", **config), ssh=AsyncMock(), sftp=sftp)
+
+
+def patched(sftp: FakeSFTP) -> dict:
+    return json.loads(sftp.files[str(BsgLauncher.remote_file_location)])
+
+
+@pytest.mark.asyncio
+async def test_ipatch_memory():
+    sftp = FakeSFTP({str(BsgLauncher.remote_file_location): json.dumps(SETTINGS).encode()})
+    await BsgLauncher(Config()).patch(make_ctx(sftp))
+
+    assert patched(sftp) == {"language": "ru"}
+    assert sftp.calls == ["open rb", "open wb"]
+    assert PATCH_BYTES.count(host="ipatch", patcher="BsgLauncher", mode="memory") == 1
+
+
+@pytest.mark.asyncio
+async def test_ipatch_temp_file_above_limit():
+    sftp = FakeSFTP({str(BsgLauncher.remote_file_location): json.dumps(SETTINGS).encode()})
+    await BsgLauncher(Config()).patch(make_ctx(sftp, ipatch_memory_limit=10))
+
+    assert patched(sftp) == {"language": "ru"}
+    assert sftp.calls == ["get", "put"]
+    assert PATCH_BYTES.count(host="ipatch", patcher="BsgLauncher", mode="file") == 1
+
+
+@pytest.mark.asyncio
+async def test_ipatch_prefetched():
+    content = json.dumps(SETTINGS).encode()
+    sftp = FakeSFTP({str(BsgLauncher.remote_file_location): content})
+    ctx = make_ctx(sftp)
+    ctx.warmup["BsgLauncher"] = PrefetchedFile(size=len(content), mtime=1, content=content)
+
+    await BsgLauncher(Config()).patch(ctx)
+
+    assert patched(sftp) == {"language": "ru"}
+    assert sftp.calls == ["open wb"]
+
+
+def certutil(sftp: FakeSFTP, location: PureWindowsPath = BsgLauncher.remote_file_location) -> AsyncMock:
+    async def run(command: str, **_) -> SSHCompletedProcess:
+        digest = hashlib.sha256(sftp.files[str(location)]).hexdigest()
+        return SSHCompletedProcess(
+            env=None, command=command, subsystem=None, exit_status=0, returncode=0, stdout=f"hash:\r\n{digest}\r\n"
+        )
+
+    return AsyncMock(side_effect=run)
+
+
+@pytest.mark.asyncio
+async def test_ipatch_skip_clean():
+    sftp = FakeSFTP({str(BsgLauncher.remote_file_location): json.dumps(SETTINGS).encode()})
+    ctx = make_ctx(sftp)
+    ctx.ssh.run = certutil(sftp)
+    await BsgLauncher(Config()).patch(ctx)
+    assert sftp.calls == ["open rb", "open wb"]
+    ctx.ssh.run.assert_not_awaited()
+
+    sftp.calls.clear()
+    await BsgLauncher(Config()).patch(ctx)
+    assert not sftp.calls
+    assert ctx.ssh.run.await_args.args[0].startswith("certutil -hashfile")
+    assert FINGERPRINT_HITS.value(host="ipatch", patcher="BsgLauncher") == 1
+
+    # same size and mtime, other content
+    sftp.files[str(BsgLauncher.remote_file_location)] = json.dumps({"language": "en"}).encode()
+    await BsgLauncher(Config()).patch(ctx)
+    assert sftp.calls == ["open rb"]
+
+    sftp.calls.clear()
+    ctx.config.ipatch_force_refresh = True
+    await BsgLauncher(Config()).patch(ctx)
+    assert sftp.calls == ["open rb"]
+    assert FINGERPRINT_HITS.value(host="ipatch", patcher="BsgLauncher") == 1
+
+
+@pytest.mark.asyncio
+async def test_battlenet_logout_when_clean(mocker):
+    # import of patchers not registers them for other tests
+    mocker.patch("drova_desktop_keenetic.common.patch._ALL_PATCHES", [])
+    from drova_desktop_keenetic.patches.basic import (  # pylint: disable=C0415
+        BattleNet,
+    )
+
+    apply = mocker.patch("drova_desktop_keenetic.patches.basic.RegistryBatch.apply", AsyncMock(return_value=[]))
+    sftp = FakeSFTP(
+        {str(BattleNet.remote_file_location): json.dumps({"Client": {"SavedAccountNames": "user"}}).encode()}
+    )
+    ctx = make_ctx(sftp)
+    ctx.ssh.run = certutil(sftp, BattleNet.remote_file_location)
+    battlenet = BattleNet(Config())
+
+    for _ in range(2):
+        await battlenet.on_session_start(ctx)
+    # config clean after first session - not patched again, account still removed
+    assert FINGERPRINT_HITS.value(host="ipatch", patcher="BattleNet") == 1
+    assert json.loads(sftp.files[str(BattleNet.remote_file_location)]) == {}
+    commands = [call.args[0] for call in ctx.ssh.run.await_args_list]
+    assert len([command for command in commands if r"Battle.net\Account" in command]) == 2
+    assert apply.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_ipatch_already_clean_not_written():
+    sftp = FakeSFTP({str(BsgLauncher.remote_file_location): json.dumps({"language": "ru"}).encode()})
+    ctx = make_ctx(sftp, ipatch_memory_limit=10)
+    await BsgLauncher(Config()).patch(ctx)
+
+    assert sftp.calls == ["get"]
+    digest = hashlib.sha256(sftp.files[str(BsgLauncher.remote_file_location)]).hexdigest()
+    assert ctx.fingerprints.find(str(BsgLauncher.remote_file_location), 18, 1) == Fingerprint(18, 1, digest)
+
+
+def test_fingerprint_cache_persisted(tmp_path: Path):
+    location = tmp_path / "fingerprints.json"
+    cache = FingerprintCache(location, max_per_file=2)
+    for mtime in range(3):
+        cache.record("settings", Fingerprint(size=10, mtime=mtime, sha256="00"))
+
+    restored = FingerprintCache(location)
+    assert restored.find("settings", 10, 0) is None
+    assert restored.find("settings", 10, 2) == Fingerprint(size=10, mtime=2, sha256="00")
+    restored.forget("settings")
+    assert FingerprintCache(location).find("settings", 10, 2) is None
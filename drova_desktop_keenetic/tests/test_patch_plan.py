@@ -0,0 +1,103 @@
+from pathlib import PureWindowsPath
+from uuid import uuid4
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.drova import PRODUCT_UUID_DESKTOP, ProductInfo
+from drova_desktop_keenetic.common.patch import ISessionHandler
+from drova_desktop_keenetic.common.patch_plan import (
+    PatchPlan,
+    ProductRules,
+    prune_not_installed,
+)
+
+
+class Handler(ISessionHandler):
+    async def on_idle(self, ctx):
+        return None
+
+    async def on_session_start(self, ctx):
+        return None
+
+    async def on_session_active(self, ctx):
+        return None
+
+    async def on_session_end(self, ctx):
+        return None
+
+
+# same names as real patchers - rules use names
+class SteamAuthDiscard(Handler):
+    @property
+    def inventory(self) -> list[PureWindowsPath]:
+        return [PureWindowsPath(r"c:\Program Files (x86)\Steam\config\loginusers.vdf")]
+
+
+class EpicGamesAuthDiscard(Handler):
+    pass
+
+
+class Chrome(Handler):
+    pass
+
+
+def make_plan() -> PatchPlan:
+    return PatchPlan(patchers=[SteamAuthDiscard(Config()), EpicGamesAuthDiscard(Config()), Chrome(Config())])
+
+
+def names(plan: PatchPlan) -> list[str]:
+    return [patch.__class__.__name__ for patch in plan.patchers]
+
+
+def test_product_rules():
+    rules = ProductRules()
+
+    desktop = ProductInfo(product_id=PRODUCT_UUID_DESKTOP, use_default_desktop=True)
+    plan = make_plan()
+    rules.prune(plan, desktop)
+    assert rules.category(desktop) == "desktop"
+    assert names(plan) == ["SteamAuthDiscard", "EpicGamesAuthDiscard", "Chrome"]
+
+    # steam title - other launchers skipped, browsers needed by every product
+    steam = ProductInfo(
+        product_id=uuid4(),
+        game_path=PureWindowsPath(r"C:\Program Files (x86)\Steam\steamapps\common\Baldurs Gate 3\bin\bg3.exe"),
+        title="Baldur's Gate 3",
+    )
+    plan = make_plan()
+    rules.prune(plan, steam)
+    assert rules.category(steam) == "steam"
+    assert names(plan) == ["SteamAuthDiscard", "Chrome"]
+    assert plan.skipped == {"EpicGamesAuthDiscard": "not used by steam product Baldur's Gate 3"}
+
+    # steam title with desktop - client can log into any launcher
+    steam_desktop = steam.model_copy(update={"product_id": uuid4(), "use_default_desktop": True})
+    plan = make_plan()
+    rules.prune(plan, steam_desktop)
+    assert rules.category(steam_desktop) == "steam"
+    assert not plan.skipped
+
+    epic = ProductInfo(product_id=uuid4(), game_path=PureWindowsPath(r"D:\Games\Fortnite.exe"), args="-EpicPortal")
+    assert rules.category(epic) == "epic"
+
+    # unknown product - all launchers
+    unknown = ProductInfo(product_id=uuid4(), game_path=PureWindowsPath(r"D:\Games\game.exe"))
+    plan = make_plan()
+    rules.prune(plan, unknown)
+    assert rules.category(unknown) == rules.category(None) == "other"
+    assert not plan.skipped
+
+    # rule of product cached by product_id
+    steam.game_path = PureWindowsPath(r"D:\Games\game.exe")
+    assert rules.category(steam) == "steam"
+
+
+def test_prune_not_installed():
+    plan = make_plan()
+    prune_not_installed(plan, {r"c:\Program Files (x86)\Steam\config\loginusers.vdf": False})
+    assert names(plan) == ["EpicGamesAuthDiscard", "Chrome"]
+    assert "SteamAuthDiscard - not installed" in plan.report()
+
+    # path not scanned - treated as installed
+    plan = make_plan()
+    prune_not_installed(plan, {})
+    assert not plan.skipped
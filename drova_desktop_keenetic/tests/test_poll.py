@@ -1,31 +1,40 @@
+import asyncio
 from datetime import datetime
 from logging import DEBUG, basicConfig
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 from asyncssh import SSHCompletedProcess
 
 from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.credentials import Credentials
 from drova_desktop_keenetic.common.drova import (
     CLIENT_UUID_FAKE,
     PRODUCT_UUID_BG3,
     PRODUCT_UUID_DESKTOP,
     SESSION_UUID_FAKE,
-    DrovaService,
+    AuthTokenRejected,
     FakeDrova,
     ProductInfo,
     SessionsEntity,
     SessionsResponse,
     StatusEnum,
 )
-from drova_desktop_keenetic.common.drova_poll import DrovaPoll
+from drova_desktop_keenetic.common.drova_poll import COLD_START, DrovaPoll
+from drova_desktop_keenetic.common.drova_session_transition import (
+    RESUME_LATENCY,
+    SessionState,
+)
 from drova_desktop_keenetic.common.helpers import RebootRequired
+from drova_desktop_keenetic.common.transition_journal import TransitionJournal
+
+from .test_remote_shell import FakeCmd
 
 basicConfig(level=DEBUG)
 
 
 @pytest.mark.asyncio
-async def test_poll_full(fake_drova: FakeDrova):
+async def test_poll_full(fake_drova: FakeDrova, drova_services):
     ssh = AsyncMock()
     sftp = AsyncMock()
 
@@ -34,12 +43,13 @@ async def test_poll_full(fake_drova: FakeDrova):
     patcher.on_session_start = AsyncMock()
     patcher.on_session_active = AsyncMock()
     patcher.on_session_end = AsyncMock()
+    patcher.session_start_kills = MagicMock(return_value=[])
 
     config = Config(windows_host="127.0.0.1")
     drova_poll = DrovaPoll(config)
     drova_poll.ctx.ssh = ssh
     drova_poll.ctx.sftp = sftp
-    drova_poll.drova_service = DrovaService(fake_drova.faked_host)
+    drova_poll.drova_service = drova_services()
     drova_poll.drova_transition._patchers = [patcher]  # pylint: disable=W0212
     drova_poll.get_server_id = AsyncMock(return_value=str(SESSION_UUID_FAKE))
     drova_poll.get_auth_token = AsyncMock(return_value=str(SESSION_UUID_FAKE))
@@ -103,7 +113,7 @@ async def test_poll_full(fake_drova: FakeDrova):
 
 
 @pytest.mark.asyncio
-async def test_poll_active_to_none_from_finished(fake_drova: FakeDrova):
+async def test_poll_active_to_none_from_finished(fake_drova: FakeDrova, drova_services):
     ssh = AsyncMock()
     sftp = AsyncMock()
 
@@ -112,12 +122,13 @@ async def test_poll_active_to_none_from_finished(fake_drova: FakeDrova):
     patcher.on_session_start = AsyncMock()
     patcher.on_session_active = AsyncMock()
     patcher.on_session_end = AsyncMock()
+    patcher.session_start_kills = MagicMock(return_value=[])
 
     config = Config(windows_host="127.0.0.1")
     drova_poll = DrovaPoll(config)
     drova_poll.ctx.ssh = ssh
     drova_poll.ctx.sftp = sftp
-    drova_poll.drova_service = DrovaService(fake_drova.faked_host)
+    drova_poll.drova_service = drova_services()
     drova_poll.drova_transition._patchers = [patcher]  # pylint: disable=W0212
     drova_poll.get_server_id = AsyncMock(return_value=str(SESSION_UUID_FAKE))
     drova_poll.get_auth_token = AsyncMock(return_value=str(SESSION_UUID_FAKE))
@@ -159,7 +170,51 @@ async def test_poll_active_to_none_from_finished(fake_drova: FakeDrova):
 
 
 @pytest.mark.asyncio
-async def test_poll_active_to_none(fake_drova: FakeDrova):
+async def test_poll_warmup_after_finished(fake_drova: FakeDrova, drova_services):
+    patcher = AsyncMock()
+    config = Config(windows_host="127.0.0.1", session_warmup=True, patchers_prune=False)
+    drova_poll = DrovaPoll(config)
+    drova_poll.ctx.ssh = AsyncMock()
+    drova_poll.ctx.sftp = AsyncMock()
+    drova_poll.drova_service = drova_services()
+    drova_poll.drova_transition._patchers = [patcher]  # pylint: disable=W0212
+    drova_poll.drova_transition._protector = AsyncMock()  # pylint: disable=W0212
+    drova_poll.get_server_id = AsyncMock(return_value=str(SESSION_UUID_FAKE))
+    drova_poll.get_auth_token = AsyncMock(return_value=str(SESSION_UUID_FAKE))
+    fake_drova.session = SessionsResponse(
+        sessions=(
+            SessionsEntity(
+                uuid=SESSION_UUID_FAKE,
+                product_id=PRODUCT_UUID_DESKTOP,
+                client_id=CLIENT_UUID_FAKE,
+                created_on=datetime.now(),
+                status=StatusEnum.ACTIVE,
+                creator_ip="127.0.0.1",
+            ),
+        )
+    )
+    fake_drova.product = ProductInfo(product_id=PRODUCT_UUID_DESKTOP, use_default_desktop=True)
+    await drova_poll.one_poll(drova_poll.ctx.ssh)
+
+    # session end reboots host - not warmed on connection of reboot
+    fake_drova.session.sessions[0].status = StatusEnum.FINISHED
+    await drova_poll.one_poll(drova_poll.ctx.ssh)
+    patcher.on_session_end.assert_awaited_once()
+    patcher.on_warmup.assert_not_awaited()
+
+    # connection after reboot - latest session is still finished one, host idle
+    ssh = AsyncMock()
+    drova_poll.ctx.ssh = ssh
+    drova_poll._attach = AsyncMock(return_value=True)  # pylint: disable=W0212
+    for _ in range(2):
+        await drova_poll.one_poll(ssh)
+        await drova_poll.drova_transition._wait_warmup()  # pylint: disable=W0212
+    assert drova_poll.drova_transition.state == SessionState.SESSION_END
+    patcher.on_warmup.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_poll_active_to_none(fake_drova: FakeDrova, drova_services):
     ssh = AsyncMock()
     sftp = AsyncMock()
 
@@ -168,12 +223,13 @@ async def test_poll_active_to_none(fake_drova: FakeDrova):
     patcher.on_session_start = AsyncMock()
     patcher.on_session_active = AsyncMock()
     patcher.on_session_end = AsyncMock()
+    patcher.session_start_kills = MagicMock(return_value=[])
 
     config = Config(windows_host="127.0.0.1")
     drova_poll = DrovaPoll(config)
     drova_poll.ctx.ssh = ssh
     drova_poll.ctx.sftp = sftp
-    drova_poll.drova_service = DrovaService(fake_drova.faked_host)
+    drova_poll.drova_service = drova_services()
     drova_poll.drova_transition._patchers = [patcher]  # pylint: disable=W0212
     drova_poll.get_server_id = AsyncMock(return_value=str(SESSION_UUID_FAKE))
     drova_poll.get_auth_token = AsyncMock(return_value=str(SESSION_UUID_FAKE))
@@ -216,7 +272,7 @@ async def test_poll_active_to_none(fake_drova: FakeDrova):
 
 
 @pytest.mark.asyncio
-async def test_poll_full_not_a_desktop(fake_drova: FakeDrova):
+async def test_poll_full_not_a_desktop(fake_drova: FakeDrova, drova_services):
     ssh = AsyncMock()
     sftp = AsyncMock()
 
@@ -225,12 +281,13 @@ async def test_poll_full_not_a_desktop(fake_drova: FakeDrova):
     patcher.on_session_start = AsyncMock()
     patcher.on_session_active = AsyncMock()
     patcher.on_session_end = AsyncMock()
+    patcher.session_start_kills = MagicMock(return_value=[])
 
     config = Config(windows_host="127.0.0.1")
     drova_poll = DrovaPoll(config)
     drova_poll.ctx.ssh = ssh
     drova_poll.ctx.sftp = sftp
-    drova_poll.drova_service = DrovaService(fake_drova.faked_host)
+    drova_poll.drova_service = drova_services()
     drova_poll.drova_transition._patchers = [patcher]  # pylint: disable=W0212
     drova_poll.get_server_id = AsyncMock(return_value=str(SESSION_UUID_FAKE))
     drova_poll.get_auth_token = AsyncMock(return_value=str(SESSION_UUID_FAKE))
@@ -266,7 +323,120 @@ async def test_poll_full_not_a_desktop(fake_drova: FakeDrova):
 
 
 @pytest.mark.asyncio
-async def test_refresh_tokens_failure(fake_drova: FakeDrova):
+async def test_poll_product_once_per_session(fake_drova: FakeDrova, drova_services):
+    ssh = AsyncMock()
+    sftp = AsyncMock()
+
+    config = Config(windows_host="127.0.0.1")
+    drova_poll = DrovaPoll(config)
+    drova_poll.ctx.ssh = ssh
+    drova_poll.ctx.sftp = sftp
+    drova_poll.drova_service = drova_services()
+    drova_poll.drova_service.get_product_info = AsyncMock(wraps=drova_poll.drova_service.get_product_info)
+    drova_poll.drova_transition._patchers = []  # pylint: disable=W0212
+    drova_poll.get_server_id = AsyncMock(return_value=str(SESSION_UUID_FAKE))
+    drova_poll.get_auth_token = AsyncMock(return_value=str(SESSION_UUID_FAKE))
+
+    fake_drova.session = SessionsResponse(
+        sessions=(
+            SessionsEntity(
+                uuid=SESSION_UUID_FAKE,
+                product_id=PRODUCT_UUID_BG3,
+                client_id=CLIENT_UUID_FAKE,
+                created_on=datetime.now(),
+                status=StatusEnum.NEW,
+                creator_ip="127.0.0.1",
+            ),
+        )
+    )
+    for _ in range(3):
+        await drova_poll.one_poll(ssh)
+    drova_poll.drova_service.get_product_info.assert_awaited_once()
+
+    # next session with same product - from cache
+    fake_drova.session.sessions[0].uuid = CLIENT_UUID_FAKE
+    await drova_poll.one_poll(ssh)
+    drova_poll.drova_service.get_product_info.assert_awaited_once()
+    assert drova_poll.ctx.session.uuid == CLIENT_UUID_FAKE
+
+
+@pytest.mark.asyncio
+async def test_poll_restart_resume(fake_drova: FakeDrova, tmp_path, drova_services):
+    config = Config(windows_host="resume-host", cache_location=str(tmp_path))
+
+    def start_service() -> tuple[DrovaPoll, AsyncMock, dict[str, AsyncMock]]:
+        ssh = AsyncMock()
+        drova_poll = DrovaPoll(config)
+        drova_poll.ctx.ssh = ssh
+        drova_poll.ctx.sftp = AsyncMock()
+        drova_poll.drova_service = drova_services()
+        patchers = {name: type(name, (AsyncMock,), {})() for name in ("First", "Second")}
+        for patcher in patchers.values():
+            patcher.on_idle = AsyncMock()
+            patcher.on_session_start = AsyncMock()
+            patcher.on_session_active = AsyncMock()
+            patcher.on_session_end = AsyncMock()
+            patcher.session_start_kills = MagicMock(return_value=[])
+        drova_poll.drova_transition._patchers = list(patchers.values())  # pylint: disable=W0212
+        drova_poll.get_server_id = AsyncMock(return_value=str(SESSION_UUID_FAKE))
+        drova_poll.get_auth_token = AsyncMock(return_value=str(SESSION_UUID_FAKE))
+        return drova_poll, ssh, patchers
+
+    def commands(ssh: AsyncMock) -> list[str]:
+        return [call.args[0] for call in ssh.run.await_args_list]
+
+    fake_drova.session = SessionsResponse(
+        sessions=(
+            SessionsEntity(
+                uuid=SESSION_UUID_FAKE,
+                product_id=PRODUCT_UUID_DESKTOP,
+                client_id=CLIENT_UUID_FAKE,
+                created_on=datetime.now(),
+                status=StatusEnum.NEW,
+                creator_ip="127.0.0.1",
+            ),
+        )
+    )
+    fake_drova.product = ProductInfo(product_id=PRODUCT_UUID_DESKTOP, use_default_desktop=True)
+
+    # killed while session start - shadow mode entered, only first patcher done
+    journal = TransitionJournal(config.cache_file("transition_resume-host.json"))
+    journal.begin(SessionState.SESSION_START.name, str(SESSION_UUID_FAKE))
+    journal.finish("ShadowDefender")
+    journal.finish("First")
+
+    resumes = RESUME_LATENCY.count(host="resume-host")
+    drova_poll, ssh, patchers = start_service()
+    assert drova_poll.drova_transition.state == SessionState.SESSION_START
+    await drova_poll.one_poll(ssh)
+    patchers["First"].on_session_start.assert_not_awaited()
+    patchers["Second"].on_session_start.assert_awaited_once()
+    assert not any("CmdTool" in command for command in commands(ssh))
+    assert RESUME_LATENCY.count(host="resume-host") == resumes + 1
+
+    # restart while active session - nothing to do, no force close and reboot
+    fake_drova.session.sessions[0].status = StatusEnum.ACTIVE
+    await drova_poll.one_poll(ssh)
+    drova_poll, ssh, patchers = start_service()
+    assert drova_poll.drova_transition.state == SessionState.SESSION_ACTIVE
+    await drova_poll.one_poll(ssh)
+    for patcher in patchers.values():
+        patcher.on_session_active.assert_not_awaited()
+        patcher.on_session_end.assert_not_awaited()
+    assert not ssh.run.await_count
+    assert RESUME_LATENCY.percentile(100, host="resume-host") < 1
+
+    # session end after restart - one reboot
+    fake_drova.session.sessions[0].status = StatusEnum.FINISHED
+    await drova_poll.one_poll(ssh)
+    await drova_poll.one_poll(ssh)
+    for patcher in patchers.values():
+        patcher.on_session_end.assert_awaited_once()
+    assert len([command for command in commands(ssh) if command.startswith("shutdown")]) == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_tokens_failure(drova_services):
     ssh = AsyncMock()
     sftp = AsyncMock()
 
@@ -275,12 +445,13 @@ async def test_refresh_tokens_failure(fake_drova: FakeDrova):
     patcher.on_session_start = AsyncMock()
     patcher.on_session_active = AsyncMock()
     patcher.on_session_end = AsyncMock()
+    patcher.session_start_kills = MagicMock(return_value=[])
 
     config = Config(windows_host="127.0.0.1")
     drova_poll = DrovaPoll(config)
     drova_poll.ctx.ssh = ssh
     drova_poll.ctx.sftp = sftp
-    drova_poll.drova_service = DrovaService(fake_drova.faked_host)
+    drova_poll.drova_service = drova_services()
     drova_poll.drova_transition._patchers = []  # pylint: disable=W0212
 
     with pytest.raises(RebootRequired):
@@ -299,7 +470,7 @@ async def test_refresh_tokens_failure(fake_drova: FakeDrova):
 
 
 @pytest.mark.asyncio
-async def test_refresh_tokens(fake_drova: FakeDrova):
+async def test_refresh_tokens(drova_services):
     ssh = AsyncMock()
     sftp = AsyncMock()
 
@@ -308,12 +479,13 @@ async def test_refresh_tokens(fake_drova: FakeDrova):
     patcher.on_session_start = AsyncMock()
     patcher.on_session_active = AsyncMock()
     patcher.on_session_end = AsyncMock()
+    patcher.session_start_kills = MagicMock(return_value=[])
 
     config = Config(windows_host="127.0.0.1")
     drova_poll = DrovaPoll(config)
     drova_poll.ctx.ssh = ssh
     drova_poll.ctx.sftp = sftp
-    drova_poll.drova_service = DrovaService(fake_drova.faked_host)
+    drova_poll.drova_service = drova_services()
     drova_poll.drova_transition._patchers = []  # pylint: disable=W0212
 
     result = SSHCompletedProcess(
@@ -329,3 +501,128 @@ auth_token    REG_SZ    7a8b78f4-103d-1111-1111-111111111111
     await drova_poll.refresh_actual_tokens()
 
     assert drova_poll.ctx.ssh.run.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_wait_ready_token():
+    ssh = AsyncMock()
+    ssh.start_sftp_client = AsyncMock(return_value=AsyncMock())
+    no_token = SSHCompletedProcess(
+        returncode=0,
+        stdout=r"""
+HKEY_LOCAL_MACHINE\SOFTWARE\ITKey\Esme\servers\85dd80c4-adc1-1111-1111-111111111111
+""",
+    )
+    token = SSHCompletedProcess(
+        returncode=0,
+        stdout=r"""
+HKEY_LOCAL_MACHINE\SOFTWARE\ITKey\Esme\servers\85dd80c4-adc1-1111-1111-111111111111
+auth_token    REG_SZ    7a8b78f4-103d-1111-1111-111111111111
+""",
+    )
+    # esme service writes token some time after boot
+    ssh.run = AsyncMock(side_effect=[no_token, no_token, token])
+
+    drova_poll = DrovaPoll(Config(windows_host="127.0.0.1", remote_shell=False, reconnect_interval=0.01))
+    await drova_poll._wait_ready(ssh)  # pylint: disable=W0212
+
+    assert ssh.run.call_count == 3
+    assert drova_poll.ctx.sftp
+    assert await drova_poll.get_server_id() == "85dd80c4-adc1-1111-1111-111111111111"
+
+    # token never appear - reboot as before
+    ssh.run = AsyncMock(return_value=no_token)
+    drova_poll = DrovaPoll(
+        Config(windows_host="127.0.0.1", remote_shell=False, reconnect_interval=0.01, ready_timeout=0.05)
+    )
+    with pytest.raises(RebootRequired):
+        await drova_poll._wait_ready(ssh)  # pylint: disable=W0212
+
+
+@pytest.mark.asyncio
+async def test_wait_ready_persisted_token(fake_drova: FakeDrova, tmp_path, drova_services):
+    config = Config(
+        windows_host="persisted-host",
+        cache_location=str(tmp_path),
+        remote_shell=False,
+        reconnect_interval=0.01,
+        ready_timeout=0.05,
+    )
+    boot = SSHCompletedProcess(
+        returncode=0,
+        stdout="\r\nHKEY_LOCAL_MACHINE\\...\\PrefetchParameters\r\n    BootId    REG_DWORD    0x1a3\r\n",
+    )
+    token = SSHCompletedProcess(
+        returncode=0,
+        stdout=r"""
+HKEY_LOCAL_MACHINE\SOFTWARE\ITKey\Esme\servers\85dd80c4-adc1-1111-1111-111111111111
+auth_token    REG_SZ    7a8b78f4-103d-1111-1111-111111111111
+""",
+    )
+    previous = DrovaPoll(config)
+    previous.credentials.on_boot("0x1a3")
+    previous.credentials.set(
+        Credentials(server_id=str(SESSION_UUID_FAKE), auth_token="7a8b78f4-103d-1111-1111-111111111111")
+    )
+
+    # restart on same boot - esme not queried
+    ssh = AsyncMock()
+    ssh.start_sftp_client = AsyncMock(return_value=AsyncMock())
+    ssh.run = AsyncMock(return_value=boot)
+    drova_poll = DrovaPoll(config)
+    drova_poll.drova_service = drova_services()
+    drova_poll.drova_transition._patchers = []  # pylint: disable=W0212
+    await drova_poll._wait_ready(ssh)  # pylint: disable=W0212
+    assert ssh.run.call_count == 1
+    assert await drova_poll.get_server_id() == str(SESSION_UUID_FAKE)
+
+    cold_starts = COLD_START.count(host="persisted-host", credentials="persisted")
+    drova_poll._started_at = 0  # pylint: disable=W0212
+    await drova_poll.one_poll(ssh)
+    drova_poll._first_poll()  # pylint: disable=W0212
+    assert COLD_START.count(host="persisted-host", credentials="persisted") == cold_starts + 1
+
+    # token changed - rejected by api, queried on next poll
+    fake_drova.auth_token = "7a8b78f4-103d-2222-2222-222222222222"
+    with pytest.raises(AuthTokenRejected):
+        await drova_poll.one_poll(ssh)
+    drova_poll.credentials.invalidate()
+    ssh.run = AsyncMock(return_value=token)
+    await drova_poll.get_auth_token()
+    assert ssh.run.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_poll_metrics_port_taken(unused_tcp_port):
+    taken = await asyncio.start_server(lambda *_: None, "127.0.0.1", unused_tcp_port)
+    async with taken:
+        drova_poll = DrovaPoll(Config(windows_host="127.0.0.1", metrics_listen=f"127.0.0.1:{unused_tcp_port}"))
+        drova_poll.polling = AsyncMock()
+        await drova_poll.serve(True)
+    drova_poll.polling.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_attach_after_connection_lost():
+    def connection() -> tuple[MagicMock, FakeCmd]:
+        cmd = FakeCmd()
+        conn = MagicMock()
+        conn.create_process = AsyncMock(return_value=cmd)
+        conn.start_sftp_client = AsyncMock(return_value=AsyncMock())
+        return conn, cmd
+
+    drova_poll = DrovaPoll(Config(windows_host="127.0.0.1", remote_shell=True))
+    first, first_cmd = connection()
+    assert await drova_poll._attach(first)  # pylint: disable=W0212
+    assert drova_poll.ctx.shell and drova_poll.ctx.shell.is_running
+
+    # host rebooted - shell channel of first connection is dead
+    first_cmd.stdin.write.side_effect = BrokenPipeError("Channel not open for sending")
+    second, second_cmd = connection()
+    assert await drova_poll._attach(second)  # pylint: disable=W0212
+    assert drova_poll.ctx.ssh is second
+    assert drova_poll.ctx.shell and drova_poll.ctx.shell.is_running
+
+    await drova_poll.ctx.run("tasklist")
+    assert second_cmd.commands == ["tasklist"]
+    await drova_poll.ctx.shell.close()
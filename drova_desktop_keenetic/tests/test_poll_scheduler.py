@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+from ipaddress import IPv4Address
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.drova import (
+    CLIENT_UUID_FAKE,
+    PRODUCT_UUID_DESKTOP,
+    SESSION_UUID_FAKE,
+    SessionsEntity,
+    StatusEnum,
+)
+from drova_desktop_keenetic.common.drova_session_transition import SessionState
+from drova_desktop_keenetic.common.poll_scheduler import (
+    DETECTION_LATENCY,
+    PollScheduler,
+)
+
+CONFIG = Config(
+    windows_host="scheduler",
+    poll_interval_fast=0.5,
+    poll_interval_active=5,
+    poll_interval_idle=2,
+    poll_backoff_max=60,
+)
+
+
+def test_scheduler_by_state():
+    scheduler = PollScheduler(CONFIG)
+    assert scheduler.on_success(SessionState.NONE_SESSION) == 2
+    assert scheduler.on_success(SessionState.SESSION_START) == 0.5
+    assert scheduler.on_success(SessionState.SESSION_ACTIVE) == 5
+    assert scheduler.on_success(SessionState.SESSION_END) == 0.5
+
+    # after session idle polling slows down step by step
+    idle_delays = [scheduler.on_success(SessionState.NONE_SESSION) for _ in range(6)]
+    assert idle_delays[0] == 0.5
+    assert idle_delays == sorted(idle_delays)
+    assert idle_delays[-1] == 2
+
+
+def test_scheduler_idle_after_end(mocker):
+    clock = mocker.patch("drova_desktop_keenetic.common.poll_scheduler.time.monotonic", return_value=100.0)
+    scheduler = PollScheduler(CONFIG)
+    assert scheduler.on_success(SessionState.SESSION_ACTIVE) == 5
+
+    # just ended - fast polls for short window
+    assert scheduler.on_success(SessionState.SESSION_END) == 0.5
+    clock.return_value += PollScheduler.END_FAST_WINDOW - 1
+    assert scheduler.on_success(SessionState.SESSION_END) == 0.5
+
+    # ended session of idle host - slows down as no session
+    clock.return_value += 1
+    idle_delays = [scheduler.on_success(SessionState.SESSION_END) for _ in range(6)]
+    assert idle_delays[0] == 0.5
+    assert idle_delays == sorted(idle_delays)
+    assert idle_delays[-1] == 2
+
+
+def test_scheduler_backoff():
+    scheduler = PollScheduler(CONFIG)
+    delays = [scheduler.on_error() for _ in range(10)]
+    assert 1 <= delays[0] <= 2
+    assert 2 <= delays[1] <= 4
+    assert all(30 <= delay <= 60 for delay in delays[-3:])
+
+    # success reset backoff
+    scheduler.on_success(SessionState.NONE_SESSION)
+    assert scheduler.on_error() <= 2
+
+
+def test_scheduler_phase_offset():
+    offsets = {PollScheduler(Config(windows_host=f"192.168.0.{i}")).phase_offset() for i in range(10)}
+    assert len(offsets) > 1
+    assert all(0 <= offset < 2 for offset in offsets)
+    assert PollScheduler(CONFIG).phase_offset() == PollScheduler(CONFIG).phase_offset()
+
+
+def test_scheduler_detection_latency():
+    scheduler = PollScheduler(CONFIG)
+    session = SessionsEntity(
+        uuid=SESSION_UUID_FAKE,
+        product_id=PRODUCT_UUID_DESKTOP,
+        client_id=CLIENT_UUID_FAKE,
+        created_on=datetime.now() - timedelta(seconds=3),
+        status=StatusEnum.NEW,
+        creator_ip=IPv4Address("127.0.0.1"),
+    )
+    scheduler.on_session(session)
+    session.status = StatusEnum.HANDSHAKE
+    scheduler.on_session(session)
+
+    assert DETECTION_LATENCY.count(host="scheduler") == 1
+    assert 3 <= DETECTION_LATENCY.percentile(50, host="scheduler") < 4
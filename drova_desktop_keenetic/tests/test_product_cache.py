@@ -0,0 +1,67 @@
+from uuid import uuid4
+
+from drova_desktop_keenetic.common.drova import ProductInfo
+from drova_desktop_keenetic.common.product_cache import (
+    CACHE_HITS,
+    CACHE_MISSES,
+    ProductCache,
+)
+
+
+def test_product_cache_lru():
+    cache = ProductCache(max_len=2)
+    first, second, third = uuid4(), uuid4(), uuid4()
+
+    hits, misses = CACHE_HITS.value(), CACHE_MISSES.value()
+    assert cache.get(first) is None
+    cache.put(first, ProductInfo(product_id=first))
+    cache.put(second, ProductInfo(product_id=second))
+    assert cache.get(first)  # first is recently used now
+    cache.put(third, ProductInfo(product_id=third))
+
+    assert len(cache) == 2
+    assert cache.get(second) is None
+    assert cache.get(first)
+    assert CACHE_HITS.value() - hits == 2
+    assert CACHE_MISSES.value() - misses == 2
+
+
+def test_product_cache_ttl(mocker):
+    cache = ProductCache(ttl=10)
+    product_id = uuid4()
+    cache.put(product_id, ProductInfo(product_id=product_id))
+
+    time_mock = mocker.patch("drova_desktop_keenetic.common.product_cache.time.time")
+    time_mock.return_value = 10**10
+    assert cache.get(product_id) is None
+    assert len(cache) == 0
+
+
+def test_product_cache_persistent(tmp_path):
+    location = tmp_path / "cache" / "products.json"
+    product_id = uuid4()
+    ProductCache(location).put(product_id, ProductInfo(product_id=product_id, title="Baldur's Gate 3"))
+
+    product = ProductCache(location).get(product_id)
+    assert product
+    assert product.title == "Baldur's Gate 3"
+
+    location.write_text("{broken", encoding="utf8")
+    assert len(ProductCache(location)) == 0
+
+
+def test_product_cache_shared(tmp_path):
+    location = tmp_path / "products.json"
+    first, second, other = ProductCache(location), ProductCache(location), uuid4()
+    first_id, second_id = uuid4(), uuid4()
+    first.put(first_id, ProductInfo(product_id=first_id))
+    second.put(other, ProductInfo(product_id=other, title="old"))
+    first.put(other, ProductInfo(product_id=other, title="new"))
+
+    # last writer keeps products of other poller, newer product wins
+    second.put(second_id, ProductInfo(product_id=second_id))
+    shared = ProductCache(location)
+    assert len(shared) == 3
+    product = shared.get(other)
+    assert product and product.title == "new"
+    assert [path.name for path in tmp_path.iterdir()] == ["products.json"]
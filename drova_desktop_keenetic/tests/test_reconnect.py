@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import pytest
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.context import SessionHandlerContext
+from drova_desktop_keenetic.common.reconnect import (
+    READY_LATENCY,
+    REBOOT_TURNAROUND,
+    ReconnectManager,
+)
+
+
+def test_reconnect_backoff():
+    manager = ReconnectManager(Config(reconnect_interval=1, reconnect_backoff_max=8))
+    delays = [manager.delay() for _ in range(6)]
+
+    # jitter keep delay in upper half of exponential interval, never above max
+    for delay, expected in zip(delays, (1, 2, 4, 8, 8, 8)):
+        assert expected / 2 <= delay <= expected
+
+
+@pytest.mark.asyncio
+async def test_reconnect_wait_reachable(mocker, unused_tcp_port):
+    mocker.patch.object(ReconnectManager, "SSH_PORT", unused_tcp_port)
+    manager = ReconnectManager(Config(windows_host="127.0.0.1", reconnect_interval=0.01, reconnect_backoff_max=0.02))
+    stop_future = asyncio.get_event_loop().create_future()
+
+    assert not await manager.probe()
+
+    waiter = asyncio.create_task(manager.wait_reachable(stop_future))
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+
+    server = await asyncio.start_server(lambda _, writer: writer.close(), "127.0.0.1", unused_tcp_port)
+    async with server:
+        assert await asyncio.wait_for(waiter, 1)
+        assert READY_LATENCY.count(host="127.0.0.1", stage="tcp")
+
+    stop_future.set_result(True)
+    assert not await manager.wait_reachable(stop_future)
+
+
+def test_reconnect_turnaround():
+    config = Config(windows_host="turnaround")
+    manager = ReconnectManager(config)
+    ctx = SessionHandlerContext(config=config, ssh=None, sftp=None)
+
+    # still answering right after reboot command - not a turnaround
+    ctx.rebooted_at = time.monotonic()
+    manager.ready(ctx)
+    assert REBOOT_TURNAROUND.count(host="turnaround") == 0
+    assert ctx.rebooted_at is not None
+
+    manager.connection_lost()
+    manager.ready(ctx)
+    assert REBOOT_TURNAROUND.count(host="turnaround") == 1
+    assert ctx.rebooted_at is None
+
+
+def test_reconnect_deadline(mocker):
+    clock = mocker.patch("drova_desktop_keenetic.common.reconnect.time.monotonic", return_value=100.0)
+    config = Config(windows_host="deadline", ready_timeout=60)
+    manager = ReconnectManager(config)
+    manager.connection_lost()
+
+    # long session or reboot - ready deadline from host answering again, not from connection lost
+    clock.return_value = 1000.0
+    assert manager.deadline() == 1060.0
+    clock.return_value = 1030.0
+    assert manager.deadline() == 1060.0
+
+    manager.ready(SessionHandlerContext(config=config, ssh=None, sftp=None))
+    manager.connection_lost()
+    clock.return_value = 2000.0
+    assert manager.deadline() == 2060.0
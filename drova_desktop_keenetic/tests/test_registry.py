@@ -0,0 +1,158 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from asyncssh import SFTPAttrs, SFTPNoSuchFile, SSHCompletedProcess
+
+from drova_desktop_keenetic.common.commands import (
+    RegAdd,
+    RegDel,
+    RegDelActionRemoveAllValues,
+    RegDelActionRemoveValue,
+    RegImport,
+    RegQuery,
+    RegValueType,
+)
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.context import SessionHandlerContext
+from drova_desktop_keenetic.common.registry import RegistryBatch, RegistryPatch
+
+EXPLORER = r"HKCU\Software\Microsoft\Windows\CurrentVersion\Policies\Explorer"
+BATTLE_NET = r"HKEY_CURRENT_USER\SOFTWARE\Blizzard Entertainment\Battle.net\Identity"
+
+QUERY_OUTPUT = r"""
+HKEY_CURRENT_USER\Software\Microsoft\Windows\CurrentVersion\Policies\Explorer
+    NoClose    REG_DWORD    0x1
+    StartMenuLogoff    REG_DWORD    0x0
+
+HKEY_CURRENT_USER\Software\Microsoft\Windows\CurrentVersion\Policies\Explorer\DisallowRun
+
+HKEY_CURRENT_USER\Software\Microsoft\Windows\CurrentVersion\Policies\Explorer\DisallowRun
+    0    REG_SZ    C:\Windows\regedit.exe
+
+HKEY_CURRENT_USER\SOFTWARE\Blizzard Entertainment\Battle.net\Identity
+"""
+
+
+def fake_reg(*query_outputs: str) -> AsyncMock:
+    """ssh of host - reg query gives next output"""
+    outputs = iter(query_outputs)
+
+    async def run(command: str, **_) -> SSHCompletedProcess:
+        stdout = next(outputs) if command.startswith("reg query") else ""
+        return SSHCompletedProcess(returncode=0, stdout=stdout)
+
+    ssh = AsyncMock()
+    ssh.run = AsyncMock(side_effect=run)
+    return ssh
+
+
+def make_batch() -> RegistryBatch:
+    return RegistryBatch(
+        [
+            RegistryPatch(reg_directory=EXPLORER, value_name="NoClose", value_type=RegValueType.REG_DWORD, value=1),
+            RegistryPatch(
+                reg_directory=EXPLORER, value_name="StartMenuLogoff", value_type=RegValueType.REG_DWORD, value=1
+            ),
+            RegistryPatch(
+                reg_directory=EXPLORER + r"\DisallowRun",
+                value_name="0",
+                value_type=RegValueType.REG_SZ,
+                value=r"C:\Windows\regedit.exe",
+            ),
+            RegDel(key=BATTLE_NET, action=RegDelActionRemoveAllValues()),
+            RegDel(key=EXPLORER, action=RegDelActionRemoveValue(value_name="NoLogoff")),
+        ]
+    )
+
+
+def test_registry_batch_render():
+    assert make_batch().render().split("\r\n") == [
+        "Windows Registry Editor Version 5.00",
+        "",
+        r"[HKEY_CURRENT_USER\Software\Microsoft\Windows\CurrentVersion\Policies\Explorer]",
+        '"NoClose"=dword:00000001',
+        '"StartMenuLogoff"=dword:00000001',
+        "",
+        r"[HKEY_CURRENT_USER\Software\Microsoft\Windows\CurrentVersion\Policies\Explorer\DisallowRun]",
+        r'"0"="C:\\Windows\\regedit.exe"',
+        "",
+        r"[HKEY_CURRENT_USER\Software\Microsoft\Windows\CurrentVersion\Policies\Explorer]",
+        '"NoLogoff"=-',
+        "",
+    ]
+    assert make_batch().encode().startswith(b"\xff\xfeW\x00")
+
+
+def test_registry_batch_failures():
+    batch = make_batch()
+    failures = batch.find_failures(RegQuery.parse(QUERY_OUTPUT))
+    assert len(failures) == 1
+    assert isinstance(failures[0], RegistryPatch)
+    assert failures[0].value_name == "StartMenuLogoff"
+
+
+@pytest.mark.asyncio
+async def test_registry_batch_apply():
+    ssh = fake_reg(QUERY_OUTPUT, QUERY_OUTPUT)
+    sftp = MagicMock()
+    sftp.remove = AsyncMock()
+    remote_file = AsyncMock()
+    sftp.open.return_value.__aenter__.return_value = remote_file
+
+    ctx = SessionHandlerContext(config=Config(), ssh=ssh, sftp=sftp)
+    failures = await make_batch().apply(ctx)
+
+    # values of key removed without subkeys before import, not applied entry tried alone
+    commands = [call.args[0] for call in ssh.run.await_args_list]
+    assert len(commands) == 5
+    assert str(RegDel(key=BATTLE_NET, action=RegDelActionRemoveAllValues())) in commands[0]
+    assert commands[1].startswith("reg import")
+    assert commands[2].count("reg query") == 3
+    assert commands[3] == str(
+        RegAdd(EXPLORER, value_name="StartMenuLogoff", value_type=RegValueType.REG_DWORD, value=1)
+    )
+    assert commands[4].count("reg query") == 1
+    assert len(failures) == 1
+    remote_file.write.assert_awaited_once_with(make_batch().encode())
+    sftp.remove.assert_awaited_once()
+
+    # applied one by one - not failed
+    ssh = fake_reg(
+        QUERY_OUTPUT, QUERY_OUTPUT.replace("StartMenuLogoff    REG_DWORD    0x0", "StartMenuLogoff    REG_DWORD    0x1")
+    )
+    ctx = SessionHandlerContext(config=Config(), ssh=ssh, sftp=sftp)
+    assert not await make_batch().apply(ctx)
+
+    # only values removed - nothing imported
+    ssh = fake_reg("")
+    ctx = SessionHandlerContext(config=Config(), ssh=ssh, sftp=sftp)
+    assert not await RegistryBatch([RegDel(key=BATTLE_NET, action=RegDelActionRemoveAllValues())]).apply(ctx)
+    assert not any("reg import" in call.args[0] for call in ssh.run.await_args_list)
+
+
+@pytest.mark.asyncio
+async def test_registry_batch_staged():
+    ssh = fake_reg(QUERY_OUTPUT, QUERY_OUTPUT)
+    sftp = MagicMock()
+    sftp.remove = AsyncMock()
+    sftp.exists = AsyncMock(return_value=True)
+    sftp.stat = AsyncMock(side_effect=SFTPNoSuchFile("not found"))
+    remote_file = AsyncMock()
+    sftp.open.return_value.__aenter__.return_value = remote_file
+    ctx = SessionHandlerContext(config=Config(), ssh=ssh, sftp=sftp)
+
+    batch = make_batch()
+    await batch.stage(ctx)
+    remote_file.write.assert_awaited_once_with(make_batch().encode())
+
+    # file named by content - staged again only checked
+    sftp.stat = AsyncMock(return_value=SFTPAttrs(size=len(make_batch().encode())))
+    again = make_batch()
+    await again.stage(ctx)
+    assert again.remote_location == batch.remote_location
+    remote_file.write.assert_awaited_once()
+
+    # apply staged batch without upload
+    await batch.apply(ctx)
+    remote_file.write.assert_awaited_once()
+    assert ssh.run.await_args_list[1].args[0] == str(RegImport(batch.remote_location))
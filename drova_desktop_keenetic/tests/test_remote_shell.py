@@ -0,0 +1,162 @@
+import asyncio
+import re
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from asyncssh import ProcessError, SSHCompletedProcess
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.context import SessionHandlerContext
+from drova_desktop_keenetic.common.remote_shell import RemoteShell, RemoteShellClosed
+
+
+class _Stream:
+    def __init__(self):
+        self.queue: asyncio.Queue[str | None] = asyncio.Queue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        line = await self.queue.get()
+        if line is None:
+            raise StopAsyncIteration
+        return line
+
+
+class FakeCmd:
+    """cmd.exe emulation enough for RemoteShell markers: echo, `(command) < nul` and %errorlevel%"""
+
+    r_echo = re.compile(r"^echo (?P<out>\S+)( %errorlevel%)?& echo (?P<err>\S+) 1>&2$")
+    r_command = re.compile(r"^\((?P<command>.*)\) < nul$")
+
+    def __init__(self):
+        self.stdout = _Stream()
+        self.stderr = _Stream()
+        self.stdin = MagicMock()
+        self.stdin.write.side_effect = self._write
+        self.commands: list[str] = []
+        self.errorlevel = 0
+        self.hung = False
+
+    def _write(self, data: str) -> None:
+        for line in filter(None, data.split("\r\n")):
+            if self.hung:
+                continue
+            if line == "exit":
+                self.close()
+            elif match := self.r_echo.match(line):
+                out = match["out"] + (f" {self.errorlevel}" if match.group(2) else "")
+                self.stdout.queue.put_nowait(out + "\n")
+                self.stderr.queue.put_nowait(match["err"] + "\n")
+            elif match := self.r_command.match(line):
+                self._execute(match["command"])
+
+    def _execute(self, command: str) -> None:
+        self.commands.append(command)
+        if command.startswith("hang"):
+            self.hung = True
+            return
+        if command.startswith("fail"):
+            self.errorlevel = 1
+            self.stderr.queue.put_nowait(f"{command} failed\n")
+            return
+        self.errorlevel = 0
+        self.stdout.queue.put_nowait(f"{command} done\n")
+
+    def close(self) -> None:
+        self.stdout.queue.put_nowait(None)
+        self.stderr.queue.put_nowait(None)
+
+
+async def make_shell(timeout: float | None = None) -> tuple[RemoteShell, FakeCmd]:
+    cmd = FakeCmd()
+    conn = MagicMock()
+    conn.create_process = AsyncMock(return_value=cmd)
+    shell = RemoteShell(conn, timeout=timeout)
+    await shell.start()
+    return shell, cmd
+
+
+@pytest.mark.asyncio
+async def test_remote_shell_run():
+    shell, cmd = await make_shell()
+
+    result = await shell.run("tasklist")
+    assert result.returncode == 0
+    assert result.stdout == "tasklist done\n"
+    assert result.stderr == ""
+
+    result = await shell.run("fail me")
+    assert result.returncode == 1
+    assert result.stdout == ""
+    assert result.stderr == "fail me failed\n"
+
+    with pytest.raises(ProcessError):
+        await shell.run("fail again", check=True)
+
+    assert cmd.commands == ["tasklist", "fail me", "fail again"]
+    await shell.close()
+    assert not shell.is_running
+
+
+@pytest.mark.asyncio
+async def test_remote_shell_pipelined():
+    shell, cmd = await make_shell()
+
+    results = await shell.run_many([f"command {i}" for i in range(10)])
+    assert [result.stdout for result in results] == [f"command {i} done\n" for i in range(10)]
+    assert len(cmd.commands) == 10
+    await shell.close()
+
+
+@pytest.mark.asyncio
+async def test_remote_shell_closed_fallback():
+    shell, cmd = await make_shell()
+    cmd.close()
+    await asyncio.sleep(0)
+
+    with pytest.raises(RemoteShellClosed):
+        await shell.run("tasklist")
+
+    ssh = MagicMock()
+    ssh.run = AsyncMock(
+        return_value=SSHCompletedProcess(
+            env=None, command="tasklist", subsystem=None, exit_status=0, returncode=0, stdout="", stderr=""
+        )
+    )
+    ctx = SessionHandlerContext(config=Config(), ssh=ssh, sftp=None, shell=shell)
+    await ctx.run("tasklist")
+    ssh.run.assert_awaited_once_with("tasklist", check=False)
+
+
+@pytest.mark.asyncio
+async def test_remote_shell_close_lost_connection():
+    shell, cmd = await make_shell()
+    # connection lost - readers not noticed yet, channel refuses writes
+    cmd.stdin.write.side_effect = BrokenPipeError("Channel not open for sending")
+    await shell.close()
+    assert not shell.is_running
+
+
+@pytest.mark.asyncio
+async def test_remote_shell_timeout():
+    shell, cmd = await make_shell(timeout=0.05)
+    assert (await shell.run("tasklist")).stdout == "tasklist done\n"
+
+    # hung command blocks cmd.exe - shell closed, pipelined command fails too
+    hung, pipelined = shell.run("hang"), shell.run("tasklist")
+    results = await asyncio.gather(hung, pipelined, return_exceptions=True)
+    assert all(isinstance(result, RemoteShellClosed) for result in results)
+    assert cmd.commands == ["tasklist", "hang"]
+    assert not shell.is_running
+
+    ssh = MagicMock()
+    ssh.run = AsyncMock(
+        return_value=SSHCompletedProcess(
+            env=None, command="tasklist", subsystem=None, exit_status=0, returncode=0, stdout="", stderr=""
+        )
+    )
+    ctx = SessionHandlerContext(config=Config(), ssh=ssh, sftp=None, shell=shell)
+    await ctx.run("tasklist")
+    ssh.run.assert_awaited_once_with("tasklist", check=False)
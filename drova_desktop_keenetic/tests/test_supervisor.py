@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from drova_desktop_keenetic.common.config import Config
+from drova_desktop_keenetic.common.drova_supervisor import (
+    DrovaSupervisor,
+    DuplicateHost,
+    discover_env_files,
+)
+
+
+def test_config_from_env_file(tmp_path):
+    env_file = tmp_path / "i9_3080ti.env"
+    env_file.write_text("WINDOWS_HOST=192.168.0.11\nWINDOWS_PASSWORD=secret\n", encoding="utf8")
+
+    config = Config.from_env_file(env_file)
+    assert config.windows_host == "192.168.0.11"
+    assert config.windows_password == "secret"
+    assert config.windows_login == Config().windows_login
+
+
+def test_discover_env_files(tmp_path):
+    hosts = tmp_path / "hosts"
+    hosts.mkdir()
+    (hosts / "b.env").write_text("WINDOWS_HOST=b", encoding="utf8")
+    (hosts / "a.env").write_text("WINDOWS_HOST=a", encoding="utf8")
+    (hosts / "readme.txt").write_text("", encoding="utf8")
+    single = tmp_path / "c.env"
+
+    assert discover_env_files([hosts, single]) == [hosts / "a.env", hosts / "b.env", single]
+
+
+@pytest.mark.asyncio
+async def test_supervisor_duplicate_host():
+    with pytest.raises(DuplicateHost):
+        DrovaSupervisor([Config(windows_host="a"), Config(windows_host="a")])
+
+
+@pytest.mark.asyncio
+async def test_supervisor_isolation(mocker):
+    mocker.patch.object(DrovaSupervisor, "RESTART_DELAY", 0)
+    hung = asyncio.Event()
+    calls: dict[str, int] = {"failed": 0, "hung": 0}
+
+    async def polling(self):
+        host = self.ctx.config.windows_host
+        calls[host] += 1
+        if host == "failed":
+            raise RuntimeError("host failed")
+        await hung.wait()
+
+    mocker.patch("drova_desktop_keenetic.common.drova_supervisor.DrovaPoll.polling", polling)
+
+    supervisor = DrovaSupervisor([Config(windows_host="failed"), Config(windows_host="hung")])
+    assert not supervisor.polls
+    task = asyncio.create_task(supervisor.serve())
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    # failed host restarted while other still polling
+    assert calls["failed"] > 1
+    assert calls["hung"] == 1
+    assert supervisor.polls["failed"].drova_service is supervisor.polls["hung"].drova_service
+
+    supervisor.stop_future.set_result(True)
+    hung.set()
+    await asyncio.wait_for(task, 1)